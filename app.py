@@ -1,91 +1,198 @@
+"""Streamlit front end: `streamlit run app.py`.
+
+Streamlit re-executes this script on every interaction, so the work is kept
+out of the full run. Settings and routers are cached resources, created once
+per process. The sidebar and the chat area are fragments: editing a setting
+reruns only the sidebar, and sending a message reruns only the chat area,
+which redraws just the turns added since the last full run. Messages drawn by
+a full run stay on the page untouched. A full run draws at most FOLD_AFTER
+messages as chat; older ones are rendered to HTML once per fold of FOLD_AFTER
+and stay hidden behind a toggle, so any rerun costs the same however long
+the conversation is (python -m bench.streamlit_rerun measures it).
+"""
 import os
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
 import streamlit as st
 from dotenv import load_dotenv
-from openai import OpenAI
-
-load_dotenv()
-
-API_KEY = (
-	os.getenv("OPENROUTER_API_KEY")
-	or os.getenv("DEEPSEEK_API_KEY")
-	or os.getenv("OPENAI_API_KEY")
-	or ""
-).strip()
-BASE_URL = (
-	os.getenv("OPENROUTER_BASE_URL")
-	or os.getenv("DEEPSEEK_BASE_URL")
-	or "https://openrouter.ai/api/v1"
-).strip()
-DEFAULT_MODEL = (
-	os.getenv("OPENROUTER_MODEL")
-	or os.getenv("DEEPSEEK_MODEL")
-	or os.getenv("OPENAI_MODEL")
-	or "nousresearch/deephermes-3-llama-3-8b-preview:free"
-)
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+import completions
+import warmup
+from cache import shared_cache
+from context import ContextWindow
+from output import MarkdownBlocks, StreamWriter
+from providers import default_settings
+from render import render_markdown
+from router import Router, default_router, router_for
+
+SYSTEM_PROMPT = "You are a helpful, concise assistant."
+# Turns the chat fragment redraws before a full run folds them into the static history
+FOLD_AFTER = 20
+
+
+@st.cache_resource(show_spinner=False)
+def load_settings() -> Tuple[str, str, str]:
+	load_dotenv()
+	return default_settings()
+
+
+@st.cache_resource(show_spinner=False)
+def get_router(api_key: str, base_url: str) -> Router:
+	# Sidebar defaults use every configured provider; edited values get their own endpoint
+	default_key, default_url, _ = load_settings()
+	if (api_key, base_url) == (default_key, default_url):
+		return default_router()
+	return router_for(api_key, base_url)
+
+
+def reset_conversation() -> None:
+	st.session_state.messages: List[Dict[str, str]] = [{"role": "system", "content": SYSTEM_PROMPT}]
+	st.session_state.drawn = 0
+	# Pre-rendered HTML of each full fold of FOLD_AFTER messages, oldest first
+	st.session_state.folds: List[str] = []
+	st.session_state.pop("last_stats", None)
+
+
+def show_message(m: Dict[str, str]) -> None:
+	if m["role"] in ("user", "assistant"):
+		with st.chat_message(m["role"]):
+			st.markdown(m["content"])
+
+
+def fold_html(messages: List[Dict[str, str]]) -> str:
+	# Escapes raw HTML and drops unsafe links, like the web front end
+	return "\n".join(
+		f'<div style="margin: 0.75rem 0"><strong>{"You" if m["role"] == "user" else "Assistant"}</strong>{render_markdown(m["content"])}</div>'
+		for m in messages if m["role"] in ("user", "assistant")
+	)
+
+
+def show_history() -> None:
+	messages = st.session_state.messages
+	# Folds are rendered to HTML once and hidden by default; the newest 1 to FOLD_AFTER messages are drawn as chat
+	folded = max(0, len(messages) - 2) // FOLD_AFTER * FOLD_AFTER
+	folds = st.session_state.folds
+	while len(folds) * FOLD_AFTER < folded:
+		start = 1 + len(folds) * FOLD_AFTER
+		folds.append(fold_html(messages[start:start + FOLD_AFTER]))
+	if folds and st.toggle(f"Show {folded} earlier messages", key="show_earlier"):
+		for block in folds:
+			st.html(block)
+	for m in messages[1 + folded:]:
+		show_message(m)
+	st.session_state.drawn = len(messages)
+
+
+@st.fragment
+def settings() -> None:
+	api_key, base_url, model = load_settings()
+	st.header("Settings")
+	api_key_input = st.text_input("API Key", value=api_key, type="password", key="api_key")
+	base_url_input = st.text_input("Base URL", value=base_url, key="base_url")
+	model_input = st.text_input("Model", value=model, key="model")
+	if api_key_input and model_input:
+		# Checked against the provider's model catalog (see warmup.py), which may mean a
+		# /models request, so only when the selection changes rather than on every rerun
+		selection = (api_key_input, base_url_input, model_input)
+		if st.session_state.get("model_checked") != selection:
+			st.session_state.model_problem = warmup.check_model(get_router(api_key_input, base_url_input), model_input)
+			st.session_state.model_checked = selection
+		if st.session_state.model_problem:
+			st.warning(st.session_state.model_problem)
+	st.text_input("HTTP-Referer (optional)", value=os.getenv("OPENROUTER_SITE_URL", ""), key="referer")
+	st.text_input("X-Title (optional)", value=os.getenv("OPENROUTER_SITE_NAME", ""), key="title")
+	if st.button("Clear Conversation"):
+		reset_conversation()
+		st.rerun()
+	# The chat area only exists once there is a key, and it is outside this fragment
+	if bool(api_key_input) != st.session_state.get("has_key", bool(api_key_input)):
+		st.session_state.has_key = bool(api_key_input)
+		st.rerun()
+
+
+@st.fragment
+def chat() -> None:
+	messages = st.session_state.messages
+	for m in messages[st.session_state.drawn:]:
+		show_message(m)
+
+	# Written from the fragment so that sending reruns only the fragment; st.bottom keeps it pinned
+	prompt = st.bottom.chat_input("Type a message")
+	if prompt:
+		model = st.session_state.model
+		router = get_router(st.session_state.api_key, st.session_state.base_url)
+		extra_headers: Dict[str, str] = {}
+		if st.session_state.referer:
+			extra_headers["HTTP-Referer"] = st.session_state.referer
+		if st.session_state.title:
+			extra_headers["X-Title"] = st.session_state.title
+
+		messages.append({"role": "user", "content": prompt})
+		show_message(messages[-1])
+
+		with st.chat_message("assistant"):
+			# Finished Markdown blocks get their own element; only the open tail is redrawn
+			reply = st.empty()
+			body = reply.container()
+			finished_area = body.container()
+			placeholder = body.empty()
+			blocks = MarkdownBlocks()
+
+			def show(chunk: str) -> None:
+				finished = blocks.feed(chunk)
+				if finished:
+					finished_area.markdown(finished)
+				placeholder.markdown(blocks.tail)
+
+			# Deadline flushes run on a timer thread, which needs this run's context to draw
+			writer = StreamWriter(show, on_thread=add_script_run_ctx)
+			outgoing, context_stats = st.session_state.context_window.fit(messages, model)
+			try:
+				with writer:
+					for content_piece in completions.stream(router, model, outgoing, extra_headers):
+						writer.write(content_piece)
+				assistant_text = writer.text()
+			except Exception as exc:
+				assistant_text = f"[error] {exc}"
+				reply.markdown(assistant_text)
+			except BaseException:
+				# Streamlit's Stop button (or a new message) ends the script run by raising here;
+				# the upstream stream is closed on the way out, and the partial answer is kept
+				messages.append({"role": "assistant", "content": writer.text() or "[stopped]"})
+				raise
+
+		messages.append({"role": "assistant", "content": assistant_text})
+		stats = (
+			f"Context: {context_stats.tokens_after}/{context_stats.tokens_before} tokens sent "
+			f"({context_stats.messages_after}/{context_stats.messages_before} messages)"
+		)
+		if shared_cache():
+			stats += f" · Cache: {shared_cache().stats()}"
+		st.session_state.last_stats = stats
+		if len(messages) - st.session_state.drawn > FOLD_AFTER:
+			st.rerun()
+	if "last_stats" in st.session_state:
+		st.caption(st.session_state.last_stats)
+
 
 st.set_page_config(page_title="AI Chat", page_icon="💬", layout="centered")
 st.title("AI Chat UI 💬")
 
+if "messages" not in st.session_state:
+	reset_conversation()
+
+if "context_window" not in st.session_state:
+	st.session_state.context_window = ContextWindow.from_env()
+
 with st.sidebar:
-	st.header("Settings")
-	api_key_input = st.text_input("API Key", value=API_KEY, type="password")
-	base_url_input = st.text_input("Base URL", value=BASE_URL)
-	model_input = st.text_input("Model", value=DEFAULT_MODEL)
-	referer = st.text_input("HTTP-Referer (optional)", value=os.getenv("OPENROUTER_SITE_URL", ""))
-	title = st.text_input("X-Title (optional)", value=os.getenv("OPENROUTER_SITE_NAME", ""))
-	clear = st.button("Clear Conversation")
-
-if clear or "messages" not in st.session_state:
-	st.session_state.messages: List[Dict[str, str]] = [
-		{"role": "system", "content": "You are a helpful, concise assistant."}
-	]
-
-if not api_key_input:
+	settings()
+
+st.session_state.has_key = bool(st.session_state.api_key)
+if not st.session_state.has_key:
 	st.info("Enter an API key in the sidebar to begin.")
 	st.stop()
 
-client = OpenAI(api_key=api_key_input, base_url=base_url_input)
-extra_headers: Dict[str, str] = {}
-if referer:
-	extra_headers["HTTP-Referer"] = referer
-if title:
-	extra_headers["X-Title"] = title
-
-for m in st.session_state.messages:
-	if m["role"] == "user":
-		with st.chat_message("user"):
-			st.markdown(m["content"])
-	elif m["role"] == "assistant":
-		with st.chat_message("assistant"):
-			st.markdown(m["content"])
+show_history()
 
-prompt = st.chat_input("Type a message")
-if prompt:
-	st.session_state.messages.append({"role": "user", "content": prompt})
-	with st.chat_message("user"):
-		st.markdown(prompt)
-
-	with st.chat_message("assistant"):
-		placeholder = st.empty()
-		accum = []
-		try:
-			stream = client.chat.completions.create(
-				model=model_input,
-				messages=st.session_state.messages,
-				stream=True,
-				**({"extra_headers": extra_headers} if extra_headers else {}),
-			)
-			for event in stream:
-				delta = event.choices[0].delta
-				content_piece = getattr(delta, "content", None)
-				if content_piece:
-					accum.append(content_piece)
-					placeholder.markdown("".join(accum))
-			assistant_text = "".join(accum)
-		except Exception as exc:
-			assistant_text = f"[error] {exc}"
-			placeholder.markdown(assistant_text)
-
-	st.session_state.messages.append({"role": "assistant", "content": assistant_text})
+chat()
@@ -0,0 +1,315 @@
+"""ASGI serving mode for the potato.ai web app.
+
+Run with either of:
+
+	uvicorn asgi:app --host 0.0.0.0 --port $PORT
+	gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+The chat routes (/send_json, /send_stream) are served natively on the event
+loop with AsyncOpenAI, so a request that is waiting on the upstream model costs
+a coroutine instead of a worker. Every other route is delegated to the Flask
+app in web.py, which shares the same signed session cookie.
+
+Concurrency limit and backpressure (per process):
+
+	ASGI_MAX_CONCURRENCY  upstream completions in flight at once (default 256)
+	ASGI_MAX_QUEUE        chat requests allowed to wait for a slot (default 512)
+
+Once both are full, chat requests are rejected immediately with 503 and a
+Retry-After header instead of piling up unbounded.
+
+A client that disconnects mid-reply (closed tab, the Stop button) cancels the
+task relaying it, which closes the upstream stream; the partial answer is
+stored.
+"""
+import asyncio
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+from flask.sessions import SecureCookieSession
+from werkzeug.http import dump_cookie, parse_cookie
+
+import completions
+import warmup
+from clients import aclose_all
+from context import ContextStats
+from ratelimit import as_user
+from render import IncrementalRenderer, render_markdown
+from web import DEFAULT_MODEL, STOPPED_REPLY, app as flask_app, ensure_conversation, get_headers, ndjson, prompt_messages, router, store
+
+MAX_CONCURRENCY = int(os.getenv("ASGI_MAX_CONCURRENCY", "256"))
+MAX_QUEUE = int(os.getenv("ASGI_MAX_QUEUE", "512"))
+MAX_BODY_BYTES = 64 * 1024
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+flask_asgi = WsgiToAsgi(flask_app)
+
+
+class Overloaded(Exception):
+	pass
+
+
+class ConcurrencyGate:
+	def __init__(self, limit: int, queue: int) -> None:
+		self.limit = limit
+		self.queue = queue
+		self.active = 0
+		self.waiting = 0
+		self._semaphore: Optional[asyncio.Semaphore] = None
+
+	async def __aenter__(self) -> "ConcurrencyGate":
+		if self._semaphore is None:
+			self._semaphore = asyncio.Semaphore(self.limit)
+		if self._semaphore.locked() and self.waiting >= self.queue:
+			raise Overloaded()
+		self.waiting += 1
+		try:
+			await self._semaphore.acquire()
+		finally:
+			self.waiting -= 1
+		self.active += 1
+		return self
+
+	async def __aexit__(self, *exc_info: Any) -> None:
+		self.active -= 1
+		self._semaphore.release()
+
+
+gate = ConcurrencyGate(MAX_CONCURRENCY, MAX_QUEUE)
+
+
+def load_session(scope: Scope) -> SecureCookieSession:
+	interface = flask_app.session_interface
+	serializer = interface.get_signing_serializer(flask_app)
+	cookie_name = flask_app.config["SESSION_COOKIE_NAME"]
+	for name, value in scope.get("headers", []):
+		if name != b"cookie":
+			continue
+		raw = parse_cookie(value.decode("latin-1")).get(cookie_name)
+		if not raw:
+			continue
+		try:
+			max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+			return SecureCookieSession(serializer.loads(raw, max_age=max_age))
+		except Exception:
+			break
+	return SecureCookieSession()
+
+
+def session_cookie(session: SecureCookieSession) -> Tuple[bytes, bytes]:
+	interface = flask_app.session_interface
+	value = interface.get_signing_serializer(flask_app).dumps(dict(session))
+	cookie = dump_cookie(
+		flask_app.config["SESSION_COOKIE_NAME"],
+		value,
+		expires=interface.get_expiration_time(flask_app, session),
+		path=interface.get_cookie_path(flask_app),
+		domain=interface.get_cookie_domain(flask_app),
+		secure=interface.get_cookie_secure(flask_app),
+		httponly=interface.get_cookie_httponly(flask_app),
+		samesite=interface.get_cookie_samesite(flask_app),
+	)
+	return b"set-cookie", cookie.encode("latin-1")
+
+
+async def open_conversation(session: SecureCookieSession, prompt: str, model: str) -> Tuple[str, str, List[Dict[str, str]], ContextStats]:
+	# Store calls are blocking I/O, keep them off the event loop
+	conversation_id = await asyncio.to_thread(ensure_conversation, session)
+	user_html = render_markdown(prompt)
+	await asyncio.to_thread(store.append, conversation_id, "user", prompt, user_html)
+	messages, context_stats = await asyncio.to_thread(prompt_messages, conversation_id, model)
+	return conversation_id, user_html, messages, context_stats
+
+
+def cookie_headers(session: SecureCookieSession) -> List[Tuple[bytes, bytes]]:
+	# Only new conversations change the cookie
+	return [session_cookie(session)] if session.modified else []
+
+
+async def read_json(receive: Receive) -> Dict[str, Any]:
+	body = b""
+	while True:
+		message = await receive()
+		body += message.get("body", b"")
+		if len(body) > MAX_BODY_BYTES or not message.get("more_body"):
+			break
+	try:
+		payload = json.loads(body or b"{}")
+	except ValueError:
+		return {}
+	return payload if isinstance(payload, dict) else {}
+
+
+async def until_disconnected(receive: Receive) -> None:
+	# The request body has been read, so the next message is the disconnect
+	while (await receive())["type"] != "http.disconnect":
+		pass
+
+
+async def cancel_on_disconnect(receive: Receive, work: Awaitable[None]) -> bool:
+	"""Run `work`, cancelling it if the client disconnects first; True if it was cancelled."""
+	task = asyncio.ensure_future(work)
+	watcher = asyncio.ensure_future(until_disconnected(receive))
+	try:
+		await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+	finally:
+		watcher.cancel()
+		if not task.done():
+			task.cancel()
+	try:
+		await task
+	except asyncio.CancelledError:
+		return True
+	return False
+
+
+async def send_body(send: Send, status: int, body: bytes, content_type: bytes, extra: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+	headers = [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]
+	await send({"type": "http.response.start", "status": status, "headers": headers + (extra or [])})
+	await send({"type": "http.response.body", "body": body})
+
+
+async def send_json_response(send: Send, payload: Dict[str, Any], extra: Optional[List[Tuple[bytes, bytes]]] = None) -> None:
+	await send_body(send, 200, json.dumps(payload).encode(), b"application/json", extra)
+
+
+async def send_overloaded(send: Send, conversation_id: str, stream: bool = False) -> None:
+	assistant_text = "[busy] Server is at capacity, please retry"
+	# Keep user/assistant turns paired in the stored history
+	await asyncio.to_thread(store.append, conversation_id, "assistant", assistant_text, render_markdown(assistant_text))
+	if stream:
+		body, content_type = ndjson({"error": assistant_text}).encode(), b"application/x-ndjson"
+	else:
+		body, content_type = json.dumps({"assistant": assistant_text}).encode(), b"application/json"
+	await send_body(send, 503, body, content_type, [(b"retry-after", b"1")])
+
+
+async def send_json(scope: Scope, receive: Receive, send: Send) -> None:
+	session = load_session(scope)
+	payload = await read_json(receive)
+	if not session.get("unlocked", False):
+		return await send_json_response(send, {"assistant": "[locked] Please unlock to chat"})
+	if not router.providers:
+		return await send_json_response(send, {"assistant": "[error] Missing API key on server"})
+	prompt = (payload.get("prompt") or "").strip()
+	if not prompt:
+		return await send_json_response(send, {"assistant": ""})
+	model = session.get("model") or DEFAULT_MODEL
+	conversation_id, user_html, messages, context_stats = await open_conversation(session, prompt, model)
+	headers = get_headers()
+	pieces: List[str] = []
+
+	async def collect() -> None:
+		# Streamed and joined, so a disconnect can close the upstream mid-answer
+		with as_user(conversation_id):
+			async for content_piece in completions.astream(router, model, messages, headers):
+				pieces.append(content_piece)
+
+	stopped = False
+	try:
+		async with gate:
+			stopped = await cancel_on_disconnect(receive, collect())
+		assistant_text = "".join(pieces) or (STOPPED_REPLY if stopped else "")
+	except Overloaded:
+		return await send_overloaded(send, conversation_id)
+	except Exception as exc:
+		assistant_text = f"[error] {exc}"
+	html = await asyncio.to_thread(render_markdown, assistant_text)
+	await asyncio.to_thread(store.append, conversation_id, "assistant", assistant_text, html)
+	if stopped:
+		return
+	reply = {"assistant": assistant_text, "html": html, "user_html": user_html, "context": context_stats.as_dict()}
+	await send_json_response(send, reply, cookie_headers(session))
+
+
+async def send_stream(scope: Scope, receive: Receive, send: Send) -> None:
+	session = load_session(scope)
+	payload = await read_json(receive)
+	ndjson_type = b"application/x-ndjson"
+	if not session.get("unlocked", False):
+		return await send_body(send, 200, ndjson({"error": "[locked] Please unlock to chat"}).encode(), ndjson_type)
+	if not router.providers:
+		return await send_body(send, 200, ndjson({"error": "[error] Missing API key on server"}).encode(), ndjson_type)
+	prompt = (payload.get("prompt") or "").strip()
+	if not prompt:
+		return await send_body(send, 200, b"", ndjson_type)
+	model = session.get("model") or DEFAULT_MODEL
+	conversation_id, user_html, messages, context_stats = await open_conversation(session, prompt, model)
+	headers = get_headers()
+	renderer = IncrementalRenderer()
+
+	async def emit(event: Dict[str, object]) -> None:
+		await send({"type": "http.response.body", "body": ndjson(event).encode(), "more_body": True})
+
+	async def relay() -> None:
+		with as_user(conversation_id):
+			async for content_piece in completions.astream(router, model, messages, headers):
+				await emit({"delta": content_piece, **renderer.feed(content_piece)})
+
+	try:
+		async with gate:
+			stopped = True
+			try:
+				await send({
+					"type": "http.response.start",
+					"status": 200,
+					"headers": [
+						(b"content-type", ndjson_type),
+						(b"cache-control", b"no-cache"),
+						(b"x-accel-buffering", b"no"),
+					] + cookie_headers(session),
+				})
+				await emit({"context": context_stats.as_dict(), "user_html": user_html})
+				try:
+					stopped = await cancel_on_disconnect(receive, relay())
+				except Exception as exc:
+					stopped = False
+					error = f"[error] {exc}"
+					await emit({"error": error, **renderer.feed(("\n" if renderer.text else "") + error)})
+			finally:
+				# Also reached when a write fails or the task is cancelled, so the user turn always gets a reply
+				text = renderer.text or (STOPPED_REPLY if stopped else "")
+				html = await asyncio.to_thread(render_markdown, text)
+				await asyncio.to_thread(store.append, conversation_id, "assistant", text, html)
+			if stopped:
+				# Nobody is listening any more
+				return
+			await emit(renderer.finish())
+			await emit({"done": True})
+			await send({"type": "http.response.body", "body": b""})
+	except Overloaded:
+		await send_overloaded(send, conversation_id, stream=True)
+
+
+ROUTES = {
+	("POST", "/send_json"): send_json,
+	("POST", "/send_stream"): send_stream,
+}
+
+
+async def lifespan(receive: Receive, send: Send) -> None:
+	while True:
+		message = await receive()
+		if message["type"] == "lifespan.startup":
+			# In the background: /ready answers 503 until it is done
+			warmup.astart(router, DEFAULT_MODEL)
+			await send({"type": "lifespan.startup.complete"})
+		elif message["type"] == "lifespan.shutdown":
+			await aclose_all()
+			await send({"type": "lifespan.shutdown.complete"})
+			return
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+	if scope["type"] == "lifespan":
+		return await lifespan(receive, send)
+	if scope["type"] == "http":
+		handler = ROUTES.get((scope["method"], scope["path"]))
+		if handler:
+			return await handler(scope, receive, send)
+	await flask_asgi(scope, receive, send)
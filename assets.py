@@ -0,0 +1,124 @@
+"""Fingerprinted static assets for web.py.
+
+Files under static/ are read once at startup, hashed, and pre-compressed
+(gzip, plus brotli when the brotli package is installed). Templates link to
+/assets/<name>.<hash>.<ext> through asset_url(), so responses can be cached
+for a year and a deploy that changes a file changes its URL. Generated files
+(e.g. the code highlighting stylesheet) are registered with add().
+
+The encoding is picked from Accept-Encoding, q-values included; each encoding
+has its own ETag, since the bytes differ.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+# Preferred first when the client accepts several equally
+ENCODINGS = ("br", "gzip")
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+URL_PREFIX = "/assets/"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+	"""Accept-Encoding as {coding: q}; a coding listed without q has q=1."""
+	accepted: Dict[str, float] = {}
+	for item in header.split(","):
+		coding, *params = [part.strip() for part in item.split(";")]
+		if not coding:
+			continue
+		q = 1.0
+		for param in params:
+			name, _, value = param.partition("=")
+			if name.strip().lower() == "q":
+				try:
+					q = float(value)
+				except ValueError:
+					q = 0.0
+		accepted[coding.lower()] = q
+	return accepted
+
+
+def quality(accepted: Dict[str, float], coding: str) -> float:
+	if coding in accepted:
+		return accepted[coding]
+	return accepted.get("*", 0.0)
+
+
+@dataclass
+class Asset:
+	name: str
+	url: str
+	mimetype: str
+	etag: str
+	data: bytes
+	gzip: bytes
+	br: Optional[bytes]
+
+	def body(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+		accepted = accepted_encodings(accept_encoding)
+		bodies = {"br": self.br, "gzip": self.gzip}
+		best: Optional[str] = None
+		for coding in ENCODINGS:
+			if bodies[coding] is not None and quality(accepted, coding) > (quality(accepted, best) if best else 0.0):
+				best = coding
+		if best is None:
+			return self.data, None
+		return bodies[best], best
+
+	def etag_for(self, encoding: Optional[str]) -> str:
+		return self.etag + ETAG_SUFFIXES.get(encoding or "", "")
+
+
+def build_asset(name: str, data: bytes, mimetype: Optional[str] = None) -> Asset:
+	digest = hashlib.sha256(data).hexdigest()[:12]
+	stem, ext = os.path.splitext(name)
+	return Asset(
+		name=name,
+		url=f"{URL_PREFIX}{stem}.{digest}{ext}",
+		mimetype=mimetype or mimetypes.guess_type(name)[0] or "application/octet-stream",
+		etag=digest,
+		data=data,
+		gzip=gzip.compress(data, compresslevel=9, mtime=0),
+		br=brotli.compress(data) if brotli is not None else None,
+	)
+
+
+class AssetRegistry:
+	def __init__(self, root: str = STATIC_DIR) -> None:
+		self.root = root
+		self.by_name: Dict[str, Asset] = {}
+		self.by_url: Dict[str, Asset] = {}
+		self.load()
+
+	def load(self) -> None:
+		for folder, _, files in os.walk(self.root):
+			for filename in files:
+				path = os.path.join(folder, filename)
+				name = os.path.relpath(path, self.root).replace(os.sep, "/")
+				with open(path, "rb") as fh:
+					self.add(build_asset(name, fh.read()))
+
+	def add(self, asset: Asset) -> None:
+		self.by_name[asset.name] = asset
+		self.by_url[asset.url[len(URL_PREFIX):]] = asset
+
+	def url(self, name: str) -> str:
+		asset = self.by_name.get(name)
+		if asset is not None:
+			return asset.url
+		return URL_PREFIX + name
+
+	def lookup(self, path: str) -> Optional[Asset]:
+		return self.by_url.get(path)
+
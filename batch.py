@@ -0,0 +1,200 @@
+"""Batch mode for chat.py: push a JSONL file of prompts through the configured model.
+
+	python chat.py batch prompts.jsonl -o results.jsonl --concurrency 8
+	python chat.py batch requests.jsonl --id-field request_id --prompt-field body
+
+Each input line is a JSON object with a "prompt" (or a "messages" list) and an
+optional "id"; a bare JSON string is taken as the prompt. Input is read lazily,
+so files of any size work. Results are appended to the output file as they
+finish, one JSON object per line:
+
+	{"id": ..., "model": ..., "output": ..., "error": null, "latency_ms": ..., "tokens_in": ..., "tokens_out": ...}
+
+The output file doubles as the checkpoint: re-running the same command after a
+crash or Ctrl+C skips every id that already has a successful result and
+retries the ones that failed (readers should keep the last line per id).
+Token counts are estimated the same way as the context window (context.py).
+Requests go through the usual router, so throughput is also bounded by the
+provider rate limiter (RATE_LIMIT_RPS, see ratelimit.py).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, TextIO, Tuple
+
+import completions
+from clients import aclose_all
+from context import MESSAGE_OVERHEAD_TOKENS, ContextWindow
+from ratelimit import as_user
+from router import Router
+
+Job = Tuple[str, List[Dict[str, str]]]
+
+
+@dataclass
+class Summary:
+	done: int = 0
+	failed: int = 0
+	skipped: int = 0
+	tokens_in: int = 0
+	tokens_out: int = 0
+	started: float = 0.0
+
+	def report(self) -> str:
+		elapsed = max(time.perf_counter() - self.started, 1e-9)
+		return (
+			f"{self.done} done, {self.failed} failed, {self.skipped} skipped in {elapsed:.1f}s | "
+			f"{self.done / elapsed:.2f} prompts/s | {self.tokens_out / elapsed:.1f} output tokens/s "
+			f"({self.tokens_in} in / {self.tokens_out} out)"
+		)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+	parser.add_argument("input", help="JSONL file of prompts")
+	parser.add_argument("-o", "--output", help="results file (default: <input>.results.jsonl)")
+	parser.add_argument("-c", "--concurrency", type=int, default=8, help="requests in flight at once")
+	parser.add_argument("--model", help="model to use (default: the configured model)")
+	parser.add_argument("--system", help="system prompt (default: the interactive one; '' for none)")
+	parser.add_argument("--id-field", default="id")
+	parser.add_argument("--prompt-field", default="prompt")
+
+
+def completed_ids(path: str) -> Set[str]:
+	"""Ids with a successful result; also drops a half-written last line."""
+	done: Set[str] = set()
+	if not os.path.exists(path):
+		return done
+	with open(path, "rb+") as fh:
+		data = fh.read()
+		if data and not data.endswith(b"\n"):
+			# A crash mid-write leaves a partial line; appending after it would corrupt the next one
+			fh.truncate(data.rfind(b"\n") + 1)
+	for line in data.splitlines():
+		try:
+			record = json.loads(line)
+		except ValueError:
+			continue
+		if isinstance(record, dict) and record.get("error") is None:
+			done.add(str(record.get("id")))
+	return done
+
+
+def read_jobs(path: str, args: argparse.Namespace, system_prompt: str, done: Set[str], summary: Summary) -> Iterator[Job]:
+	with open(path, encoding="utf-8") as fh:
+		for number, line in enumerate(fh, 1):
+			line = line.strip()
+			if not line:
+				continue
+			try:
+				record = json.loads(line)
+			except ValueError:
+				print(f"line {number}: not JSON, skipped", file=sys.stderr)
+				continue
+			if isinstance(record, str):
+				record = {args.prompt_field: record}
+			job_id = str(record.get(args.id_field, number))
+			if job_id in done:
+				summary.skipped += 1
+				continue
+			messages = record.get("messages")
+			if not isinstance(messages, list):
+				prompt = str(record.get(args.prompt_field) or "").strip()
+				if not prompt:
+					print(f"line {number}: no {args.prompt_field!r} field, skipped", file=sys.stderr)
+					continue
+				messages = [{"role": "user", "content": prompt}]
+				if system_prompt:
+					messages.insert(0, {"role": "system", "content": system_prompt})
+			yield job_id, messages
+
+
+async def worker(
+	number: int,
+	jobs: "asyncio.Queue[Optional[Job]]",
+	out: TextIO,
+	router: Router,
+	model: str,
+	extra_headers: Dict[str, str],
+	window: ContextWindow,
+	summary: Summary,
+) -> None:
+	# Each worker queues as its own rate-limit user so the per-user cap doesn't bound concurrency
+	with as_user(f"batch-{number}"):
+		while True:
+			job = await jobs.get()
+			if job is None:
+				return
+			job_id, messages = job
+			outgoing, stats = window.fit(messages, model)
+			started = time.perf_counter()
+			output, error = None, None
+			try:
+				output = await completions.acomplete(router, model, outgoing, extra_headers)
+			except Exception as exc:
+				error = f"{type(exc).__name__}: {exc}"
+			tokens_out = window.counter.count({"role": "assistant", "content": output or ""}) - MESSAGE_OVERHEAD_TOKENS
+			record = {
+				"id": job_id,
+				"model": model,
+				"output": output,
+				"error": error,
+				"latency_ms": round((time.perf_counter() - started) * 1000, 1),
+				"tokens_in": stats.tokens_after,
+				"tokens_out": tokens_out if output else 0,
+			}
+			out.write(json.dumps(record, ensure_ascii=False) + "\n")
+			out.flush()
+			if error is None:
+				summary.done += 1
+				summary.tokens_in += stats.tokens_after
+				summary.tokens_out += tokens_out
+			else:
+				summary.failed += 1
+
+
+async def run(args: argparse.Namespace, router: Router, model: str, extra_headers: Dict[str, str], system_prompt: str, summary: Summary) -> None:
+	output = args.output or os.path.splitext(args.input)[0] + ".results.jsonl"
+	done = completed_ids(output)
+	window = ContextWindow.from_env()
+	concurrency = max(1, args.concurrency)
+	jobs: "asyncio.Queue[Optional[Job]]" = asyncio.Queue(maxsize=concurrency * 2)
+	with open(output, "a", encoding="utf-8") as out:
+		workers = [
+			asyncio.create_task(worker(n, jobs, out, router, model, extra_headers, window, summary))
+			for n in range(concurrency)
+		]
+		try:
+			last_report = time.perf_counter()
+			for job in read_jobs(args.input, args, system_prompt, done, summary):
+				await jobs.put(job)
+				if time.perf_counter() - last_report > 5:
+					print(summary.report(), file=sys.stderr)
+					last_report = time.perf_counter()
+			for _ in workers:
+				await jobs.put(None)
+			await asyncio.gather(*workers)
+		finally:
+			for task in workers:
+				task.cancel()
+			await asyncio.gather(*workers, return_exceptions=True)
+			await aclose_all()
+
+
+def main(argv: List[str], router: Router, default_model: str, extra_headers: Dict[str, str], system_prompt: str) -> None:
+	parser = argparse.ArgumentParser(prog="chat.py batch", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	add_arguments(parser)
+	args = parser.parse_args(argv)
+	system = system_prompt if args.system is None else args.system
+	summary = Summary(started=time.perf_counter())
+	try:
+		asyncio.run(run(args, router, args.model or default_model, extra_headers, system, summary))
+	except KeyboardInterrupt:
+		print(summary.report())
+		print("interrupted; re-run the same command to resume", file=sys.stderr)
+		sys.exit(130)
+	print(summary.report())
+	sys.exit(1 if summary.failed else 0)
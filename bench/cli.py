@@ -0,0 +1,105 @@
+"""Benchmark chat.py's interactive streaming loop against the mock upstream.
+
+	python -m bench.cli --turns 20 --ttft-ms 200 --tokens-per-sec 80
+
+Drives chat.py through a pipe and times each turn from the moment the prompt is
+written: time to the first reply character and time until the next "You:"
+prompt appears.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from typing import List, Optional
+
+from bench.mock_server import add_arguments, config_from_args, serve
+from bench.report import summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+
+class OutputWatcher:
+	def __init__(self, stream: "subprocess.IO[bytes]") -> None:
+		self.text = ""
+		self._cond = threading.Condition()
+		threading.Thread(target=self._pump, args=(stream,), daemon=True).start()
+
+	def _pump(self, stream: "subprocess.IO[bytes]") -> None:
+		while True:
+			data = os.read(stream.fileno(), 4096)
+			if not data:
+				break
+			with self._cond:
+				self.text += ANSI.sub("", data.decode("utf-8", "replace"))
+				self._cond.notify_all()
+
+	def wait_for(self, pattern: str, start: int, timeout: float = 120.0) -> Optional[int]:
+		deadline = time.monotonic() + timeout
+		with self._cond:
+			while True:
+				index = self.text.find(pattern, start)
+				if index >= 0:
+					return index
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return None
+				self._cond.wait(remaining)
+
+	def wait_for_length(self, length: int, timeout: float = 120.0) -> bool:
+		with self._cond:
+			return self._cond.wait_for(lambda: len(self.text) >= length, timeout)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--turns", type=int, default=10)
+	add_arguments(parser)
+	args = parser.parse_args()
+
+	upstream = serve(config_from_args(args))
+	env = dict(
+		os.environ,
+		PYTHONUNBUFFERED="1",
+		PROVIDERS="openrouter",
+		OPENROUTER_API_KEY="mock",
+		OPENROUTER_BASE_URL=f"http://127.0.0.1:{upstream.server_address[1]}/v1",
+		OPENROUTER_MODEL="mock-model",
+	)
+	started = time.perf_counter()
+	proc = subprocess.Popen([sys.executable, "chat.py"], cwd=ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+	watcher = OutputWatcher(proc.stdout)
+	if watcher.wait_for("You:", 0) is None:
+		raise SystemExit("chat.py never showed a prompt")
+	print(f"startup (first prompt) {(time.perf_counter() - started) * 1000:.1f}ms")
+
+	ttfts: List[float] = []
+	latencies: List[float] = []
+	for turn in range(args.turns):
+		mark = len(watcher.text)
+		t0 = time.perf_counter()
+		proc.stdin.write(f"benchmark prompt {turn}\n".encode())
+		proc.stdin.flush()
+		prefix = watcher.wait_for("Assistant: ", mark)
+		if prefix is None:
+			break
+		body = prefix + len("Assistant: ")
+		if watcher.wait_for_length(body + 1):
+			ttfts.append(time.perf_counter() - t0)
+		if watcher.wait_for("You:", body) is None:
+			break
+		latencies.append(time.perf_counter() - t0)
+
+	proc.stdin.write(b"/exit\n")
+	proc.stdin.flush()
+	proc.wait(timeout=10)
+	print(f"turns completed {len(latencies)}/{args.turns}")
+	print(summarize("ttft", ttfts))
+	print(summarize("latency", latencies))
+
+
+if __name__ == "__main__":
+	main()
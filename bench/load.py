@@ -0,0 +1,154 @@
+"""Load test for the web app's chat routes.
+
+Against a running server (pass the gunicorn master pid to report worker memory):
+
+	python -m bench.load --url http://127.0.0.1:8000 --master-pid 1234 --concurrency 20 --requests 200
+
+Or let the harness start the mock upstream and a gunicorn server itself:
+
+	python -m bench.load --spawn --workers 2 --route send_stream --ttft-ms 300 --tokens-per-sec 40
+
+Reports requests/s, time-to-first-token and total latency percentiles, errors,
+and RSS per worker.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import requests
+
+from bench.mock_server import add_arguments, config_from_args, serve
+from bench.report import summarize, worker_memory
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def one_request(http: requests.Session, url: str, route: str, prompt: str) -> Tuple[float, float, bool]:
+	started = time.perf_counter()
+	ttft = 0.0
+	if route == "send_json":
+		resp = http.post(f"{url}/send_json", json={"prompt": prompt}, timeout=300)
+		ok = resp.ok and not resp.json().get("assistant", "").startswith("[")
+		ttft = time.perf_counter() - started
+		return ttft, ttft, ok
+	ok = False
+	with http.post(f"{url}/send_stream", json={"prompt": prompt}, stream=True, timeout=300) as resp:
+		for line in resp.iter_lines():
+			if not line:
+				continue
+			event = json.loads(line)
+			if event.get("delta") and not ttft:
+				ttft = time.perf_counter() - started
+				ok = True
+			if event.get("error"):
+				ok = False
+	return ttft, time.perf_counter() - started, ok and resp.ok
+
+
+def run_load(url: str, route: str, concurrency: int, total: int, password: str) -> Tuple[List[float], List[float], int, float]:
+	ttfts: List[float] = []
+	latencies: List[float] = []
+	errors = 0
+	lock = threading.Lock()
+	counter = iter(range(total))
+
+	def user() -> None:
+		nonlocal errors
+		http = requests.Session()
+		http.post(f"{url}/unlock", json={"password": password}, timeout=30)
+		for n in counter:
+			try:
+				ttft, latency, ok = one_request(http, url, route, f"benchmark prompt {n}")
+			except requests.RequestException:
+				ttft, latency, ok = 0.0, 0.0, False
+			with lock:
+				if ok:
+					ttfts.append(ttft)
+					latencies.append(latency)
+				else:
+					errors += 1
+
+	started = time.perf_counter()
+	threads = [threading.Thread(target=user) for _ in range(concurrency)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	return ttfts, latencies, errors, time.perf_counter() - started
+
+
+def spawn_server(args: argparse.Namespace) -> Tuple[subprocess.Popen, str]:
+	upstream = serve(config_from_args(args))
+	port = args.port
+	tmp = tempfile.mkdtemp(prefix="potato-bench-")
+	env = dict(
+		os.environ,
+		PROVIDERS="openrouter",
+		OPENROUTER_API_KEY="mock",
+		OPENROUTER_BASE_URL=f"http://127.0.0.1:{upstream.server_address[1]}/v1",
+		OPENROUTER_MODEL="mock-model",
+		CONVERSATION_DB_URL=f"sqlite:///{tmp}/bench.db",
+		LOCK_PASSWORD=args.password,
+	)
+	if args.app == "asgi":
+		command = ["gunicorn", "asgi:app", "-k", "uvicorn.workers.UvicornWorker"]
+	else:
+		command = ["gunicorn", "web:app"]
+	command += ["-w", str(args.workers), "-b", f"127.0.0.1:{port}", "--timeout", "300"]
+	proc = subprocess.Popen(command, cwd=ROOT, env=env)
+	url = f"http://127.0.0.1:{port}"
+	deadline = time.time() + 30
+	while time.time() < deadline:
+		try:
+			requests.get(url + "/", timeout=1)
+			return proc, url
+		except requests.RequestException:
+			time.sleep(0.2)
+	proc.terminate()
+	raise SystemExit("server did not start within 30s")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--url", default="http://127.0.0.1:8000")
+	parser.add_argument("--route", choices=["send_json", "send_stream"], default="send_stream")
+	parser.add_argument("--concurrency", type=int, default=10)
+	parser.add_argument("--requests", type=int, default=100)
+	parser.add_argument("--password", default=os.getenv("LOCK_PASSWORD", "230111009115"))
+	parser.add_argument("--master-pid", type=int, default=None, help="gunicorn master pid, for worker memory")
+	parser.add_argument("--spawn", action="store_true", help="start the mock upstream and gunicorn")
+	parser.add_argument("--app", choices=["web", "asgi"], default="web", help="entry point used with --spawn")
+	parser.add_argument("--workers", type=int, default=1, help="gunicorn workers used with --spawn")
+	parser.add_argument("--port", type=int, default=8765, help="port used with --spawn")
+	add_arguments(parser)
+	args = parser.parse_args()
+
+	proc: Optional[subprocess.Popen] = None
+	url, master_pid = args.url, args.master_pid
+	if args.spawn:
+		proc, url = spawn_server(args)
+		master_pid = proc.pid
+	try:
+		ttfts, latencies, errors, elapsed = run_load(url, args.route, args.concurrency, args.requests, args.password)
+		print(f"route=/{args.route} concurrency={args.concurrency} requests={args.requests} elapsed={elapsed:.2f}s")
+		print(f"throughput {len(latencies) / elapsed:.2f} req/s  errors={errors}")
+		print(summarize("ttft", ttfts))
+		print(summarize("latency", latencies))
+		if master_pid:
+			for pid, mb in sorted(worker_memory(master_pid).items()):
+				print(f"worker {pid}: {mb:.1f} MB RSS")
+	finally:
+		if proc is not None:
+			proc.terminate()
+			proc.wait(timeout=10)
+	sys.exit(1 if errors and not latencies else 0)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,232 @@
+"""Local OpenAI-compatible mock server for benchmarks and fail-over testing.
+
+	python -m bench.mock_server --port 9100 --ttft-ms 300 --tokens-per-sec 40 --error-rate 0.05
+	python -m bench.mock_server --rate-limit 2   # 429s past 2 requests/second
+	python -m bench.mock_server --prompt-cache --prefill-ms-per-1k 100
+
+Serves POST /v1/chat/completions (streaming and non-streaming) and GET
+/v1/models. Point a provider at it with e.g. OPENROUTER_BASE_URL=http://127.0.0.1:9100/v1.
+
+Prompt processing adds --prefill-ms-per-1k per thousand prompt tokens to the
+time to first token. With --prompt-cache, message prefixes seen before are
+"cached": they cost nothing and are reported as
+usage.prompt_tokens_details.cached_tokens, as OpenAI does.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+WORDS = "the potato is a starchy tuber and a staple food in many parts of the world".split()
+
+
+@dataclass
+class MockConfig:
+	ttft_ms: float = 200.0
+	tokens_per_sec: float = 50.0
+	reply_tokens: int = 60
+	error_rate: float = 0.0
+	error_status: int = 429
+	retry_after: Optional[float] = None
+	# Requests allowed per one-second window, 0 for unlimited (OpenRouter-style headers)
+	rate_limit: int = 0
+	prefill_ms_per_1k: float = 0.0
+	prompt_cache: bool = False
+
+
+def _text(content: Any) -> str:
+	if isinstance(content, list):
+		return "".join(str(part.get("text") or "") for part in content if isinstance(part, dict))
+	return str(content or "")
+
+
+def _chunk(model: str, cid: str, content: Optional[str], finish: Optional[str] = None, usage: Optional[Dict[str, Any]] = None) -> bytes:
+	body: Dict[str, Any] = {
+		"id": cid,
+		"object": "chat.completion.chunk",
+		"created": int(time.time()),
+		"model": model,
+		"choices": [{"index": 0, "delta": {"content": content} if content is not None else {}, "finish_reason": finish}],
+	}
+	if usage is not None:
+		body["choices"] = []
+		body["usage"] = usage
+	return b"data: " + json.dumps(body).encode() + b"\n\n"
+
+
+def make_handler(config: MockConfig) -> type:
+	window = {"start": 0.0, "count": 0}
+	window_lock = threading.Lock()
+	prefixes: Dict[str, float] = {}
+	prefixes_lock = threading.Lock()
+
+	def prompt_usage(messages: List[Dict[str, Any]]) -> Tuple[int, int]:
+		# (prompt tokens, cached tokens); a prefix is cached once any earlier request sent it
+		counts = [len(_text(m.get("content"))) // 4 + 4 for m in messages]
+		if not config.prompt_cache:
+			return sum(counts), 0
+		digest = hashlib.sha256()
+		cached = 0
+		now = time.time()
+		with prefixes_lock:
+			for index, message in enumerate(messages):
+				# cache_control markers don't change the prefix
+				digest.update(json.dumps([message.get("role"), _text(message.get("content"))]).encode())
+				key = digest.hexdigest()
+				if index < len(messages) - 1 and prefixes.get(key, 0) > now:
+					cached = sum(counts[:index + 1])
+				prefixes[key] = now + 300
+		return sum(counts), cached
+
+	def rate_limit_headers() -> Tuple[bool, Tuple[Tuple[str, str], ...]]:
+		now = time.time()
+		with window_lock:
+			if now - window["start"] >= 1.0:
+				window["start"], window["count"] = now, 0
+			window["count"] += 1
+			allowed = window["count"] <= config.rate_limit
+			remaining = max(0, config.rate_limit - window["count"])
+			reset_ms = int((window["start"] + 1.0) * 1000)
+		return allowed, (
+			("X-RateLimit-Limit", str(config.rate_limit)),
+			("X-RateLimit-Remaining", str(remaining)),
+			("X-RateLimit-Reset", str(reset_ms)),
+		)
+
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = "HTTP/1.1"
+
+		def log_message(self, *args: Any) -> None:
+			pass
+
+		def _json(self, status: int, payload: Dict[str, Any], headers: Tuple[Tuple[str, str], ...] = ()) -> None:
+			body = json.dumps(payload).encode()
+			self.send_response(status)
+			self.send_header("Content-Type", "application/json")
+			self.send_header("Content-Length", str(len(body)))
+			for name, value in headers:
+				self.send_header(name, value)
+			self.end_headers()
+			self.wfile.write(body)
+
+		def do_GET(self) -> None:
+			if self.path.rstrip("/").endswith("/models"):
+				self._json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+			else:
+				self._json(404, {"error": {"message": "not found"}})
+
+		def do_POST(self) -> None:
+			length = int(self.headers.get("Content-Length") or 0)
+			try:
+				request = json.loads(self.rfile.read(length) or b"{}")
+			except ValueError:
+				return self._json(400, {"error": {"message": "invalid json"}})
+			if not self.path.rstrip("/").endswith("/chat/completions"):
+				return self._json(404, {"error": {"message": "not found"}})
+			limit_headers: Tuple[Tuple[str, str], ...] = ()
+			if config.rate_limit:
+				allowed, limit_headers = rate_limit_headers()
+				if not allowed:
+					return self._json(429, {"error": {"message": "rate limited", "code": 429}}, limit_headers)
+			if config.error_rate and random.random() < config.error_rate:
+				headers = (("Retry-After", str(config.retry_after)),) if config.retry_after is not None else ()
+				return self._json(config.error_status, {"error": {"message": "injected error", "code": config.error_status}}, headers)
+			model = request.get("model") or "mock-model"
+			prompt_tokens, cached_tokens = prompt_usage(request.get("messages") or [])
+			tokens = [random.choice(WORDS) + " " for _ in range(config.reply_tokens)]
+			time.sleep((config.ttft_ms + (prompt_tokens - cached_tokens) / 1000 * config.prefill_ms_per_1k) / 1000)
+			usage: Dict[str, Any] = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens), "total_tokens": prompt_tokens + len(tokens)}
+			if config.prompt_cache:
+				usage["prompt_tokens_details"] = {"cached_tokens": cached_tokens}
+			cid = "chatcmpl-" + uuid.uuid4().hex[:12]
+			if not request.get("stream"):
+				time.sleep(len(tokens) / config.tokens_per_sec)
+				return self._json(200, {
+					"id": cid,
+					"object": "chat.completion",
+					"created": int(time.time()),
+					"model": model,
+					"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+					"usage": usage,
+				}, limit_headers)
+			self.send_response(200)
+			self.send_header("Content-Type", "text/event-stream")
+			self.send_header("Cache-Control", "no-cache")
+			self.send_header("Connection", "close")
+			for name, value in limit_headers:
+				self.send_header(name, value)
+			self.end_headers()
+			self.close_connection = True
+			interval = 1 / config.tokens_per_sec
+			try:
+				for token in tokens:
+					self.wfile.write(_chunk(model, cid, token))
+					self.wfile.flush()
+					time.sleep(interval)
+				self.wfile.write(_chunk(model, cid, None, finish="stop"))
+				if (request.get("stream_options") or {}).get("include_usage"):
+					self.wfile.write(_chunk(model, cid, None, usage=usage))
+				self.wfile.write(b"data: [DONE]\n\n")
+				self.wfile.flush()
+			except (BrokenPipeError, ConnectionResetError):
+				pass
+
+	return Handler
+
+
+def serve(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+	# Starts in a daemon thread; port 0 picks a free port (see server.server_address)
+	server = ThreadingHTTPServer((host, port), make_handler(config))
+	server.daemon_threads = True
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+	parser.add_argument("--ttft-ms", type=float, default=200.0, help="delay before the first token")
+	parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="token rate after the first token")
+	parser.add_argument("--reply-tokens", type=int, default=60, help="tokens per reply")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+	parser.add_argument("--error-status", type=int, default=429, help="status code for injected errors")
+	parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds on injected errors")
+	parser.add_argument("--rate-limit", type=int, default=0, help="requests per second before answering 429")
+	parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0, help="extra time to first token per 1000 uncached prompt tokens")
+	parser.add_argument("--prompt-cache", action="store_true", help="simulate prefix caching of repeated prompts")
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+	return MockConfig(
+		ttft_ms=args.ttft_ms,
+		tokens_per_sec=args.tokens_per_sec,
+		reply_tokens=args.reply_tokens,
+		error_rate=args.error_rate,
+		error_status=args.error_status,
+		retry_after=args.retry_after,
+		rate_limit=args.rate_limit,
+		prefill_ms_per_1k=args.prefill_ms_per_1k,
+		prompt_cache=args.prompt_cache,
+	)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=9100)
+	add_arguments(parser)
+	args = parser.parse_args()
+	server = serve(config_from_args(args), args.host, args.port)
+	print(f"Mock OpenAI server on http://{args.host}:{server.server_address[1]}/v1")
+	try:
+		threading.Event().wait()
+	except KeyboardInterrupt:
+		server.shutdown()
+
+
+if __name__ == "__main__":
+	main()
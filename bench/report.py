@@ -0,0 +1,52 @@
+"""Shared helpers for benchmark reporting."""
+import os
+from typing import Dict, List, Optional, Sequence
+
+
+def percentile(samples: Sequence[float], q: float) -> Optional[float]:
+	if not samples:
+		return None
+	ordered = sorted(samples)
+	return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def summarize(name: str, samples: Sequence[float]) -> str:
+	if not samples:
+		return f"{name:<10} n=0"
+	parts = [f"{name:<10} n={len(samples)}"]
+	for q in (50, 95, 99):
+		parts.append(f"p{q}={percentile(samples, q) * 1000:8.1f}ms")
+	parts.append(f"max={max(samples) * 1000:8.1f}ms")
+	return "  ".join(parts)
+
+
+def child_pids(pid: int) -> List[int]:
+	# Linux only: reads parent pids from /proc
+	children: List[int] = []
+	for entry in os.listdir("/proc"):
+		if not entry.isdigit():
+			continue
+		try:
+			with open(f"/proc/{entry}/stat") as fh:
+				fields = fh.read().rsplit(")", 1)[1].split()
+		except OSError:
+			continue
+		if int(fields[1]) == pid:
+			children.append(int(entry))
+	return children
+
+
+def rss_mb(pid: int) -> Optional[float]:
+	try:
+		with open(f"/proc/{pid}/status") as fh:
+			for line in fh:
+				if line.startswith("VmRSS:"):
+					return int(line.split()[1]) / 1024
+	except OSError:
+		return None
+	return None
+
+
+def worker_memory(master_pid: int) -> Dict[int, float]:
+	pids = child_pids(master_pid) or [master_pid]
+	return {pid: mb for pid in pids for mb in [rss_mb(pid)] if mb is not None}
@@ -0,0 +1,98 @@
+"""Benchmark chat.py startup: time until the first "You:" prompt.
+
+	python -m bench.startup --runs 10 --target-ms 200
+
+Each run starts chat.py with a dummy key and times it until the prompt is
+shown. A separate `python -X importtime -c "import chat"` run lists the
+slowest imports and fails the check if a module that should load lazily (the
+openai SDK and its HTTP/validation stack) is imported before the prompt.
+Exits 1 when p50 is over the target, so the number can be tracked in CI.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from typing import List, Tuple
+
+from bench.cli import OutputWatcher
+from bench.report import percentile, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+# Must stay off the path to the first prompt
+LAZY = ("openai", "httpx", "httpx2", "pydantic", "tiktoken", "markdown", "sqlalchemy")
+
+
+def child_env() -> dict:
+	return dict(
+		os.environ,
+		PYTHONUNBUFFERED="1",
+		PROVIDERS="openrouter",
+		OPENROUTER_API_KEY="startup-benchmark",
+		OPENROUTER_BASE_URL="http://127.0.0.1:9/v1",
+		OPENROUTER_MODEL="mock-model",
+	)
+
+
+def time_to_prompt() -> float:
+	started = time.perf_counter()
+	proc = subprocess.Popen([sys.executable, "chat.py"], cwd=ROOT, env=child_env(), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+	watcher = OutputWatcher(proc.stdout)
+	try:
+		if watcher.wait_for("You:", 0, timeout=30) is None:
+			raise SystemExit("chat.py never showed a prompt")
+		return time.perf_counter() - started
+	finally:
+		proc.stdin.write(b"/exit\n")
+		proc.stdin.flush()
+		proc.wait(timeout=10)
+
+
+def import_profile() -> List[Tuple[str, int, int]]:
+	"""(module, depth, cumulative microseconds) for everything `import chat` loads."""
+	result = subprocess.run(
+		[sys.executable, "-X", "importtime", "-c", "import chat"],
+		cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True,
+	)
+	modules = []
+	for line in result.stderr.splitlines():
+		match = IMPORT_LINE.match(line)
+		if match:
+			modules.append((match.group(4), len(match.group(3)), int(match.group(2))))
+	# importtime prints children before their parent; keep chat's subtree only
+	end = next(i for i, m in enumerate(modules) if m[0] == "chat")
+	start = end
+	while start > 0 and modules[start - 1][1] > modules[end][1]:
+		start -= 1
+	return modules[start:end + 1]
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--runs", type=int, default=10)
+	parser.add_argument("--target-ms", type=float, default=200.0, help="p50 time-to-prompt budget")
+	parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+	args = parser.parse_args()
+
+	modules = import_profile()
+	_, depth, total = modules[-1]
+	print(f"import chat      {total / 1000:8.1f}ms")
+	direct = sorted((m for m in modules if m[1] == depth + 2), key=lambda m: -m[2])
+	for name, _, us in direct[:args.top]:
+		print(f"  {name:<14} {us / 1000:8.1f}ms")
+	eager = sorted({name for name, _, _ in modules if name.split(".")[0] in LAZY})
+	if eager:
+		print(f"imported before the prompt but should be lazy: {', '.join(eager)}")
+
+	samples = [time_to_prompt() for _ in range(args.runs)]
+	print(summarize("prompt", samples))
+	p50 = percentile(samples, 50) * 1000
+	ok = p50 <= args.target_ms and not eager
+	print(f"target p50 <= {args.target_ms:.0f}ms: {'ok' if ok else 'FAILED'} ({p50:.1f}ms)")
+	sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+	main()
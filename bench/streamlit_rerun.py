@@ -0,0 +1,173 @@
+"""Benchmark Streamlit reruns of app.py as the conversation grows.
+
+	python -m bench.streamlit_rerun --turns 200 --every 25
+	python -m bench.streamlit_rerun --script old_app.py   # compare another copy of the app
+
+Starts the mock upstream and `streamlit run app.py` headless, then drives it
+over Streamlit's websocket protocol, as a browser tab would. Every --every
+turns it reports the median time of three interactions, from sending the
+event until the server reports the run finished: editing a sidebar setting,
+sending a chat message (the mock replies instantly by default; the median
+covers the turns since the previous row) and a full rerun. The elements and
+bytes sent back are counted too, since the browser has to apply each one.
+Needs the websockets package, which recent Streamlit releases install.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+from bench.mock_server import add_arguments, config_from_args, serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SETTING = "HTTP-Referer (optional)"
+
+
+def free_port() -> int:
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+
+class Tab:
+	"""One browser tab: remembers the widgets on the page and sends reruns."""
+
+	def __init__(self, ws: Any) -> None:
+		self.ws = ws
+		# label -> (widget id, fragment id)
+		self.widgets: Dict[str, Tuple[str, str]] = {}
+		self.values: Dict[str, str] = {}
+
+	async def rerun(self, fragment_id: str = "", chat: Optional[str] = None, chat_widget: str = "") -> Tuple[float, int, int]:
+		"""(seconds, elements, bytes) for one rerun, including any rerun the app asks for."""
+		from streamlit.proto.BackMsg_pb2 import BackMsg
+		from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+		msg = BackMsg()
+		state = msg.rerun_script
+		state.fragment_id = fragment_id
+		for widget_id, value in self.values.items():
+			state.widget_states.widgets.add(id=widget_id, string_value=value)
+		if chat is not None:
+			widget = state.widget_states.widgets.add(id=chat_widget)
+			if "chat_input_value" in widget.DESCRIPTOR.fields_by_name:
+				widget.chat_input_value.data = chat
+			else:
+				widget.string_trigger_value.data = chat
+		started = time.perf_counter()
+		await self.ws.send(msg.SerializeToString())
+		elements = size = 0
+		while True:
+			data = await self.ws.recv()
+			size += len(data)
+			forward = ForwardMsg()
+			forward.ParseFromString(data)
+			kind = forward.WhichOneof("type")
+			if kind == "delta":
+				elements += 1
+				self._learn(forward.delta)
+			elif kind == "script_finished" and forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+				return time.perf_counter() - started, elements, size
+
+	def _learn(self, delta: Any) -> None:
+		if delta.WhichOneof("type") != "new_element":
+			return
+		kind = delta.new_element.WhichOneof("type")
+		if kind not in ("text_input", "chat_input"):
+			return
+		widget = getattr(delta.new_element, kind)
+		label = widget.label if kind == "text_input" else "chat"
+		self.widgets[label] = (widget.id, delta.fragment_id)
+		if kind == "text_input":
+			self.values.setdefault(widget.id, widget.default)
+
+
+def median(runs: List[Tuple[float, int, int]]) -> Tuple[float, int, int]:
+	return sorted(runs)[len(runs) // 2]
+
+
+async def drive(url: str, turns: int, every: int, repeat: int) -> List[Tuple[Any, ...]]:
+	import websockets
+
+	rows: List[Any] = []
+	async with websockets.connect(url, subprotocols=["streamlit"], max_size=None) as ws:
+		tab = Tab(ws)
+		await tab.rerun()
+		chats: List[Tuple[float, int, int]] = []
+		for turn in range(turns + 1):
+			# Fragment ids depend on where the fragment is drawn, so look them up after every run
+			chat_id, chat_fragment = tab.widgets["chat"]
+			chats.append(await tab.rerun(chat_fragment, f"benchmark prompt {turn}", chat_id))
+			if turn % every:
+				continue
+			edits = []
+			fulls = []
+			for sample in range(repeat):
+				setting_id, setting_fragment = tab.widgets[SETTING]
+				tab.values[setting_id] = f"bench-{turn}-{sample}"
+				edits.append(await tab.rerun(setting_fragment))
+				fulls.append(await tab.rerun())
+			rows.append((turn, median(edits), median(chats), median(fulls)))
+			print(row_text(rows[-1]), flush=True)
+			chats = []
+	return rows
+
+
+def row_text(row: Tuple[Any, ...]) -> str:
+	turn, *runs = row
+	return f"{turn:>6}" + "".join(f"  {seconds * 1000:8.1f}ms {elements:>5} {size / 1024:8.1f}KB" for seconds, elements, size in runs)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument("--turns", type=int, default=100, help="chat turns to play")
+	parser.add_argument("--every", type=int, default=20, help="turns between measurements")
+	parser.add_argument("--repeat", type=int, default=5, help="samples per measurement (the median is shown)")
+	parser.add_argument("--script", default="app.py", help="Streamlit script, relative to the repository")
+	add_arguments(parser)
+	parser.set_defaults(ttft_ms=0.0, tokens_per_sec=5000.0)
+	args = parser.parse_args()
+
+	upstream = serve(config_from_args(args))
+	port = free_port()
+	env = dict(
+		os.environ,
+		PROVIDERS="openrouter",
+		OPENROUTER_API_KEY="mock",
+		OPENROUTER_BASE_URL=f"http://127.0.0.1:{upstream.server_address[1]}/v1",
+		OPENROUTER_MODEL="mock-model",
+	)
+	proc = subprocess.Popen(
+		[
+			sys.executable, "-m", "streamlit", "run", args.script,
+			"--server.headless", "true", "--server.port", str(port),
+			"--server.enableXsrfProtection", "false", "--browser.gatherUsageStats", "false",
+		],
+		cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+	)
+	try:
+		deadline = time.monotonic() + 60
+		while True:
+			try:
+				if requests.get(f"http://127.0.0.1:{port}/_stcore/health", timeout=1).ok:
+					break
+			except requests.RequestException:
+				pass
+			if proc.poll() is not None or time.monotonic() > deadline:
+				raise SystemExit("streamlit did not start")
+			time.sleep(0.2)
+		print(f"{'turns':>6}  {'edit a setting':^29}  {'send a message':^29}  {'full rerun':^29}")
+		asyncio.run(drive(f"ws://127.0.0.1:{port}/_stcore/stream", args.turns, max(1, args.every), max(1, args.repeat)))
+	finally:
+		proc.terminate()
+		proc.wait(timeout=10)
+
+
+if __name__ == "__main__":
+	main()
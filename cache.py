@@ -0,0 +1,189 @@
+"""Opt-in completion cache shared by chat.py, app.py and web.py.
+
+Keyed on (model, normalized messages, sampling params). An in-process LRU tier
+with a TTL sits in front of an optional second tier: a SQLite file that
+survives restarts, or, when SHARED_STATE is set (see shared.py), the state
+shared by every worker.
+
+	COMPLETION_CACHE          "1" to enable (default off)
+	COMPLETION_CACHE_SIZE     in-process entries (default 512)
+	COMPLETION_CACHE_TTL      seconds an answer stays valid (default 3600)
+	COMPLETION_CACHE_PATH     SQLite file for the on-disk tier (default unset)
+	COMPLETION_CACHE_DISK_MAX rows kept on disk (default 20000)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from shared import SharedState, shared_state
+
+
+def normalize_messages(messages: List[Mapping[str, object]]) -> List[Tuple[str, str]]:
+	# Whitespace-only differences shouldn't cost a paid upstream call
+	return [(str(m.get("role", "")), " ".join(str(m.get("content") or "").split())) for m in messages]
+
+
+def cache_key(model: str, messages: List[Mapping[str, object]], params: Optional[Mapping[str, object]] = None) -> str:
+	payload = json.dumps(
+		[model, normalize_messages(messages), sorted((params or {}).items())],
+		ensure_ascii=False,
+		separators=(",", ":"),
+		default=str,
+	)
+	return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskTier:
+	def __init__(self, path: str, max_rows: int) -> None:
+		self.max_rows = max_rows
+		self._lock = threading.Lock()
+		self._puts = 0
+		self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+		# Several workers may share the file
+		self._conn.execute("PRAGMA journal_mode=WAL")
+		self._conn.execute(
+			"CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+		)
+		self._conn.commit()
+
+	def get(self, key: str) -> Optional[Tuple[str, float]]:
+		with self._lock:
+			row = self._conn.execute("SELECT value, expires FROM completions WHERE key = ?", (key,)).fetchone()
+		return (row[0], row[1]) if row else None
+
+	def put(self, key: str, value: str, expires: float) -> int:
+		evicted = 0
+		with self._lock:
+			self._conn.execute("INSERT OR REPLACE INTO completions (key, value, expires) VALUES (?, ?, ?)", (key, value, expires))
+			self._puts += 1
+			# Prune in batches rather than on every write
+			if self._puts % 100 == 0:
+				evicted += self._conn.execute("DELETE FROM completions WHERE expires < ?", (time.time(),)).rowcount
+				evicted += self._conn.execute(
+					"DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+					(self.max_rows,),
+				).rowcount
+			self._conn.commit()
+		return evicted
+
+	def delete(self, key: str) -> None:
+		with self._lock:
+			self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+			self._conn.commit()
+
+
+class SharedTier:
+	"""Second tier kept in a SharedState, so every worker sees every answer."""
+
+	def __init__(self, state: SharedState) -> None:
+		self.state = state
+
+	def get(self, key: str) -> Optional[Tuple[str, float]]:
+		found = self.state.get("cache:" + key)
+		if found is None:
+			return None
+		value, expires = json.loads(found)
+		return value, expires
+
+	def put(self, key: str, value: str, expires: float) -> int:
+		# Expiry is left to the backend, so nothing is ever evicted from here
+		self.state.set("cache:" + key, json.dumps([value, expires], ensure_ascii=False), max(1.0, expires - time.time()))
+		return 0
+
+	def delete(self, key: str) -> None:
+		self.state.delete("cache:" + key)
+
+
+class CompletionCache:
+	def __init__(self, max_entries: int = 512, ttl: float = 3600.0, path: Optional[str] = None, disk_max: int = 20000, tier: Optional[SharedTier] = None) -> None:
+		self.max_entries = max_entries
+		self.ttl = ttl
+		self.disk = DiskTier(path, disk_max) if path else tier
+		self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+		self._lock = threading.Lock()
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+
+	def get(self, key: str) -> Optional[str]:
+		now = time.time()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None:
+				if entry[1] > now:
+					self._entries.move_to_end(key)
+					self.hits += 1
+					return entry[0]
+				del self._entries[key]
+				self.expirations += 1
+		if self.disk is not None:
+			found = self.disk.get(key)
+			if found is not None and found[1] > now:
+				with self._lock:
+					self.hits += 1
+					self.disk_hits += 1
+				self._remember(key, found[0], found[1])
+				return found[0]
+			if found is not None:
+				self.disk.delete(key)
+				with self._lock:
+					self.expirations += 1
+		with self._lock:
+			self.misses += 1
+		return None
+
+	def put(self, key: str, value: str) -> None:
+		expires = time.time() + self.ttl
+		self._remember(key, value, expires)
+		if self.disk is not None:
+			evicted = self.disk.put(key, value, expires)
+			with self._lock:
+				self.evictions += evicted
+
+	def _remember(self, key: str, value: str, expires: float) -> None:
+		with self._lock:
+			self._entries[key] = (value, expires)
+			self._entries.move_to_end(key)
+			while len(self._entries) > self.max_entries:
+				self._entries.popitem(last=False)
+				self.evictions += 1
+
+	def stats(self) -> Dict[str, int]:
+		with self._lock:
+			return {
+				"hits": self.hits,
+				"disk_hits": self.disk_hits,
+				"misses": self.misses,
+				"evictions": self.evictions,
+				"expirations": self.expirations,
+				"size": len(self._entries),
+			}
+
+
+_shared: Optional[CompletionCache] = None
+_shared_lock = threading.Lock()
+
+
+def shared_cache() -> Optional[CompletionCache]:
+	# One cache per process; Streamlit reruns and Flask requests all reuse it
+	global _shared
+	if os.getenv("COMPLETION_CACHE", "0") != "1":
+		return None
+	with _shared_lock:
+		if _shared is None:
+			state = shared_state()
+			_shared = CompletionCache(
+				max_entries=int(os.getenv("COMPLETION_CACHE_SIZE", "512")),
+				ttl=float(os.getenv("COMPLETION_CACHE_TTL", "3600")),
+				path=os.getenv("COMPLETION_CACHE_PATH") or None,
+				disk_max=int(os.getenv("COMPLETION_CACHE_DISK_MAX", "20000")),
+				tier=SharedTier(state) if state.kind != "memory" else None,
+			)
+	return _shared
@@ -0,0 +1,183 @@
+"""Stopping a reply while it is still being generated.
+
+Front ends run each reply inside a CancelScope. router.py registers every open
+upstream stream with the current scope, so cancel() -- from the Stop button,
+Ctrl+C or a client that went away -- closes the HTTP response at once instead
+of reading (and paying for) the rest of the answer. Whatever arrived before
+that is kept as the reply.
+
+web.py notices dropped connections through DisconnectWatcher, which polls the
+sockets of replies still being written; asgi.py listens for http.disconnect.
+
+	DISCONNECT_POLL_MS  how often watched sockets are checked (default 250)
+"""
+import contextvars
+import os
+import selectors
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_MS", "250")) / 1000.0
+
+
+class Cancelled(Exception):
+	"""The reply was stopped on purpose; not an upstream error."""
+
+
+class CancelScope:
+	def __init__(self) -> None:
+		self.cancelled = False
+		self.reason = ""
+		self._callbacks: List[Callable[[], None]] = []
+		self._lock = threading.Lock()
+
+	def cancel(self, reason: str = "stopped") -> None:
+		with self._lock:
+			if self.cancelled:
+				return
+			self.cancelled = True
+			self.reason = reason
+			callbacks, self._callbacks = self._callbacks, []
+		for callback in callbacks:
+			try:
+				callback()
+			except Exception:
+				pass
+
+	def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+		"""Run `callback` on cancel (now, if already cancelled); returns a function that unregisters it."""
+		with self._lock:
+			if not self.cancelled:
+				self._callbacks.append(callback)
+				return lambda: self._discard(callback)
+		callback()
+		return lambda: None
+
+	def _discard(self, callback: Callable[[], None]) -> None:
+		with self._lock:
+			if callback in self._callbacks:
+				self._callbacks.remove(callback)
+
+	def check(self) -> None:
+		if self.cancelled:
+			raise Cancelled(self.reason)
+
+
+_current: "contextvars.ContextVar[Optional[CancelScope]]" = contextvars.ContextVar("cancel_scope", default=None)
+
+
+def current() -> Optional[CancelScope]:
+	return _current.get()
+
+
+@contextmanager
+def cancel_scope(scope: Optional[CancelScope] = None) -> Iterator[CancelScope]:
+	scope = scope or CancelScope()
+	token = _current.set(scope)
+	try:
+		yield scope
+	finally:
+		_current.reset(token)
+
+
+def cancelled() -> bool:
+	scope = _current.get()
+	return scope is not None and scope.cancelled
+
+
+def check() -> None:
+	scope = _current.get()
+	if scope is not None:
+		scope.check()
+
+
+def on_cancel(callback: Callable[[], None]) -> Callable[[], None]:
+	scope = _current.get()
+	if scope is None:
+		return lambda: None
+	return scope.on_cancel(callback)
+
+
+class DisconnectWatcher:
+	"""One thread that cancels a reply's scope when its client hangs up.
+
+	A worker thread writing a streamed reply only finds out the client is gone
+	when a write fails, and not at all while it waits for the next token. The
+	request body has been read by then, so a watched socket only turns readable
+	when the peer closes it.
+	"""
+
+	def __init__(self, interval: float = POLL_INTERVAL) -> None:
+		self.interval = interval
+		self._selector: Optional[selectors.BaseSelector] = None
+		self._lock = threading.Lock()
+
+	def _start(self) -> selectors.BaseSelector:
+		with self._lock:
+			if self._selector is None:
+				self._selector = selectors.DefaultSelector()
+				threading.Thread(target=self._run, name="disconnect-watcher", daemon=True).start()
+			return self._selector
+
+	@contextmanager
+	def watch(self, sock: Any, scope: CancelScope) -> Iterator[CancelScope]:
+		if not isinstance(sock, socket.socket):
+			# e.g. a server that doesn't expose its socket; failed writes still end the reply
+			yield scope
+			return
+		selector = self._start()
+		try:
+			with self._lock:
+				selector.register(sock, selectors.EVENT_READ, scope)
+		except (KeyError, ValueError, OSError):
+			yield scope
+			return
+		try:
+			yield scope
+		finally:
+			self._forget(sock)
+
+	def _forget(self, sock: socket.socket) -> None:
+		with self._lock:
+			try:
+				self._selector.unregister(sock)
+			except (KeyError, ValueError, OSError):
+				pass
+
+	def _run(self) -> None:
+		while True:
+			with self._lock:
+				empty = not self._selector.get_map()
+			if empty:
+				time.sleep(self.interval)
+				continue
+			try:
+				events = self._selector.select(self.interval)
+			except OSError:
+				continue
+			for key, _ in events:
+				sock = key.fileobj
+				try:
+					gone = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+				except BlockingIOError:
+					continue
+				except ValueError:
+					# TLS sockets can't peek; those rely on failed writes
+					gone = False
+				except OSError:
+					gone = True
+				# Either way stop watching: more request bytes mean the client is still there
+				self._forget(sock)
+				if gone:
+					key.data.cancel("disconnected")
+
+
+_watcher = DisconnectWatcher()
+
+
+def watch_disconnect(environ: Dict[str, Any], scope: CancelScope) -> Any:
+	"""Context manager cancelling `scope` if the client of this WSGI request disconnects."""
+	return _watcher.watch(environ.get("gunicorn.socket") or environ.get("werkzeug.socket"), scope)
@@ -1,10 +1,20 @@
 import os
 import sys
+import threading
 from typing import List, Dict
 
 from dotenv import load_dotenv
 from colorama import Fore, Style, init as colorama_init
-from openai import OpenAI
+
+from context import ContextWindow
+from output import StreamWriter
+from providers import default_settings
+from transcript import Transcript, list_sessions
+
+# The router, completions and the openai SDK (httpx, pydantic) are imported
+# lazily: importing the SDK alone takes longer than everything else here, so it
+# happens on a background thread while the first message is typed.
+# `python -m bench.startup` tracks the time to the first prompt.
 
 
 # Initialize color output for Windows terminals
@@ -14,20 +24,8 @@ colorama_init(autoreset=True)
 load_dotenv()
 
 
-# Choose API key priority: OpenRouter > DeepSeek > OpenAI for compatibility
-API_KEY = (
-	os.getenv("OPENROUTER_API_KEY")
-	or os.getenv("DEEPSEEK_API_KEY")
-	or os.getenv("OPENAI_API_KEY")
-	or ""
-).strip()
-
-# Base URL priority: OpenRouter > DeepSeek > default OpenAI (unused here)
-BASE_URL = (
-	os.getenv("OPENROUTER_BASE_URL")
-	or os.getenv("DEEPSEEK_BASE_URL")
-	or "https://openrouter.ai/api/v1"
-).strip()
+# Key/base URL/model priority: OpenRouter > DeepSeek > OpenAI (see providers.py)
+API_KEY, BASE_URL, DEFAULT_MODEL = default_settings()
 
 if not API_KEY:
 	print(
@@ -38,17 +36,6 @@ if not API_KEY:
 	)
 	sys.exit(1)
 
-# Configure OpenAI-compatible SDK client (OpenRouter compatible)
-client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
-
-# Default chat model priority: OpenRouter > DeepSeek > OpenAI > fallback
-DEFAULT_MODEL = (
-	os.getenv("OPENROUTER_MODEL")
-	or os.getenv("DEEPSEEK_MODEL")
-	or os.getenv("OPENAI_MODEL")
-	or "nousresearch/deephermes-3-llama-3-8b-preview:free"
-)
-
 # Optional OpenRouter ranking headers (see https://openrouter.ai/docs)
 OPENROUTER_REFERER = os.getenv("OPENROUTER_SITE_URL", "").strip()
 OPENROUTER_TITLE = os.getenv("OPENROUTER_SITE_NAME", "").strip()
@@ -75,13 +62,55 @@ def print_info(msg: str) -> None:
 	print(f"{Fore.YELLOW}{msg}{Style.RESET_ALL}")
 
 
+def write_stdout(text: str) -> None:
+	sys.stdout.write(text)
+	sys.stdout.flush()
+
+
+def warm_up(window: ContextWindow) -> threading.Thread:
+	def run() -> None:
+		try:
+			import logging
+
+			import warmup
+
+			# Problems are reported at the prompt (see main), not logged over it
+			logging.getLogger("warmup").addHandler(logging.NullHandler())
+			# Imports the SDK, connects to each provider and loads their model catalogs
+			warmup.run(model=DEFAULT_MODEL)
+			window.counter.warm()
+		except Exception:
+			# Anything real resurfaces, with a proper message, on the first request
+			pass
+
+	thread = threading.Thread(target=run, name="warm-up", daemon=True)
+	thread.start()
+	return thread
+
+
 def main() -> None:
+	if sys.argv[1:2] == ["batch"]:
+		import batch
+		from router import default_router
+
+		batch.main(sys.argv[2:], default_router(), DEFAULT_MODEL, EXTRA_HEADERS, SYSTEM_PROMPT)
+		return
+
 	model = DEFAULT_MODEL
+	# The default model is checked against the provider's catalog by the warm-up
+	default_checked = False
 	messages: List[Dict[str, str]] = [
 		{"role": "system", "content": SYSTEM_PROMPT},
 	]
 
-	print_info("Type '/exit' to quit, '/reset' to clear chat, '/model <name>' to switch model.")
+	window = ContextWindow.from_env()
+	warm_up(window)
+	# Every completed turn is appended to disk, so nothing is lost on exit or /reset
+	session = Transcript.new()
+
+	print_info("Type '/exit' to quit, '/reset' to clear chat, '/model <name>' to switch model, '/context' for token usage, '/cache' for cache stats.")
+	print_info("Ctrl+C stops a reply that is still streaming; at the prompt it quits.")
+	print_info("Sessions: '/save' to get this chat's id, '/load <id>' to reopen one, '/history' to list them.")
 
 	while True:
 		print_user_prefix()
@@ -100,44 +129,123 @@ def main() -> None:
 			break
 		if user_input.lower() == "/reset":
 			messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-			print_info("Conversation reset.")
+			if session.exists:
+				print_info(f"Conversation reset. The previous one is kept as {session.id}.")
+			else:
+				print_info("Conversation reset.")
+			session = Transcript.new()
+			continue
+		if user_input.lower() == "/save":
+			if session.exists:
+				session.sync()
+				print_info(f"Saved as {session.id} ({session.count} messages). Reopen with '/load {session.id}'.")
+			else:
+				print_info("Nothing to save yet.")
+			continue
+		if user_input.lower() == "/history":
+			sessions = list_sessions()
+			if not sessions:
+				print_info("No saved sessions.")
+			for saved in sessions[:20]:
+				current = " *" if saved.id == session.id else ""
+				print_info(f"{saved.id}{current}  {saved.count:>5} messages  {saved.preview()}")
+			continue
+		if user_input.lower().startswith("/load"):
+			parts = user_input.split(maxsplit=1)
+			if len(parts) == 2:
+				try:
+					target = Transcript(parts[1].strip())
+				except ValueError as exc:
+					print_info(str(exc))
+					continue
+			else:
+				recent = list_sessions()
+				target = recent[0] if recent else Transcript.new()
+			if not target.exists:
+				print_info("No such session; '/history' lists them.")
+				continue
+			session = target
+			# Only the newest turns that fit the context window are read from disk
+			messages = session.tail(window.budget_for(model), window.counter.count)
+			if not messages or messages[0]["role"] != "system":
+				messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+			print_info(f"Loaded {session.id}: {len(messages) - 1} of {session.count - 1} messages in context.")
 			continue
 		if user_input.lower().startswith("/model"):
 			parts = user_input.split(maxsplit=1)
 			if len(parts) == 2 and parts[1]:
-				model = parts[1].strip()
-				print_info(f"Model set to: {model}")
+				import warmup
+				from router import default_router
+
+				problem = warmup.check_model(default_router(), parts[1].strip())
+				if problem:
+					print_info(f"{problem} Still using {model}.")
+				else:
+					model = parts[1].strip()
+					print_info(f"Model set to: {model}")
 			else:
 				print_info(f"Current model: {model}")
 			continue
 
+		if user_input.lower() == "/context":
+			stats = window.last
+			if stats:
+				print_info(
+					f"Last request: {stats.tokens_after}/{stats.tokens_before} tokens sent "
+					f"({stats.messages_after}/{stats.messages_before} messages), budget {window.budget_for(model)}."
+				)
+			else:
+				print_info(f"No requests yet. Budget for {model}: {window.budget_for(model)} tokens.")
+			continue
+		if user_input.lower() == "/cache":
+			from cache import shared_cache
+			from semantic import shared_semantic_cache
+
+			cache = shared_cache()
+			print_info(f"Cache: {cache.stats()}" if cache else "Response cache is off (set COMPLETION_CACHE=1).")
+			semantic = shared_semantic_cache()
+			print_info(f"Semantic cache: {semantic.stats()}" if semantic else "Semantic cache is off (set SEMANTIC_CACHE=1).")
+			continue
+
+		import completions
+		import warmup
+		from router import default_router
+
+		warm = warmup.status()
+		if model == DEFAULT_MODEL and not default_checked and warm["ready"]:
+			default_checked = True
+			if warm["model_error"]:
+				print_info(f"{warm['model_error']} Use '/model <name>' to pick another.")
+
 		messages.append({"role": "user", "content": user_input})
+		outgoing, _ = window.fit(messages, model)
 
-		# Stream assistant response
+		# Stream assistant response, writing to the terminal in batches rather than per token
 		print_assistant_prefix()
-		assistant_text_parts: List[str] = []
+		writer = StreamWriter(write_stdout)
 		try:
-			stream = client.chat.completions.create(
-				model=model,
-				messages=messages,
-				stream=True,
-				**({"extra_headers": EXTRA_HEADERS} if EXTRA_HEADERS else {}),
-			)
-			for event in stream:
-				delta = event.choices[0].delta
-				content_piece = getattr(delta, "content", None)
-				if content_piece:
-					assistant_text_parts.append(content_piece)
-					print(content_piece, end="", flush=True)
+			with writer:
+				for content_piece in completions.stream(default_router(), model, outgoing, EXTRA_HEADERS):
+					writer.write(content_piece)
 			print()  # newline after the stream completes
+		except KeyboardInterrupt:
+			# Ctrl+C stops this reply only; leaving the loop closed the upstream stream
+			print(f"\n{Fore.YELLOW}[stopped]{Style.RESET_ALL}")
+			if not writer.text():
+				messages.pop()
+				continue
 		except Exception as exc:
 			print(f"\n{Fore.RED}[error]{Style.RESET_ALL} {exc}")
 			# Remove the last user message on failure to avoid poisoning context
 			messages.pop()
 			continue
 
-		assistant_text = "".join(assistant_text_parts)
+		assistant_text = writer.text()
 		messages.append({"role": "assistant", "content": assistant_text})
+		try:
+			session.append(messages[-2:] if session.exists else [messages[0]] + messages[-2:])
+		except OSError as exc:
+			print(f"{Fore.RED}[transcript not saved]{Style.RESET_ALL} {exc}")
 
 	print_info("Goodbye 👋")
 
@@ -0,0 +1,88 @@
+"""Shared, connection-pooled OpenAI-compatible clients.
+
+Clients are cached per (base_url, api_key), so repeated turns, Streamlit
+reruns and Flask requests reuse warm keep-alive connections instead of paying
+a fresh TLS handshake.
+
+	HTTP_POOL_SIZE        max connections per client (default 20)
+	HTTP_KEEPALIVE_POOL   idle keep-alive connections kept (default 10)
+	HTTP_KEEPALIVE_SECS   how long an idle connection is kept (default 60)
+	HTTP_CONNECT_TIMEOUT  seconds (default 5)
+	HTTP_READ_TIMEOUT     seconds between bytes while streaming (default 120)
+	HTTP2                 "1" to negotiate HTTP/2 when the h2 package is installed
+"""
+import os
+import threading
+from typing import Any, Dict, Tuple
+
+_clients: Dict[Tuple[str, str, bool], Any] = {}
+_lock = threading.Lock()
+
+
+def _http2_enabled() -> bool:
+	if os.getenv("HTTP2", "0") != "1":
+		return False
+	try:
+		import h2  # noqa: F401
+	except ImportError:
+		return False
+	return True
+
+
+def _http_options() -> Dict[str, Any]:
+	# Built from the SDK's own exports so this follows whichever HTTP library
+	# the installed openai version is based on
+	from openai import DEFAULT_CONNECTION_LIMITS, Timeout
+
+	limits = type(DEFAULT_CONNECTION_LIMITS)
+	read = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+	return {
+		"limits": limits(
+			max_connections=int(os.getenv("HTTP_POOL_SIZE", "20")),
+			max_keepalive_connections=int(os.getenv("HTTP_KEEPALIVE_POOL", "10")),
+			keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_SECS", "60")),
+		),
+		"timeout": Timeout(read, connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))),
+		"http2": _http2_enabled(),
+	}
+
+
+def get_client(api_key: str, base_url: str, asynchronous: bool = False) -> Any:
+	key = (base_url.rstrip("/"), api_key, asynchronous)
+	with _lock:
+		client = _clients.get(key)
+		if client is not None:
+			return client
+		from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+		options = _http_options()
+		# Retries are scheduled by router.py/ratelimit.py, which know about every provider
+		if asynchronous:
+			client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=DefaultAsyncHttpxClient(**options))
+		else:
+			client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=DefaultHttpxClient(**options))
+		_clients[key] = client
+		return client
+
+
+def get_async_client(api_key: str, base_url: str) -> Any:
+	return get_client(api_key, base_url, asynchronous=True)
+
+
+def _forget_inherited() -> None:
+	global _lock
+	# A forked child must not share its parent's pooled connections; it builds its own clients
+	_clients.clear()
+	_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_inherited)
+
+
+async def aclose_all() -> None:
+	with _lock:
+		clients = [c for k, c in _clients.items() if k[2]]
+		for k in [k for k in _clients if k[2]]:
+			del _clients[k]
+	for client in clients:
+		await client.close()
@@ -0,0 +1,251 @@
+"""Single-flight de-duplication of identical in-flight completions.
+
+Concurrent requests with the same key (router, model, normalized messages,
+params) share one upstream call. Streaming subscribers fan out from a single
+token stream: a late joiner first gets every chunk produced so far, then
+follows along live. A subscriber whose reply is stopped (see cancel.py) stops
+waiting at once; when the last subscriber goes away the upstream stream is
+closed, even if it is still waiting for its first token.
+
+	COALESCE_REQUESTS  "0" to disable (default on)
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterator, List, Optional
+
+from cancel import Cancelled, CancelScope, cancel_scope, current as current_scope, on_cancel
+from metrics import REGISTRY
+
+COALESCED = REGISTRY.counter("chat_coalesced_requests_total", "Requests served by joining an identical in-flight completion")
+
+
+class Flight:
+	"""Chunks produced by one upstream call, readable by any number of threads."""
+
+	def __init__(self) -> None:
+		self.chunks: List[str] = []
+		self.done = False
+		self.error: Optional[BaseException] = None
+		self.subscribers = 0
+		# The upstream call runs in this scope, not in any one subscriber's
+		self.scope = CancelScope()
+		self._cond = threading.Condition()
+
+	def publish(self, chunk: str) -> None:
+		with self._cond:
+			self.chunks.append(chunk)
+			self._cond.notify_all()
+
+	def finish(self, error: Optional[BaseException] = None) -> None:
+		with self._cond:
+			self.done = True
+			self.error = error
+			self._cond.notify_all()
+
+	def wake(self) -> None:
+		with self._cond:
+			self._cond.notify_all()
+
+	def subscribe(self, scope: Optional[CancelScope] = None) -> Iterator[str]:
+		index = 0
+		while True:
+			with self._cond:
+				while index >= len(self.chunks) and not self.done and not (scope and scope.cancelled):
+					self._cond.wait()
+				if scope is not None:
+					scope.check()
+				pending = self.chunks[index:]
+				index = len(self.chunks)
+				done, error = self.done, self.error
+			yield from pending
+			if done:
+				if error is not None:
+					raise error
+				return
+
+
+class AsyncFlight:
+	"""Event-loop twin of Flight."""
+
+	def __init__(self) -> None:
+		self.chunks: List[str] = []
+		self.done = False
+		self.error: Optional[BaseException] = None
+		self.subscribers = 0
+		self.task: Optional[asyncio.Task] = None
+		self._changed = asyncio.Event()
+
+	def _notify(self) -> None:
+		self._changed.set()
+		self._changed = asyncio.Event()
+
+	def publish(self, chunk: str) -> None:
+		self.chunks.append(chunk)
+		self._notify()
+
+	def finish(self, error: Optional[BaseException] = None) -> None:
+		self.done = True
+		self.error = error
+		self._notify()
+
+	async def subscribe(self) -> AsyncIterator[str]:
+		index = 0
+		while True:
+			if index < len(self.chunks):
+				index += 1
+				yield self.chunks[index - 1]
+			elif self.done:
+				if self.error is not None:
+					raise self.error
+				return
+			else:
+				await self._changed.wait()
+
+
+class Coalescer:
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._flights: Dict[Hashable, Flight] = {}
+		# Only touched from the event loop, so no lock
+		self._async_flights: Dict[Hashable, AsyncFlight] = {}
+		self._async_calls: Dict[Hashable, asyncio.Task] = {}
+
+	def complete(self, key: Hashable, call: Callable[[], str]) -> str:
+		with self._lock:
+			flight = self._flights.get(key)
+			leader = flight is None
+			if leader:
+				flight = self._flights[key] = Flight()
+		if not leader:
+			COALESCED.inc(mode="complete")
+			return "".join(flight.subscribe())
+		try:
+			text = call()
+			flight.publish(text)
+			flight.finish()
+			return text
+		except BaseException as exc:
+			flight.finish(exc)
+			raise
+		finally:
+			with self._lock:
+				self._flights.pop(key, None)
+
+	def stream(self, key: Hashable, source: Callable[[], Iterator[str]]) -> Iterator[str]:
+		with self._lock:
+			flight = self._flights.get(key)
+			leader = flight is None
+			if leader:
+				flight = self._flights[key] = Flight()
+			flight.subscribers += 1
+		if leader:
+			# Upstream is read by its own thread so no single subscriber owns it; the
+			# copied context carries the leader's rate-limit user
+			threading.Thread(target=contextvars.copy_context().run, args=(self._pump, key, flight, source), daemon=True).start()
+		else:
+			COALESCED.inc(mode="stream")
+		stop_waiting = on_cancel(flight.wake)
+		try:
+			yield from flight.subscribe(current_scope())
+		finally:
+			stop_waiting()
+			with self._lock:
+				flight.subscribers -= 1
+				abandoned = flight.subscribers == 0 and not flight.done
+				# Nobody is reading any more; later requests must not join a stream about to be cut
+				if abandoned and self._flights.get(key) is flight:
+					del self._flights[key]
+			if abandoned:
+				flight.scope.cancel("abandoned")
+
+	def _pump(self, key: Hashable, flight: Flight, source: Callable[[], Iterator[str]]) -> None:
+		error: Optional[BaseException] = None
+		with cancel_scope(flight.scope):
+			chunks = source()
+			try:
+				for chunk in chunks:
+					flight.publish(chunk)
+					with self._lock:
+						if flight.subscribers == 0:
+							break
+			except Exception as exc:
+				error = exc
+			finally:
+				close = getattr(chunks, "close", None)
+				if close is not None:
+					close()
+				with self._lock:
+					if self._flights.get(key) is flight:
+						del self._flights[key]
+				flight.finish(error)
+
+	async def acomplete(self, key: Hashable, call: Callable[[], Awaitable[str]]) -> str:
+		task = self._async_calls.get(key)
+		if task is None:
+			task = self._async_calls[key] = asyncio.create_task(call())
+			task.add_done_callback(lambda done: self._forget(key, done))
+		else:
+			COALESCED.inc(mode="complete")
+		# A caller that disconnects must not cancel the call for the others
+		return await asyncio.shield(task)
+
+	def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+		if self._async_calls.get(key) is task:
+			del self._async_calls[key]
+		# Retrieve the outcome even when every caller has gone, so asyncio doesn't log it
+		if not task.cancelled():
+			task.exception()
+
+	async def astream(self, key: Hashable, source: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+		flight = self._async_flights.get(key)
+		if flight is None:
+			flight = self._async_flights[key] = AsyncFlight()
+			flight.task = asyncio.create_task(self._apump(key, flight, source))
+		else:
+			COALESCED.inc(mode="stream")
+		flight.subscribers += 1
+		try:
+			async for chunk in flight.subscribe():
+				yield chunk
+		finally:
+			flight.subscribers -= 1
+			if flight.subscribers == 0 and not flight.done:
+				if self._async_flights.get(key) is flight:
+					del self._async_flights[key]
+				# Cancelling the pump closes the upstream response
+				flight.task.cancel()
+
+	async def _apump(self, key: Hashable, flight: AsyncFlight, source: Callable[[], AsyncIterator[str]]) -> None:
+		error: Optional[BaseException] = None
+		chunks = source()
+		try:
+			async for chunk in chunks:
+				flight.publish(chunk)
+				if flight.subscribers == 0:
+					break
+		except asyncio.CancelledError:
+			error = Cancelled("abandoned")
+			raise
+		except Exception as exc:
+			error = exc
+		finally:
+			await chunks.aclose()
+			if self._async_flights.get(key) is flight:
+				del self._async_flights[key]
+			flight.finish(error)
+
+
+_shared: Optional[Coalescer] = None
+_shared_lock = threading.Lock()
+
+
+def shared_coalescer() -> Optional[Coalescer]:
+	global _shared
+	if os.getenv("COALESCE_REQUESTS", "1") == "0":
+		return None
+	with _shared_lock:
+		if _shared is None:
+			_shared = Coalescer()
+	return _shared
@@ -0,0 +1,135 @@
+"""Chat completion calls shared by chat.py, app.py, web.py and asgi.py.
+
+Every front end goes through complete()/stream() (or their async twins) so the
+response cache and later cross-cutting concerns live in one place. Requests
+are sent through a Router (see router.py), which handles provider fail-over.
+stream() yields text deltas; cached answers are replayed through it in small
+chunks. An exact-match miss falls back to the semantic cache (see semantic.py)
+when it is enabled. Identical requests already in flight share one upstream
+call (see coalesce.py). A reply stopped part-way (see cancel.py) is never
+cached. The async twins run cache lookups and stores in a worker thread, since
+the tiers behind them (SQLite, Redis, the semantic index) block.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Dict, Hashable, Iterator, List, Optional
+
+from cache import cache_key, shared_cache
+from coalesce import shared_coalescer
+from router import Router
+from semantic import shared_semantic_cache
+
+# Size of the pieces a cached answer is replayed in on streaming paths
+REPLAY_CHUNK_CHARS = 48
+
+
+def _replay(text: str) -> Iterator[str]:
+	for i in range(0, len(text), REPLAY_CHUNK_CHARS):
+		yield text[i:i + REPLAY_CHUNK_CHARS]
+
+
+def _cached(key: str, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> Optional[str]:
+	cache = shared_cache()
+	if cache:
+		cached = cache.get(key)
+		if cached is not None:
+			return cached
+	semantic = shared_semantic_cache()
+	if semantic:
+		return semantic.get(model, messages, params)
+	return None
+
+
+def _remember(key: str, model: str, messages: List[Dict[str, str]], params: Dict[str, Any], text: str) -> None:
+	if not text:
+		return
+	cache = shared_cache()
+	if cache:
+		cache.put(key, text)
+	semantic = shared_semantic_cache()
+	if semantic:
+		semantic.put(model, messages, text, params)
+
+
+def _flight_key(mode: str, router: Router, key: str) -> Hashable:
+	# Different routers (e.g. a user-supplied key in app.py) never share calls
+	return (mode, id(router), key)
+
+
+def complete(router: Router, model: str, messages: List[Dict[str, str]], extra_headers: Optional[Dict[str, str]] = None, **params: Any) -> str:
+	key = cache_key(model, messages, params)
+	cached = _cached(key, model, messages, params)
+	if cached is not None:
+		return cached
+
+	def call() -> str:
+		text = router.complete(model, messages, extra_headers, **params)
+		_remember(key, model, messages, params, text)
+		return text
+
+	coalescer = shared_coalescer()
+	if coalescer is None:
+		return call()
+	return coalescer.complete(_flight_key("complete", router, key), call)
+
+
+def stream(router: Router, model: str, messages: List[Dict[str, str]], extra_headers: Optional[Dict[str, str]] = None, **params: Any) -> Iterator[str]:
+	key = cache_key(model, messages, params)
+	cached = _cached(key, model, messages, params)
+	if cached is not None:
+		yield from _replay(cached)
+		return
+
+	def upstream() -> Iterator[str]:
+		parts: List[str] = []
+		for piece in router.stream(model, messages, extra_headers, **params):
+			parts.append(piece)
+			yield piece
+		# Only answers that streamed to completion are cached
+		_remember(key, model, messages, params, "".join(parts))
+
+	coalescer = shared_coalescer()
+	if coalescer is None:
+		yield from upstream()
+		return
+	yield from coalescer.stream(_flight_key("stream", router, key), upstream)
+
+
+async def acomplete(router: Router, model: str, messages: List[Dict[str, str]], extra_headers: Optional[Dict[str, str]] = None, **params: Any) -> str:
+	key = cache_key(model, messages, params)
+	cached = await asyncio.to_thread(_cached, key, model, messages, params)
+	if cached is not None:
+		return cached
+
+	async def call() -> str:
+		text = await router.acomplete(model, messages, extra_headers, **params)
+		await asyncio.to_thread(_remember, key, model, messages, params, text)
+		return text
+
+	coalescer = shared_coalescer()
+	if coalescer is None:
+		return await call()
+	return await coalescer.acomplete(_flight_key("complete", router, key), call)
+
+
+async def astream(router: Router, model: str, messages: List[Dict[str, str]], extra_headers: Optional[Dict[str, str]] = None, **params: Any) -> AsyncIterator[str]:
+	key = cache_key(model, messages, params)
+	cached = await asyncio.to_thread(_cached, key, model, messages, params)
+	if cached is not None:
+		for piece in _replay(cached):
+			yield piece
+		return
+
+	async def upstream() -> AsyncIterator[str]:
+		parts: List[str] = []
+		async for piece in router.astream(model, messages, extra_headers, **params):
+			parts.append(piece)
+			yield piece
+		await asyncio.to_thread(_remember, key, model, messages, params, "".join(parts))
+
+	coalescer = shared_coalescer()
+	if coalescer is None:
+		async for piece in upstream():
+			yield piece
+		return
+	async for piece in coalescer.astream(_flight_key("stream", router, key), upstream):
+		yield piece
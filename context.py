@@ -0,0 +1,207 @@
+"""Token-budgeted context window shared by chat.py, app.py and web.py.
+
+Older turns are dropped until the outgoing list fits the model's prompt budget.
+Leading system messages and the newest turns are always kept.
+
+History is cut at fixed checkpoints (every CONTEXT_TRIM_STEP tokens from the
+start of the conversation) rather than just before the oldest message that
+still fits. The kept prefix then stays byte-identical for several turns, so
+provider prompt caches (see prompt_cache.py) keep hitting once a chat is over
+budget, at the cost of sending up to one step less history.
+
+Stored conversations go through fit_tail(), which reads the history newest
+first, a page at a time, and stops once the budget is covered; the cost of a
+turn doesn't grow with the length of the conversation.
+
+	CONTEXT_BUDGET     default prompt-token budget (default 6000)
+	CONTEXT_BUDGETS    per-model overrides, e.g. "deepseek-chat=12000,gpt-4o-mini=16000"
+	CONTEXT_KEEP_LAST  newest messages that are never dropped (default 4)
+	CONTEXT_TRIM_STEP  tokens between checkpoints (default a quarter of the budget; 0 cuts exactly)
+
+Token counts are cached per message, so each turn only counts what is new.
+tiktoken is used when installed, otherwise a ~4 chars/token estimate.
+"""
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+# Per-message framing overhead used by OpenAI-style chat formats
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _load_encoder() -> Callable[[str], int]:
+	try:
+		import tiktoken
+
+		encoding = tiktoken.get_encoding("cl100k_base")
+		return lambda text: len(encoding.encode(text, disallowed_special=()))
+	except Exception:
+		return lambda text: (len(text) + 3) // 4
+
+
+class TokenCounter:
+	def __init__(self, max_entries: int = 8192) -> None:
+		self.max_entries = max_entries
+		self._encode: Optional[Callable[[str], int]] = None
+		self._cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+		self._lock = threading.Lock()
+
+	def warm(self) -> None:
+		# Loading a tiktoken encoding takes a while; done up front by the CLI
+		if self._encode is None:
+			self._encode = _load_encoder()
+
+	def count(self, message: Mapping[str, object]) -> int:
+		key = (str(message.get("role", "")), str(message.get("content") or ""))
+		with self._lock:
+			cached = self._cache.get(key)
+			if cached is not None:
+				self._cache.move_to_end(key)
+				return cached
+		if self._encode is None:
+			self._encode = _load_encoder()
+		tokens = self._encode(key[1]) + MESSAGE_OVERHEAD_TOKENS
+		with self._lock:
+			self._cache[key] = tokens
+			if len(self._cache) > self.max_entries:
+				self._cache.popitem(last=False)
+		return tokens
+
+
+@dataclass
+class ContextStats:
+	tokens_before: int
+	tokens_after: int
+	messages_before: int
+	messages_after: int
+
+	@property
+	def dropped(self) -> int:
+		return self.messages_before - self.messages_after
+
+	def as_dict(self) -> Dict[str, int]:
+		return {
+			"tokens_before": self.tokens_before,
+			"tokens_after": self.tokens_after,
+			"messages_before": self.messages_before,
+			"messages_after": self.messages_after,
+		}
+
+
+class ContextWindow:
+	def __init__(self, budget: int = 6000, budgets: Optional[Dict[str, int]] = None, keep_last: int = 4, counter: Optional[TokenCounter] = None, trim_step: Optional[int] = None) -> None:
+		self.budget = budget
+		self.budgets = budgets or {}
+		self.keep_last = keep_last
+		# None: a quarter of each model's budget
+		self.trim_step = trim_step
+		self.counter = counter or TokenCounter()
+		self.last: Optional[ContextStats] = None
+		# Running totals so savings can be reported over a process lifetime
+		self.total_before = 0
+		self.total_after = 0
+		self._lock = threading.Lock()
+
+	@classmethod
+	def from_env(cls) -> "ContextWindow":
+		budgets: Dict[str, int] = {}
+		for item in os.getenv("CONTEXT_BUDGETS", "").split(","):
+			name, _, value = item.strip().rpartition("=")
+			if name and value.isdigit():
+				budgets[name] = int(value)
+		step = os.getenv("CONTEXT_TRIM_STEP", "").strip()
+		return cls(
+			budget=int(os.getenv("CONTEXT_BUDGET", "6000")),
+			budgets=budgets,
+			keep_last=int(os.getenv("CONTEXT_KEEP_LAST", "4")),
+			trim_step=int(step) if step else None,
+		)
+
+	def budget_for(self, model: str) -> int:
+		return self.budgets.get(model, self.budget)
+
+	def _checkpoint(self, counts: List[int], head: int, start: int, budget: int) -> int:
+		"""The first checkpoint at or after `start`; `start` itself if that would cut into the newest messages."""
+		step = self.trim_step if self.trim_step is not None else budget // 4
+		if step <= 0:
+			return start
+		# Checkpoints depend only on the messages before them, so they don't move as the chat grows
+		total = 0
+		for index in range(head, len(counts) - self.keep_last):
+			crossed = (total + counts[index]) // step > total // step
+			total += counts[index]
+			if crossed and index + 1 >= start:
+				return index + 1
+		return start
+
+	def fit(self, messages: List[Dict[str, str]], model: str = "") -> Tuple[List[Dict[str, str]], ContextStats]:
+		budget = self.budget_for(model)
+		counts = [self.counter.count(m) for m in messages]
+		head = 0
+		while head < len(messages) and messages[head].get("role") == "system":
+			head += 1
+		# Walk back from the newest message; the newest keep_last always go out
+		used = sum(counts[:head])
+		start = len(messages)
+		while start > head:
+			cost = counts[start - 1]
+			if len(messages) - start >= self.keep_last and used + cost > budget:
+				break
+			used += cost
+			start -= 1
+		if start > head:
+			start = self._checkpoint(counts, head, start, budget)
+			used = sum(counts[:head]) + sum(counts[start:])
+		# Don't open the kept history with a dangling assistant reply
+		while start < len(messages) - 1 and messages[start].get("role") == "assistant" and len(messages) - start > self.keep_last:
+			used -= counts[start]
+			start += 1
+		kept = messages[:head] + messages[start:]
+		stats = ContextStats(
+			tokens_before=sum(counts),
+			tokens_after=used,
+			messages_before=len(messages),
+			messages_after=len(kept),
+		)
+		with self._lock:
+			# Request threads share one window
+			self.last = stats
+			self.total_before += stats.tokens_before
+			self.total_after += stats.tokens_after
+		return kept, stats
+
+	def fit_tail(self, head: List[Dict[str, Any]], load: Callable[[int, Optional[int]], List[Dict[str, Any]]], count: int, model: str = "", page: int = 64) -> Tuple[List[Dict[str, Any]], ContextStats]:
+		"""fit() over only as much of a stored conversation as the budget needs.
+
+		`head` is the conversation's first messages (its system prompt), `count`
+		how many messages it has, and `load(limit, before)` returns its newest
+		`limit` messages with an "id" below `before` (None: the newest), oldest
+		first. Pages start on multiples of `page` in the conversation's own
+		positions, so every read returns only rows the tail may use, and the
+		oldest message read, which checkpoints are counted from, only moves when
+		a whole page is no longer needed. Stats cover the messages read.
+		"""
+		budget = self.budget_for(model)
+		step = self.trim_step if self.trim_step is not None else budget // 4
+		system: List[Dict[str, Any]] = []
+		for m in head:
+			if m.get("role") != "system":
+				break
+			system.append(m)
+		first_id = max((m["id"] for m in system), default=0)
+		tail: List[Dict[str, Any]] = []
+		tokens = sum(self.counter.count(m) for m in system)
+		before: Optional[int] = None
+		# The newest page is the partial one
+		limit = (count - 1) % page + 1 if count else 0
+		while limit and (tokens < budget + max(step, 0) or len(tail) < self.keep_last):
+			rows = load(limit, before)
+			chunk = [m for m in rows if m["id"] > first_id]
+			tail = chunk + tail
+			tokens += sum(self.counter.count(m) for m in chunk)
+			if len(chunk) < limit:
+				break
+			before, limit = rows[0]["id"], page
+		return self.fit(system + tail, model)
@@ -0,0 +1,86 @@
+"""gunicorn settings for web.py; `gunicorn web:app` reads this file automatically.
+
+	WEB_CONCURRENCY   worker processes (default 2 x CPUs + 1, at most 9)
+	GUNICORN_THREADS  threads per worker (default 8; each open reply stream holds one)
+	GUNICORN_TIMEOUT  seconds before a silent worker is restarted (default 120)
+	PORT              port to listen on (default 8000)
+	GUNICORN_PRELOAD  "0" to import the app in each worker instead of once in the master (default 1)
+
+CPUs are counted from the scheduler affinity and any cgroup CPU quota, so a
+container limited to one CPU on a large host doesn't start dozens of workers.
+Workers don't share memory: with more than one, SHARED_STATE defaults to
+"sqlite" so caches, rate limits and metrics stay consistent (see shared.py).
+
+With preload the master imports web.py (and the SDK) once and forks workers
+that share the loaded code, so a restarted worker is serving at once. Each
+worker then opens its own connections to the providers and loads the model
+catalog in the background (see warmup.py); /ready answers 503 until it has.
+"""
+import math
+import os
+
+
+def cpu_count() -> int:
+	try:
+		count = len(os.sched_getaffinity(0))
+	except AttributeError:
+		count = os.cpu_count() or 1
+	quota = None
+	try:
+		# cgroup v2: "<quota> <period>" or "max <period>"
+		with open("/sys/fs/cgroup/cpu.max") as fh:
+			limit, period = fh.read().split()
+		if limit != "max":
+			quota = int(limit) / int(period)
+	except (OSError, ValueError):
+		try:
+			# cgroup v1
+			with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as fh:
+				limit = int(fh.read())
+			with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as fh:
+				period = int(fh.read())
+			if limit > 0:
+				quota = limit / period
+		except (OSError, ValueError):
+			pass
+	if quota is not None:
+		count = min(count, max(1, math.ceil(quota)))
+	return max(1, count)
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Replies are streamed and mostly spent waiting on the upstream, so threads carry the concurrency
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(2 * cpu_count() + 1, 9))))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+def nworkers_changed(server, new_value, old_value):
+	# First called with the final count (including -w), before a preloaded app is imported
+	if old_value is None and new_value > 1:
+		os.environ.setdefault("SHARED_STATE", "sqlite")
+
+
+def on_starting(server):
+	# server.cfg has the final numbers, including -w/--threads from the command line
+	count = server.cfg.workers
+	if server.cfg.preload_app:
+		import warmup
+
+		warmup.preload()
+	server.log.info("%d workers x %d threads, shared state: %s", count, server.cfg.threads, os.getenv("SHARED_STATE", "memory"))
+	if count > 1 and os.getenv("CONVERSATION_STORE", "").strip().lower() == "memory":
+		server.log.warning("CONVERSATION_STORE=memory with %d workers: each worker sees different conversations", count)
+
+
+def post_worker_init(worker):
+	# Workers of `gunicorn asgi:app -k uvicorn.workers.UvicornWorker` warm up from the app's lifespan instead
+	if "uvicorn" in worker.cfg.worker_class_str.lower():
+		return
+	import warmup
+
+	warmup.start()
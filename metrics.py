@@ -0,0 +1,318 @@
+"""Prometheus-style metrics for upstream completion calls.
+
+Recorded by router.py for every attempt, so chat.py, app.py, web.py and
+asgi.py are all covered. web.py serves the text exposition at /metrics.
+
+	METRICS_JSON_LOG  "1" to also log one JSON line per request (logger "potato.requests")
+
+Recording is a few dict updates under a lock; nothing is formatted until
+/metrics is scraped or the JSON log is enabled. Under several worker processes
+Registry.share() publishes each worker's counters and histograms to the
+shared state (see shared.py) every few seconds, and /metrics reports their sum.
+"""
+import bisect
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+logger = logging.getLogger("potato.requests")
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+	return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Sequence[Tuple[str, str]] = ()) -> str:
+	items = list(labels) + list(extra)
+	if not items:
+		return ""
+	escaped = ('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in items)
+	return "{" + ",".join(escaped) + "}"
+
+
+class Counter:
+	def __init__(self, name: str, help_text: str) -> None:
+		self.name = name
+		self.help = help_text
+		self.values: Dict[Labels, float] = {}
+		self._lock = threading.Lock()
+
+	def inc(self, amount: float = 1.0, **labels: str) -> None:
+		key = _labels(labels)
+		with self._lock:
+			self.values[key] = self.values.get(key, 0.0) + amount
+
+	def snapshot(self) -> Dict[Labels, float]:
+		with self._lock:
+			return dict(self.values)
+
+	def merge(self, into: Dict[Labels, float], values: Dict[Labels, float]) -> None:
+		for labels, value in values.items():
+			into[labels] = into.get(labels, 0.0) + value
+
+	def render(self, values: Optional[Dict[Labels, float]] = None) -> List[str]:
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+		for labels, value in sorted((self.snapshot() if values is None else values).items()):
+			lines.append(f"{self.name}{_format_labels(labels)} {value:g}")
+		return lines
+
+
+class Histogram:
+	def __init__(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+		self.name = name
+		self.help = help_text
+		self.buckets = tuple(buckets)
+		# labels -> [per-bucket counts..., +Inf count, sum]
+		self.values: Dict[Labels, List[float]] = {}
+		self._lock = threading.Lock()
+
+	def observe(self, value: float, **labels: str) -> None:
+		key = _labels(labels)
+		index = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			row = self.values.get(key)
+			if row is None:
+				row = self.values[key] = [0.0] * (len(self.buckets) + 2)
+			row[index] += 1
+			row[-1] += value
+
+	def snapshot(self) -> Dict[Labels, List[float]]:
+		with self._lock:
+			return {labels: list(row) for labels, row in self.values.items()}
+
+	def merge(self, into: Dict[Labels, List[float]], values: Dict[Labels, List[float]]) -> None:
+		for labels, row in values.items():
+			if len(row) != len(self.buckets) + 2:
+				# Published by a worker running different bucket bounds
+				continue
+			current = into.get(labels)
+			into[labels] = list(row) if current is None else [a + b for a, b in zip(current, row)]
+
+	def render(self, values: Optional[Dict[Labels, List[float]]] = None) -> List[str]:
+		lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+		for labels, row in sorted((self.snapshot() if values is None else values).items()):
+			cumulative = 0.0
+			for bound, count in zip(self.buckets, row):
+				cumulative += count
+				lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative:g}")
+			cumulative += row[len(self.buckets)]
+			lines.append(f"{self.name}_bucket{_format_labels(labels, [('le', '+Inf')])} {cumulative:g}")
+			lines.append(f"{self.name}_sum{_format_labels(labels)} {row[-1]:g}")
+			lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative:g}")
+		return lines
+
+
+class Registry:
+	def __init__(self) -> None:
+		self.metrics: List[Any] = []
+		# Callables returning (name, type, help, [(labels, value)]) for state owned elsewhere
+		self.collectors: List[Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]] = []
+		self.shared: Any = None
+		self._publish_lock = threading.Lock()
+		self.publish_interval = 5.0
+
+	def counter(self, name: str, help_text: str) -> Counter:
+		metric = Counter(name, help_text)
+		self.metrics.append(metric)
+		return metric
+
+	def histogram(self, name: str, help_text: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+		metric = Histogram(name, help_text, buckets)
+		self.metrics.append(metric)
+		return metric
+
+	def register_collector(self, collector: Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]]) -> None:
+		self.collectors.append(collector)
+
+	def share(self, state: Any, interval: float = 5.0) -> None:
+		"""Publish to `state` (a shared.SharedState) and render totals across processes."""
+		self.shared = state
+		self.publish_interval = interval
+		self._start_publisher()
+		# gunicorn forks workers (from a preloaded master too); each needs its own publisher
+		# thread, and none may fork in the middle of a publish holding a metric's lock
+		os.register_at_fork(
+			before=lambda: self._publish_lock.acquire(),
+			after_in_parent=lambda: self._publish_lock.release(),
+			after_in_child=self._after_fork,
+		)
+
+	def _after_fork(self) -> None:
+		self._publish_lock = threading.Lock()
+		self._start_publisher()
+
+	def _publish_key(self) -> str:
+		return f"metrics:{socket.gethostname()}:{os.getpid()}"
+
+	def publish(self) -> None:
+		with self._publish_lock:
+			payload = {
+				metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+				for metric in self.metrics
+			}
+			# Entries outlive a few missed publishes, then a dead worker drops out of the totals
+			self.shared.set(self._publish_key(), json.dumps(payload), self.publish_interval * 6)
+
+	def _start_publisher(self) -> None:
+		def run() -> None:
+			while True:
+				time.sleep(self.publish_interval)
+				try:
+					self.publish()
+				except Exception:
+					logging.getLogger(__name__).exception("could not publish metrics")
+
+		threading.Thread(target=run, name="metrics-publisher", daemon=True).start()
+
+	def _merged(self) -> Dict[str, Dict[Labels, Any]]:
+		own = self._publish_key()
+		totals: Dict[str, Dict[Labels, Any]] = {metric.name: metric.snapshot() for metric in self.metrics}
+		by_name = {metric.name: metric for metric in self.metrics}
+		for key, payload in self.shared.items("metrics:").items():
+			if key == own:
+				continue
+			for name, samples in json.loads(payload).items():
+				metric = by_name.get(name)
+				if metric is not None:
+					metric.merge(totals[name], {tuple(tuple(pair) for pair in labels): value for labels, value in samples})
+		return totals
+
+	def render(self) -> str:
+		lines: List[str] = []
+		totals = self._merged() if self.shared is not None else {}
+		for metric in self.metrics:
+			lines.extend(metric.render(totals.get(metric.name)))
+		for collector in self.collectors:
+			for name, kind, help_text, samples in collector():
+				lines.append(f"# HELP {name} {help_text}")
+				lines.append(f"# TYPE {name} {kind}")
+				for labels, value in samples:
+					lines.append(f"{name}{_format_labels(_labels(labels))} {value:g}")
+		return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter("chat_completion_requests_total", "Upstream completion attempts by outcome")
+TTFT = REGISTRY.histogram("chat_completion_ttft_seconds", "Time to first token of streamed completions")
+LATENCY = REGISTRY.histogram("chat_completion_latency_seconds", "Total upstream completion latency")
+TOKENS = REGISTRY.counter("chat_completion_tokens_total", "Tokens reported in upstream usage")
+PROMPT_CACHE_TOKENS = REGISTRY.counter("chat_prompt_cache_tokens_total", "Prompt tokens read from or written to the provider's prompt cache")
+# Split by whether any of the prompt came from the provider's cache, to see what caching saves
+PROMPT_CACHE_TTFT = REGISTRY.histogram("chat_prompt_cache_ttft_seconds", "Time to first token of streamed completions by prompt-cache outcome")
+CANCELLED = REGISTRY.counter("chat_cancelled_streams_total", "Streams closed early because the reply was stopped")
+SAVED_TOKENS = REGISTRY.counter("chat_cancelled_tokens_saved_total", "Estimated completion tokens not generated thanks to cancellation")
+
+# Weight of the newest finished reply in the typical reply length per model
+LENGTH_ALPHA = 0.1
+_typical_length: Dict[Tuple[str, str], float] = {}
+_typical_lock = threading.Lock()
+
+JSON_LOG = os.getenv("METRICS_JSON_LOG", "0") == "1"
+if JSON_LOG and not logger.handlers:
+	_handler = logging.StreamHandler()
+	_handler.setFormatter(logging.Formatter("%(message)s"))
+	logger.addHandler(_handler)
+	logger.setLevel(logging.INFO)
+
+
+class Trace:
+	"""One upstream attempt; call first_token()/usage() as they happen, then finish()."""
+
+	__slots__ = ("provider", "model", "stream", "started", "ttft", "prompt_tokens", "completion_tokens", "cached_tokens", "cache_write_tokens", "pieces", "extra")
+
+	def __init__(self, provider: str, model: str, stream: bool) -> None:
+		self.provider = provider
+		self.model = model
+		self.stream = stream
+		self.started = time.monotonic()
+		self.ttft: Optional[float] = None
+		self.prompt_tokens: Optional[int] = None
+		self.completion_tokens: Optional[int] = None
+		# None when the provider doesn't report prompt caching at all
+		self.cached_tokens: Optional[int] = None
+		self.cache_write_tokens: Optional[int] = None
+		# Streamed deltas, roughly one token each; the usage chunk never comes if the stream is cut
+		self.pieces = 0
+		self.extra: Dict[str, Any] = {}
+
+	def first_token(self) -> None:
+		if self.ttft is None:
+			self.ttft = time.monotonic() - self.started
+
+	def piece(self) -> None:
+		self.pieces += 1
+
+	def usage(self, usage: Any) -> None:
+		if usage is None:
+			return
+		self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+		self.completion_tokens = getattr(usage, "completion_tokens", None)
+		# OpenAI-style prompt_tokens_details (OpenRouter, OpenAI), or DeepSeek's own fields
+		details = getattr(usage, "prompt_tokens_details", None)
+		cached = getattr(details, "cached_tokens", None)
+		if cached is None:
+			cached = getattr(usage, "prompt_cache_hit_tokens", None)
+		self.cached_tokens = cached
+		self.cache_write_tokens = getattr(details, "cache_write_tokens", None)
+
+	def _learn_length(self, tokens: int) -> None:
+		key = (self.provider, self.model)
+		with _typical_lock:
+			previous = _typical_length.get(key)
+			_typical_length[key] = tokens if previous is None else previous + LENGTH_ALPHA * (tokens - previous)
+
+	def expected_length(self) -> float:
+		"""Typical completion length of finished replies from this endpoint (0 until one has finished)."""
+		with _typical_lock:
+			return _typical_length.get((self.provider, self.model), 0.0)
+
+	def finish(self, error: Optional[BaseException] = None, status: Optional[str] = None) -> None:
+		latency = time.monotonic() - self.started
+		error_class = type(error).__name__ if error is not None else ""
+		status = status or ("error" if error is not None else "ok")
+		REQUESTS.inc(provider=self.provider, model=self.model, status=status, error=error_class)
+		LATENCY.observe(latency, provider=self.provider, model=self.model)
+		if self.ttft is not None:
+			TTFT.observe(self.ttft, provider=self.provider, model=self.model)
+		if self.prompt_tokens:
+			TOKENS.inc(self.prompt_tokens, provider=self.provider, model=self.model, direction="in")
+		if self.completion_tokens:
+			TOKENS.inc(self.completion_tokens, provider=self.provider, model=self.model, direction="out")
+		if self.cached_tokens:
+			PROMPT_CACHE_TOKENS.inc(self.cached_tokens, provider=self.provider, model=self.model, kind="read")
+		if self.cache_write_tokens:
+			PROMPT_CACHE_TOKENS.inc(self.cache_write_tokens, provider=self.provider, model=self.model, kind="write")
+		if self.ttft is not None and self.cached_tokens is not None:
+			PROMPT_CACHE_TTFT.observe(self.ttft, provider=self.provider, model=self.model, cache="hit" if self.cached_tokens else "miss")
+		if status == "ok" and self.completion_tokens:
+			self._learn_length(self.completion_tokens)
+		elif status == "cancelled":
+			CANCELLED.inc(provider=self.provider, model=self.model)
+			saved = self.expected_length() - (self.completion_tokens or self.pieces)
+			if saved > 0:
+				SAVED_TOKENS.inc(saved, provider=self.provider, model=self.model)
+				self.extra["tokens_saved"] = round(saved)
+		if JSON_LOG:
+			logger.info(json.dumps({
+				"event": "chat_completion",
+				"provider": self.provider,
+				"model": self.model,
+				"stream": self.stream,
+				"status": status,
+				"error": error_class,
+				"ttft_ms": round(self.ttft * 1000, 1) if self.ttft is not None else None,
+				"latency_ms": round(latency * 1000, 1),
+				"tokens_in": self.prompt_tokens,
+				"tokens_out": self.completion_tokens,
+				"tokens_cached": self.cached_tokens,
+				**self.extra,
+			}))
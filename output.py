@@ -0,0 +1,146 @@
+"""Batched output of streamed replies for chat.py, app.py and render.py.
+
+Writing on every delta costs one terminal flush or one Streamlit redraw per
+token, and re-joining the whole reply for each redraw makes long answers
+quadratic. StreamWriter buffers deltas and hands them on at most every
+STREAM_FLUSH_MS (sooner once STREAM_FLUSH_CHARS have piled up), with a final
+flush at the end; a delta is never held back longer than STREAM_FLUSH_MS.
+MarkdownBlocks splits a growing reply into blocks that can no longer change,
+so only the unfinished tail ever has to be redrawn.
+
+	STREAM_FLUSH_MS     minimum gap between flushes (default 40)
+	STREAM_FLUSH_CHARS  buffered characters that force a flush (default 1024)
+"""
+import os
+import re
+import threading
+import time
+from typing import Callable, List, Optional
+
+FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_MS", "40")) / 1000.0
+FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "1024"))
+
+FENCE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+# Lines that continue the previous block even after a blank line
+CONTINUATION = re.compile(r"^(\s|[-*+]\s|\d+[.)]\s)")
+
+
+class StreamWriter:
+	"""Collect deltas and pass them to `sink` in batches.
+
+	The first delta goes out immediately, so time to first token is unchanged.
+	A delta held back for batching is flushed by a timer once the interval is
+	up, so text never waits on the next delta when the upstream pauses.
+	`on_thread` is called with each timer thread before it starts (app.py
+	attaches the Streamlit script context there); `sink` is only ever called by
+	one thread at a time.
+	"""
+
+	def __init__(self, sink: Callable[[str], None], interval: float = FLUSH_INTERVAL, max_chars: int = FLUSH_CHARS, on_thread: Optional[Callable[[threading.Thread], object]] = None) -> None:
+		self.sink = sink
+		self.interval = interval
+		self.max_chars = max_chars
+		self.on_thread = on_thread
+		self.parts: List[str] = []
+		self.flushes = 0
+		self._pending: List[str] = []
+		self._size = 0
+		self._last = 0.0
+		self._timer: Optional[threading.Timer] = None
+		self._lock = threading.Lock()
+
+	def write(self, delta: str) -> None:
+		if not delta:
+			return
+		with self._lock:
+			self.parts.append(delta)
+			self._pending.append(delta)
+			self._size += len(delta)
+			wait = self.interval - (time.monotonic() - self._last)
+			due = self._size >= self.max_chars or wait <= 0
+			if not due and self._timer is None:
+				self._timer = threading.Timer(wait, self.flush)
+				self._timer.daemon = True
+				if self.on_thread:
+					self.on_thread(self._timer)
+				self._timer.start()
+		if due:
+			self.flush()
+
+	def flush(self) -> None:
+		with self._lock:
+			if self._timer is not None:
+				# Harmless when called from the timer itself
+				self._timer.cancel()
+				self._timer = None
+			if not self._pending:
+				return
+			chunk = "".join(self._pending)
+			self._pending.clear()
+			self._size = 0
+			# Under the lock, so a timer flush and a write flush can't reorder chunks
+			self.sink(chunk)
+			self.flushes += 1
+			self._last = time.monotonic()
+
+	def text(self) -> str:
+		return "".join(self.parts)
+
+	def __enter__(self) -> "StreamWriter":
+		return self
+
+	def __exit__(self, *exc: object) -> None:
+		# Also on errors, so whatever arrived is shown before the error
+		self.flush()
+
+
+class MarkdownBlocks:
+	"""Split a streamed Markdown reply into finished blocks and an open tail.
+
+	A block is finished once a blank line outside a code fence is followed by
+	a line that doesn't continue it (list items and indented lines do). Only
+	the tail is kept, so each delta costs time proportional to the open block.
+	"""
+
+	def __init__(self) -> None:
+		self.tail = ""
+		self._scan = 0
+		self._fence: Optional[str] = None
+		self._after_blank = False
+
+	def feed(self, delta: str) -> str:
+		"""Add a delta; returns the text of any blocks it finished ("" if none)."""
+		self.tail += delta
+		boundary = 0
+		while True:
+			end = self.tail.find("\n", self._scan)
+			if end < 0:
+				break
+			start, line = self._scan, self.tail[self._scan:end]
+			self._scan = end + 1
+			fence = FENCE.match(line)
+			if self._fence:
+				marker = fence.group(1) if fence else ""
+				if marker[:1] == self._fence[:1] and len(marker) >= len(self._fence) and not line[fence.end():].strip():
+					self._fence = None
+				continue
+			if not line.strip():
+				self._after_blank = True
+				continue
+			if self._after_blank and not CONTINUATION.match(line):
+				boundary = start
+			self._after_blank = False
+			if fence:
+				self._fence = fence.group(1)
+		if not boundary:
+			return ""
+		finished, self.tail = self.tail[:boundary], self.tail[boundary:]
+		self._scan -= boundary
+		return finished
+
+	def finish(self) -> str:
+		rest, self.tail = self.tail, ""
+		self._scan = 0
+		self._fence = None
+		self._after_blank = False
+		return rest
@@ -0,0 +1,64 @@
+"""Provider-side prompt (prefix) caching.
+
+Providers can reuse the processed prefix of a prompt they have seen recently,
+which cuts time to first token and input cost on long chats. OpenAI, DeepSeek
+and most others do it automatically for any byte-identical prefix; Anthropic
+and Gemini models behind OpenRouter only cache up to explicit cache_control
+breakpoints. router.py passes every request through prepare(), which adds the
+breakpoints for endpoints that need them: one on the system prompt and one on
+each of the last two user turns, so each request reads what the previous one
+wrote. Keeping the prefix byte-identical is ContextWindow's job (context.py).
+
+	PROMPT_CACHE         "0" to never add breakpoints (default on)
+	<NAME>_PROMPT_CACHE  "breakpoints" or "auto" for one provider (default:
+	                     breakpoints for anthropic/ and google/gemini models on
+	                     OpenRouter, auto otherwise)
+
+Cached-token counts from the usage of each response are recorded by metrics.py.
+"""
+import os
+from typing import Any, Dict, List
+
+from providers import Provider
+
+# Anthropic accepts at most four per request
+MAX_BREAKPOINTS = 4
+BREAKPOINT_MODEL_PREFIXES = ("anthropic/", "google/gemini")
+
+
+def cache_mode(provider: Provider, model: str) -> str:
+	if os.getenv("PROMPT_CACHE", "1") == "0":
+		return "auto"
+	configured = (os.getenv(f"{provider.name.upper()}_PROMPT_CACHE") or "").strip().lower()
+	if configured in ("breakpoints", "auto"):
+		return configured
+	if "openrouter.ai" in provider.base_url and model.startswith(BREAKPOINT_MODEL_PREFIXES):
+		return "breakpoints"
+	return "auto"
+
+
+def _marked(message: Dict[str, Any]) -> Dict[str, Any]:
+	content = message.get("content")
+	if not isinstance(content, str) or not content:
+		return message
+	return dict(message, content=[{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}])
+
+
+def with_breakpoints(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+	"""A copy of `messages` with cache_control on the system prompt and the last two user turns."""
+	marks: List[int] = []
+	head = 0
+	while head < len(messages) and messages[head].get("role") == "system":
+		head += 1
+	if head:
+		marks.append(head - 1)
+	users = [i for i in range(head, len(messages)) if messages[i].get("role") == "user"]
+	marks.extend(users[-2:])
+	marks = marks[-MAX_BREAKPOINTS:]
+	return [_marked(m) if i in marks else m for i, m in enumerate(messages)]
+
+
+def prepare(provider: Provider, model: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+	if cache_mode(provider, model) == "breakpoints":
+		return with_breakpoints(messages)
+	return messages
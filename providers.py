@@ -0,0 +1,75 @@
+"""Provider configuration shared by chat.py, app.py, web.py and asgi.py.
+
+Each provider is read from <NAME>_API_KEY, <NAME>_BASE_URL and <NAME>_MODEL.
+PROVIDERS lists them in priority order (default "openrouter,deepseek,openai");
+any other name can be added the same way, e.g. PROVIDERS=openrouter,local with
+LOCAL_API_KEY / LOCAL_BASE_URL / LOCAL_MODEL pointing at a stub server.
+<NAME>_FALLBACK_MODELS is an optional comma list of extra models to fail over to.
+"""
+import os
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+FALLBACK_MODEL = "nousresearch/deephermes-3-llama-3-8b-preview:free"
+
+# Used for fail-over endpoints when <NAME>_MODEL isn't set
+DEFAULT_MODELS = {
+	"openrouter": FALLBACK_MODEL,
+	"deepseek": "deepseek-chat",
+	"openai": "gpt-4o-mini",
+}
+
+DEFAULT_BASE_URLS = {
+	"openrouter": "https://openrouter.ai/api/v1",
+	"deepseek": "https://api.deepseek.com",
+	"openai": "https://api.openai.com/v1",
+}
+
+
+@dataclass(frozen=True)
+class Provider:
+	name: str
+	api_key: str
+	base_url: str
+	models: Tuple[str, ...] = field(default_factory=tuple)
+
+
+def default_settings() -> Tuple[str, str, str]:
+	# Choose API key priority: OpenRouter > DeepSeek > OpenAI for compatibility
+	api_key = (
+		os.getenv("OPENROUTER_API_KEY")
+		or os.getenv("DEEPSEEK_API_KEY")
+		or os.getenv("OPENAI_API_KEY")
+		or ""
+	).strip()
+	# Base URL priority: OpenRouter > DeepSeek > default OpenRouter endpoint
+	base_url = (
+		os.getenv("OPENROUTER_BASE_URL")
+		or os.getenv("DEEPSEEK_BASE_URL")
+		or "https://openrouter.ai/api/v1"
+	).strip()
+	# Default chat model priority: OpenRouter > DeepSeek > OpenAI > fallback
+	model = (
+		os.getenv("OPENROUTER_MODEL")
+		or os.getenv("DEEPSEEK_MODEL")
+		or os.getenv("OPENAI_MODEL")
+		or FALLBACK_MODEL
+	)
+	return api_key, base_url, model
+
+
+def load_providers() -> List[Provider]:
+	providers: List[Provider] = []
+	names = os.getenv("PROVIDERS", "openrouter,deepseek,openai")
+	for name in [n.strip().lower() for n in names.split(",") if n.strip()]:
+		prefix = name.upper()
+		api_key = (os.getenv(f"{prefix}_API_KEY") or "").strip()
+		if not api_key:
+			continue
+		base_url = (os.getenv(f"{prefix}_BASE_URL") or DEFAULT_BASE_URLS.get(name, "")).strip()
+		if not base_url:
+			continue
+		models = [os.getenv(f"{prefix}_MODEL") or DEFAULT_MODELS.get(name, "")]
+		models += (os.getenv(f"{prefix}_FALLBACK_MODELS") or "").split(",")
+		providers.append(Provider(name, api_key, base_url, tuple(m.strip() for m in models if m.strip())))
+	return providers
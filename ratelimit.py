@@ -0,0 +1,381 @@
+"""Client-side rate limiting and retry scheduling for upstream calls.
+
+Each provider gets an adaptive token bucket. It starts at RATE_LIMIT_RPS, is
+halved on a 429 and creeps back up on success, never hands out more than the
+x-ratelimit-remaining header says is left, and pauses for Retry-After or
+until the advertised reset. Requests that find the bucket empty wait in a
+bounded queue that is served round-robin across users (see as_user()), so a
+burst is smoothed instead of failed and one user's burst cannot starve the
+rest. With SHARED_STATE set (see shared.py) the bucket itself lives in the
+shared backend, so RATE_LIMIT_RPS holds across every worker process; the
+queues and the adaptive rate stay per process. Round trips to the shared
+backend are made without holding the limiter's lock, and off the event loop
+in the async paths.
+
+	RATE_LIMIT_RPS       starting and maximum requests/second per provider (default 5, 0 disables)
+	RATE_LIMIT_MIN_RPS   floor the rate can be cut to after 429s (default 0.2)
+	RATE_LIMIT_BURST     bucket size (default 10)
+	RATE_QUEUE_PER_USER  requests one user may have waiting per provider (default 4)
+	RETRY_DEADLINE_SECS  total time a request may spend queued and retrying (default 30)
+	RETRY_BASE_MS        first backoff step (default 500)
+	RETRY_MAX_MS         backoff cap (default 8000)
+"""
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, Mapping, Optional, Tuple
+
+from shared import SharedState, shared_state
+
+RATE = float(os.getenv("RATE_LIMIT_RPS", "5"))
+MIN_RATE = float(os.getenv("RATE_LIMIT_MIN_RPS", "0.2"))
+BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+QUEUE_PER_USER = int(os.getenv("RATE_QUEUE_PER_USER", "4"))
+RETRY_DEADLINE = float(os.getenv("RETRY_DEADLINE_SECS", "30"))
+RETRY_BASE = float(os.getenv("RETRY_BASE_MS", "500")) / 1000
+RETRY_MAX = float(os.getenv("RETRY_MAX_MS", "8000")) / 1000
+# Share of the maximum rate won back per successful request
+RECOVERY = 0.05
+
+DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+_user: ContextVar[str] = ContextVar("rate_limit_user", default="")
+
+
+class RateLimited(Exception):
+	"""No upstream slot could be had before the deadline, or the user's queue is full."""
+
+
+@contextmanager
+def as_user(user: str) -> Iterator[None]:
+	# Queue fairness is per user; web front ends pass the conversation id
+	token = _user.set(user)
+	try:
+		yield
+	finally:
+		_user.reset(token)
+
+
+def status_of(exc: BaseException) -> Optional[int]:
+	status = getattr(exc, "status_code", None)
+	return status if isinstance(status, int) else None
+
+
+def headers_of(exc: BaseException) -> Mapping[str, str]:
+	response = getattr(exc, "response", None)
+	headers = getattr(response, "headers", None)
+	return headers if hasattr(headers, "get") else {}
+
+
+def _seconds(value: Optional[str]) -> Optional[float]:
+	if not value:
+		return None
+	value = value.strip()
+	try:
+		number = float(value)
+	except ValueError:
+		parts = DURATION.findall(value)
+		return sum(float(n) * UNITS[unit] for n, unit in parts) if parts else None
+	# Reset headers are either a delay or an epoch timestamp (OpenRouter sends ms)
+	if number > 1e12:
+		return max(0.0, number / 1000 - time.time())
+	if number > 1e9:
+		return max(0.0, number - time.time())
+	return number
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+	ms = headers.get("retry-after-ms")
+	if ms:
+		try:
+			return float(ms) / 1000
+		except ValueError:
+			pass
+	return _seconds(headers.get("retry-after"))
+
+
+def rate_headers(headers: Mapping[str, str]) -> Tuple[Optional[int], Optional[float]]:
+	"""(remaining requests, seconds until the window resets) from x-ratelimit-* headers."""
+	remaining = headers.get("x-ratelimit-remaining-requests") or headers.get("x-ratelimit-remaining")
+	reset = headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset")
+	try:
+		count = int(float(remaining)) if remaining is not None else None
+	except ValueError:
+		count = None
+	return count, _seconds(reset)
+
+
+def retryable(exc: BaseException) -> bool:
+	if isinstance(exc, RateLimited):
+		return False
+	status = status_of(exc)
+	if status is not None:
+		return status in (408, 409, 429) or status >= 500
+	import openai
+
+	# Connection drops, timeouts and errors sent inside a stream before its first token
+	return isinstance(exc, (openai.APIError, ConnectionError, TimeoutError))
+
+
+def backoff(attempt: int, hint: Optional[float] = None) -> float:
+	# Full jitter, but never sooner than the server asked for
+	return max(random.uniform(0, min(RETRY_MAX, RETRY_BASE * 2 ** attempt)), hint or 0.0)
+
+
+def deadline() -> float:
+	return time.monotonic() + RETRY_DEADLINE
+
+
+class Waiter:
+	__slots__ = ("user", "wake", "granted")
+
+	def __init__(self, user: str, wake: Callable[[], None]) -> None:
+		self.user = user
+		self.wake = wake
+		self.granted = False
+
+
+class ProviderLimiter:
+	def __init__(
+		self,
+		name: str,
+		rate: float = RATE,
+		min_rate: float = MIN_RATE,
+		burst: float = BURST,
+		per_user: int = QUEUE_PER_USER,
+		shared: Optional[SharedState] = None,
+		bucket: str = "",
+	) -> None:
+		self.name = name
+		self.shared = shared
+		self.bucket = bucket or name
+		self.max_rate = rate
+		self.rate = rate
+		self.min_rate = min(min_rate, rate)
+		self.burst = max(1.0, burst)
+		self.per_user = max(1, per_user)
+		self.tokens = self.burst
+		self.updated = time.monotonic()
+		self.paused_until = 0.0
+		# user -> waiters; the first user is served next, then moves to the back
+		self._queues: "OrderedDict[str, Deque[Waiter]]" = OrderedDict()
+		# Set while a thread is taking shared tokens for the queue, so others don't pile on
+		self._dispatching = False
+		self._lock = threading.Lock()
+
+	@property
+	def enabled(self) -> bool:
+		return self.max_rate > 0
+
+	def _refill(self, now: float) -> None:
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def _take_local(self, now: float) -> float:
+		# Caller holds the lock. 0.0 when a token was taken, else seconds until one is due.
+		if now < self.paused_until:
+			return self.paused_until - now
+		self._refill(now)
+		if self.tokens >= 1:
+			self.tokens -= 1
+			return 0.0
+		return (1 - self.tokens) / self.rate
+
+	def _take_shared(self) -> float:
+		# Caller must not hold the lock: this is a round trip to the shared backend
+		with self._lock:
+			pause = self.paused_until - time.monotonic()
+			rate = self.rate
+		if pause > 0:
+			return pause
+		return self.shared.take(self.bucket, rate, self.burst)
+
+	def _grant_next(self) -> None:
+		# Caller holds the lock
+		user, waiters = self._queues.popitem(last=False)
+		waiter = waiters.popleft()
+		if waiters:
+			self._queues[user] = waiters
+		waiter.granted = True
+		waiter.wake()
+
+	def _dispatch(self) -> float:
+		"""Hand tokens to queued waiters; returns how long until another could be handed out."""
+		if self.shared is None:
+			with self._lock:
+				now = time.monotonic()
+				while self._queues:
+					wait = self._take_local(now)
+					if wait > 0:
+						return max(0.001, wait)
+					self._grant_next()
+			return 0.001
+		with self._lock:
+			if self._dispatching or not self._queues:
+				return 0.005
+			self._dispatching = True
+		try:
+			while True:
+				wait = self._take_shared()
+				if wait > 0:
+					return max(0.001, wait)
+				with self._lock:
+					# Everyone may have given up meanwhile; the token is then left unused
+					if not self._queues:
+						return 0.001
+					self._grant_next()
+		finally:
+			with self._lock:
+				self._dispatching = False
+
+	def _enqueue(self, wake: Callable[[], None]) -> Optional[Waiter]:
+		# None means a token was free and nobody was ahead
+		user = _user.get()
+		with self._lock:
+			idle = not self._queues
+			if idle and self.shared is None and self._take_local(time.monotonic()) == 0:
+				return None
+		if idle and self.shared is not None and self._take_shared() == 0:
+			return None
+		with self._lock:
+			waiters = self._queues.get(user)
+			if waiters is None:
+				waiters = self._queues[user] = deque()
+			if len(waiters) >= self.per_user:
+				raise RateLimited(f"{self.name}: too many requests queued, please slow down")
+			waiter = Waiter(user, wake)
+			waiters.append(waiter)
+			return waiter
+
+	def _leave(self, waiter: Waiter) -> bool:
+		with self._lock:
+			if not waiter.granted:
+				waiters = self._queues.get(waiter.user)
+				if waiters is not None and waiter in waiters:
+					waiters.remove(waiter)
+					if not waiters:
+						del self._queues[waiter.user]
+			return waiter.granted
+
+	def acquire(self, until: float) -> None:
+		if not self.enabled:
+			return
+		event = threading.Event()
+		waiter = self._enqueue(event.set)
+		if waiter is None:
+			return
+		try:
+			while True:
+				delay = self._dispatch()
+				if waiter.granted:
+					return
+				remaining = until - time.monotonic()
+				if remaining <= 0:
+					break
+				event.wait(min(delay, remaining))
+				event.clear()
+		finally:
+			granted = self._leave(waiter)
+		if not granted:
+			raise RateLimited(f"{self.name}: rate limited, no slot before the deadline")
+
+	async def aacquire(self, until: float) -> None:
+		if not self.enabled:
+			return
+		loop = asyncio.get_running_loop()
+		event = asyncio.Event()
+		# A shared bucket means blocking I/O, which must not stall the event loop
+		offload = self.shared is not None
+		wake = lambda: loop.call_soon_threadsafe(event.set)
+		waiter = await asyncio.to_thread(self._enqueue, wake) if offload else self._enqueue(wake)
+		if waiter is None:
+			return
+		try:
+			while True:
+				delay = await asyncio.to_thread(self._dispatch) if offload else self._dispatch()
+				if waiter.granted:
+					return
+				remaining = until - time.monotonic()
+				if remaining <= 0:
+					break
+				try:
+					await asyncio.wait_for(event.wait(), min(delay, remaining))
+				except asyncio.TimeoutError:
+					pass
+				event.clear()
+		finally:
+			granted = self._leave(waiter)
+		if not granted:
+			raise RateLimited(f"{self.name}: rate limited, no slot before the deadline")
+
+	def observe(self, headers: Mapping[str, str], status: Optional[int]) -> None:
+		"""Adapt to one upstream response or error."""
+		if not self.enabled:
+			return
+		remaining, reset = rate_headers(headers)
+		hint = retry_after_seconds(headers)
+		with self._lock:
+			now = time.monotonic()
+			self._refill(now)
+			if status == 429:
+				self.rate = max(self.min_rate, self.rate / 2)
+				self.tokens = min(self.tokens, 0.0)
+				self.paused_until = max(self.paused_until, now + (hint if hint is not None else reset or 1 / self.rate))
+			elif status is None or status < 400:
+				self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY)
+			elif hint is not None:
+				self.paused_until = max(self.paused_until, now + hint)
+			if remaining is not None:
+				self.tokens = min(self.tokens, float(remaining))
+				if remaining <= 0 and reset:
+					self.paused_until = max(self.paused_until, now + reset)
+			pause = self.paused_until - now
+			rate = self.rate
+		if self.shared is not None:
+			# Other workers learn about a pause through the bucket: it refills from below zero
+			if pause > 0:
+				self.shared.cap(self.bucket, -pause * rate, rate, self.burst)
+			elif remaining is not None:
+				self.shared.cap(self.bucket, float(remaining), rate, self.burst)
+
+	async def aobserve(self, headers: Mapping[str, str], status: Optional[int]) -> None:
+		if self.shared is None:
+			self.observe(headers, status)
+		else:
+			await asyncio.to_thread(self.observe, headers, status)
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"rate": round(self.rate, 3),
+				"tokens": round(self.tokens, 2),
+				"queued": sum(len(w) for w in self._queues.values()),
+				"paused": max(0.0, round(self.paused_until - time.monotonic(), 3)),
+			}
+
+
+_limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+_lock = threading.Lock()
+
+
+def limiter_for(name: str, base_url: str) -> ProviderLimiter:
+	key = (name, base_url.rstrip("/"))
+	with _lock:
+		limiter = _limiters.get(key)
+		if limiter is None:
+			state = shared_state()
+			shared = state if state.kind != "memory" else None
+			limiter = _limiters[key] = ProviderLimiter(name, shared=shared, bucket=f"ratelimit:{key[0]}:{key[1]}")
+		return limiter
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+	with _lock:
+		return {name: limiter.snapshot() for (name, _), limiter in _limiters.items()}
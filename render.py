@@ -0,0 +1,141 @@
+"""Server-side Markdown rendering for the web front ends.
+
+Messages are rendered to sanitized, syntax-highlighted HTML once, when they are
+stored, so pages and history load without any client-side parsing. Streamed
+replies go through IncrementalRenderer, which only re-renders the trailing
+block as chunks arrive.
+
+	MARKDOWN_CODE_STYLE  Pygments style for code blocks (default github-dark)
+	MARKDOWN_TAIL_MS     minimum gap between re-renders of a streaming tail (default 50)
+"""
+import html
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as etree
+from typing import Dict, List
+
+import markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+from pygments.formatters import HtmlFormatter
+
+from output import MarkdownBlocks
+
+CODE_STYLE = os.getenv("MARKDOWN_CODE_STYLE", "github-dark")
+TAIL_INTERVAL = float(os.getenv("MARKDOWN_TAIL_MS", "50")) / 1000.0
+SAFE_SCHEMES = ("http", "https", "mailto")
+# Browsers drop these anywhere in a URL's scheme ("java\tscript:")
+_IGNORED_IN_SCHEME = re.compile(r"[\x00-\x20\x7f]+")
+
+
+def safe_url(value: str) -> bool:
+	"""True for relative URLs and http(s)/mailto ones, however the scheme is entity-encoded."""
+	# Attributes are emitted with entities intact and the browser decodes them ("javascript&#58;")
+	decoded = value
+	for _ in range(5):
+		unescaped = html.unescape(decoded)
+		if unescaped == decoded:
+			break
+		decoded = unescaped
+	head = re.split(r"[/?#]", _IGNORED_IN_SCHEME.sub("", decoded).lower(), maxsplit=1)[0]
+	if ":" not in head:
+		return True
+	return head.split(":", 1)[0] in SAFE_SCHEMES
+
+
+_URL_ATTRIBUTE = re.compile(r'\b(href|src)="([^"]*)"')
+
+
+def clean_urls(html_text: str) -> str:
+	"""Drop unsafe URLs from already rendered HTML, e.g. stored before safe_url() decoded entities."""
+	return _URL_ATTRIBUTE.sub(lambda m: m.group(0) if safe_url(m.group(2)) else f'{m.group(1)}="#"', html_text)
+
+
+class LinkSanitizer(Treeprocessor):
+	def run(self, root: etree.Element) -> None:
+		for el in root.iter():
+			for attr in ("href", "src"):
+				value = el.get(attr)
+				if value is not None and not safe_url(value):
+					el.set(attr, "#")
+			if el.tag == "a":
+				el.set("rel", "noopener noreferrer nofollow")
+				el.set("target", "_blank")
+
+
+class SanitizeExtension(Extension):
+	"""Escape raw HTML instead of passing it through, and drop unsafe URLs."""
+
+	def extendMarkdown(self, md: markdown.Markdown) -> None:
+		md.preprocessors.deregister("html_block")
+		md.inlinePatterns.deregister("html")
+		md.treeprocessors.register(LinkSanitizer(md), "sanitize_links", 0)
+
+
+_local = threading.local()
+
+
+def _converter() -> markdown.Markdown:
+	# Markdown instances are not thread-safe, but are cheap to reuse after reset()
+	md = getattr(_local, "md", None)
+	if md is None:
+		md = _local.md = markdown.Markdown(
+			extensions=["fenced_code", "codehilite", "nl2br", "sane_lists", "tables", SanitizeExtension()],
+			extension_configs={"codehilite": {"guess_lang": False, "css_class": "highlight"}},
+			output_format="html",
+		)
+	return md
+
+
+def render_markdown(text: str) -> str:
+	if not text:
+		return ""
+	md = _converter()
+	try:
+		return md.convert(text)
+	finally:
+		md.reset()
+
+
+def highlight_css() -> str:
+	return HtmlFormatter(style=CODE_STYLE).get_style_defs(".highlight")
+
+
+class IncrementalRenderer:
+	"""Render a streamed reply block by block.
+
+	Blocks that can no longer change (see output.MarkdownBlocks) are rendered
+	once and emitted as "append"; only the unfinished tail is re-rendered, at
+	most every TAIL_INTERVAL seconds.
+	"""
+
+	def __init__(self, tail_interval: float = TAIL_INTERVAL) -> None:
+		self.parts: List[str] = []
+		self.tail_interval = tail_interval
+		self._blocks = MarkdownBlocks()
+		self._last_tail = 0.0
+
+	@property
+	def text(self) -> str:
+		return "".join(self.parts)
+
+	def feed(self, delta: str) -> Dict[str, str]:
+		self.parts.append(delta)
+		event: Dict[str, str] = {}
+		finished = self._blocks.feed(delta)
+		if finished:
+			event["append"] = render_markdown(finished)
+		now = time.monotonic()
+		if event or now - self._last_tail >= self.tail_interval:
+			event["tail"] = render_markdown(self._blocks.tail)
+			self._last_tail = now
+		return event
+
+	def finish(self) -> Dict[str, str]:
+		return {"append": render_markdown(self._blocks.finish()), "tail": ""}
+
+	def html(self) -> str:
+		# One full render for storage, so reference links etc. resolve across blocks
+		return render_markdown(self.text)
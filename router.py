@@ -0,0 +1,609 @@
+"""Latency-aware routing across every configured provider and model.
+
+The requested model on the first provider is tried first unless it is cooling
+down after errors; fallbacks (other providers' default models and any
+<NAME>_FALLBACK_MODELS) are ordered by rolling latency and error rate. Errors
+before the first token fail over to the next endpoint; once tokens have been
+relayed the error is raised to the caller.
+
+	ROUTER_MAX_ATTEMPTS   endpoints tried per request (default 3)
+	ROUTER_COOLDOWN_SECS  how long a failing endpoint is skipped (default 15)
+	ROUTER_HEDGE          "1" to start a second request when the first is slow
+	ROUTER_HEDGE_MIN_MS   lower bound on the hedge delay (default 250)
+	ROUTER_HEDGE_MAX_MS   hedge delay used until p95 is known, and its cap (default 4000)
+
+With hedging on, a second endpoint is started once the first has gone longer
+than its p95 time-to-first-token without producing one. Whichever yields a
+token first wins; the loser's stream is closed.
+
+Every attempt first takes a slot from its provider's rate limiter (see
+ratelimit.py). When a whole round of endpoints fails with retryable errors
+(429, 5xx, dropped connections, stream errors before the first token) the
+round is retried after a jittered exponential backoff, until
+RETRY_DEADLINE_SECS runs out.
+
+Open streams are registered with the caller's cancel scope (see cancel.py):
+stopping a reply closes its upstream response, and the stream ends with
+Cancelled rather than failing over.
+"""
+import asyncio
+import contextvars
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from cancel import Cancelled, cancelled, check, current as current_scope, on_cancel
+from clients import get_client
+from metrics import Trace
+from prompt_cache import prepare as prepare_prompt
+from providers import Provider, load_providers
+from ratelimit import ProviderLimiter, RateLimited, backoff, deadline, headers_of, limiter_for, retry_after_seconds, retryable, status_of
+
+# Weight of the newest outcome in the rolling error rate
+ERROR_ALPHA = 0.2
+MIN_SAMPLES_FOR_P95 = 5
+# Ask for a trailing usage chunk on streams so token counts can be recorded
+STREAM_INCLUDE_USAGE = os.getenv("STREAM_INCLUDE_USAGE", "1") == "1"
+
+
+def delta_text(event: Any) -> Optional[str]:
+	if not event.choices:
+		return None
+	return getattr(event.choices[0].delta, "content", None)
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+	return retry_after_seconds(headers_of(exc))
+
+
+@dataclass(frozen=True)
+class Endpoint:
+	provider: Provider
+	model: str
+
+	@property
+	def name(self) -> str:
+		return f"{self.provider.name}:{self.model}"
+
+
+class EndpointStats:
+	def __init__(self, window: int = 100) -> None:
+		self.ttft: Deque[float] = deque(maxlen=window)
+		self.latency: Deque[float] = deque(maxlen=window)
+		self.error_rate = 0.0
+		self.requests = 0
+		self.errors = 0
+		self.cooldown_until = 0.0
+
+	def success(self, seconds: float, first_token: bool) -> None:
+		(self.ttft if first_token else self.latency).append(seconds)
+		self.requests += 1
+		self.error_rate *= 1 - ERROR_ALPHA
+
+	def failure(self, cooldown: float) -> None:
+		self.requests += 1
+		self.errors += 1
+		self.error_rate = self.error_rate * (1 - ERROR_ALPHA) + ERROR_ALPHA
+		self.cooldown_until = max(self.cooldown_until, time.monotonic() + cooldown)
+
+	def quantile(self, q: float) -> Optional[float]:
+		samples = sorted(self.ttft or self.latency)
+		if not samples:
+			return None
+		return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+	def available(self) -> bool:
+		return time.monotonic() >= self.cooldown_until
+
+	def score(self) -> float:
+		p50 = self.quantile(0.5)
+		return (p50 if p50 is not None else 1.0) * (1 + 4 * self.error_rate)
+
+	def snapshot(self) -> Dict[str, Any]:
+		return {
+			"requests": self.requests,
+			"errors": self.errors,
+			"error_rate": round(self.error_rate, 4),
+			"p50": self.quantile(0.5),
+			"p95": self.quantile(0.95),
+			"cooling_down": not self.available(),
+		}
+
+
+@dataclass
+class Opened:
+	endpoint: Endpoint
+	response: Any
+	events: Iterator[Any]
+	first: str
+	trace: Trace
+
+
+class Router:
+	def __init__(
+		self,
+		providers: Sequence[Provider],
+		max_attempts: int = 3,
+		cooldown: float = 15.0,
+		hedge: bool = False,
+		hedge_min: float = 0.25,
+		hedge_max: float = 4.0,
+	) -> None:
+		self.providers = list(providers)
+		self.max_attempts = max_attempts
+		self.cooldown = cooldown
+		self.hedge = hedge
+		self.hedge_min = hedge_min
+		self.hedge_max = hedge_max
+		self._stats: Dict[str, EndpointStats] = {}
+		self._lock = threading.Lock()
+
+	@classmethod
+	def from_env(cls, providers: Optional[Sequence[Provider]] = None) -> "Router":
+		return cls(
+			load_providers() if providers is None else providers,
+			max_attempts=int(os.getenv("ROUTER_MAX_ATTEMPTS", "3")),
+			cooldown=float(os.getenv("ROUTER_COOLDOWN_SECS", "15")),
+			hedge=os.getenv("ROUTER_HEDGE", "0") == "1",
+			hedge_min=float(os.getenv("ROUTER_HEDGE_MIN_MS", "250")) / 1000,
+			hedge_max=float(os.getenv("ROUTER_HEDGE_MAX_MS", "4000")) / 1000,
+		)
+
+	def stats(self, endpoint: Endpoint) -> EndpointStats:
+		with self._lock:
+			stats = self._stats.get(endpoint.name)
+			if stats is None:
+				stats = self._stats[endpoint.name] = EndpointStats()
+			return stats
+
+	def snapshot(self) -> Dict[str, Dict[str, Any]]:
+		with self._lock:
+			return {name: stats.snapshot() for name, stats in self._stats.items()}
+
+	def warm(self, asynchronous: bool = False) -> None:
+		"""Import the SDK and build each provider's pooled client ahead of the first request."""
+		for provider in self.providers:
+			client = get_client(provider.api_key, provider.base_url, asynchronous=asynchronous)
+			# Resources are created (and their modules imported) on first access
+			client.chat.completions
+
+	def candidates(self, model: str) -> List[Endpoint]:
+		if not self.providers:
+			return []
+		primary = Endpoint(self.providers[0], model)
+		seen = {primary.name}
+		fallbacks: List[Endpoint] = []
+		for provider in self.providers:
+			for name in provider.models:
+				endpoint = Endpoint(provider, name)
+				if endpoint.name not in seen:
+					seen.add(endpoint.name)
+					fallbacks.append(endpoint)
+		fallbacks.sort(key=lambda e: self.stats(e).score())
+		ordered = [primary] + fallbacks
+		# Endpoints cooling down go last rather than being dropped outright
+		ready = [e for e in ordered if self.stats(e).available()]
+		cooling = [e for e in ordered if not self.stats(e).available()]
+		return (ready + cooling)[:self.max_attempts]
+
+	def hedge_delay(self, endpoint: Endpoint) -> float:
+		stats = self.stats(endpoint)
+		if len(stats.ttft) < MIN_SAMPLES_FOR_P95:
+			return self.hedge_max
+		return min(self.hedge_max, max(self.hedge_min, stats.quantile(0.95) or self.hedge_max))
+
+	@staticmethod
+	def limiter(endpoint: Endpoint) -> ProviderLimiter:
+		return limiter_for(endpoint.provider.name, endpoint.provider.base_url)
+
+	def _failed(self, endpoint: Endpoint, exc: BaseException, failures: List[BaseException]) -> None:
+		failures.append(exc)
+		if isinstance(exc, (RateLimited, Cancelled)):
+			# Our own queue gave up, or the reply was stopped; says nothing about the endpoint
+			return
+		self.limiter(endpoint).observe(headers_of(exc), status_of(exc))
+		self.stats(endpoint).failure(retry_after(exc) or self.cooldown)
+
+	async def _afailed(self, endpoint: Endpoint, exc: BaseException, failures: List[BaseException]) -> None:
+		if self.limiter(endpoint).shared is None:
+			self._failed(endpoint, exc, failures)
+		else:
+			# The limiter writes to the shared backend
+			await asyncio.to_thread(self._failed, endpoint, exc, failures)
+
+	@staticmethod
+	def _retry_delay(attempt: int, failures: List[BaseException], until: float) -> Optional[float]:
+		if not any(retryable(exc) for exc in failures):
+			return None
+		delay = backoff(attempt, max(retry_after(exc) or 0.0 for exc in failures))
+		return delay if time.monotonic() + delay < until else None
+
+	def _request(self, endpoint: Endpoint, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]], params: Dict[str, Any], stream: bool) -> Dict[str, Any]:
+		# Cache breakpoints depend on the endpoint, so they are added per attempt
+		kwargs = dict(params, model=endpoint.model, messages=prepare_prompt(endpoint.provider, endpoint.model, messages), stream=stream)
+		if stream and STREAM_INCLUDE_USAGE:
+			kwargs.setdefault("stream_options", {"include_usage": True})
+		if extra_headers:
+			kwargs["extra_headers"] = extra_headers
+		return kwargs
+
+	# -- sync -----------------------------------------------------------------
+
+	def complete(self, model: str, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]] = None, **params: Any) -> str:
+		if self.hedge:
+			# Hedging needs a closable stream to cancel the loser
+			return "".join(self.stream(model, messages, extra_headers, **params))
+		until = deadline()
+		for attempt in itertools.count():
+			failures: List[BaseException] = []
+			try:
+				return self._complete_round(model, messages, extra_headers, params, until, failures)
+			except Exception:
+				delay = self._retry_delay(attempt, failures, until)
+				if delay is None:
+					raise
+			time.sleep(delay)
+
+	def _complete_round(self, model: str, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]], params: Dict[str, Any], until: float, failures: List[BaseException]) -> str:
+		for endpoint in self.candidates(model):
+			limiter = self.limiter(endpoint)
+			try:
+				limiter.acquire(until)
+			except RateLimited as exc:
+				self._failed(endpoint, exc, failures)
+				continue
+			client = get_client(endpoint.provider.api_key, endpoint.provider.base_url)
+			trace = Trace(endpoint.provider.name, endpoint.model, stream=False)
+			try:
+				raw = client.chat.completions.with_raw_response.create(**self._request(endpoint, messages, extra_headers, params, False))
+				resp = raw.parse()
+			except Exception as exc:
+				trace.finish(exc)
+				self._failed(endpoint, exc, failures)
+				continue
+			limiter.observe(raw.headers, raw.status_code)
+			trace.usage(getattr(resp, "usage", None))
+			trace.finish()
+			self.stats(endpoint).success(time.monotonic() - trace.started, first_token=False)
+			return resp.choices[0].message.content or ""
+		raise failures[-1] if failures else RuntimeError("No providers configured")
+
+	def _open(self, endpoint: Endpoint, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]], params: Dict[str, Any], state: Dict[str, Any], until: float) -> Opened:
+		limiter = self.limiter(endpoint)
+		check()
+		limiter.acquire(until)
+		check()
+		client = get_client(endpoint.provider.api_key, endpoint.provider.base_url)
+		trace = Trace(endpoint.provider.name, endpoint.model, stream=True)
+		state["trace"] = trace
+		try:
+			response = client.chat.completions.create(**self._request(endpoint, messages, extra_headers, params, True))
+		except BaseException as exc:
+			trace.finish(exc)
+			raise
+		state["response"] = response
+		# Closing the response from another thread ends the read below at once
+		on_cancel(response.close)
+		limiter.observe(response.response.headers, response.response.status_code)
+		events = iter(response)
+		try:
+			for event in events:
+				if state.get("cancelled"):
+					break
+				trace.usage(getattr(event, "usage", None))
+				piece = delta_text(event)
+				if piece:
+					trace.first_token()
+					trace.piece()
+					return Opened(endpoint, response, events, piece, trace)
+		except BaseException as exc:
+			response.close()
+			if isinstance(exc, KeyboardInterrupt):
+				trace.finish(status="cancelled")
+				raise
+			if cancelled():
+				trace.finish(status="cancelled")
+				raise Cancelled(current_scope().reason) from exc
+			# A hedge loser's stream errors out when it is closed under it
+			trace.finish(None if state.get("cancelled") else exc, "hedge_lost" if state.get("cancelled") else None)
+			raise
+		return Opened(endpoint, response, events, "", trace)
+
+	def _race(self, candidates: List[Endpoint], messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]], params: Dict[str, Any], until: float, failures: List[BaseException]) -> Opened:
+		results: "queue.Queue[Tuple[Endpoint, Dict[str, Any], Optional[Opened], Optional[BaseException]]]" = queue.Queue()
+		pending = list(candidates)
+		states: List[Dict[str, Any]] = []
+
+		def run(endpoint: Endpoint, state: Dict[str, Any]) -> None:
+			try:
+				opened = self._open(endpoint, messages, extra_headers, params, state, until)
+			except BaseException as exc:
+				results.put((endpoint, state, None, exc))
+				return
+			if state.get("cancelled"):
+				opened.response.close()
+				opened.trace.finish(status="hedge_lost")
+				return
+			results.put((endpoint, state, opened, None))
+
+		def launch() -> None:
+			state: Dict[str, Any] = {}
+			states.append(state)
+			# Copy the context so the rate limiter still sees the caller's user
+			threading.Thread(target=contextvars.copy_context().run, args=(run, pending.pop(0), state), daemon=True).start()
+
+		launch()
+		live = 1
+		while live:
+			timeout = self.hedge_delay(candidates[0]) if pending and live == 1 else None
+			try:
+				endpoint, state, opened, exc = results.get(timeout=timeout)
+			except queue.Empty:
+				launch()
+				live += 1
+				continue
+			live -= 1
+			if opened is None:
+				if isinstance(exc, Cancelled):
+					# Every attempt shares the caller's scope, so the others were closed too
+					raise exc
+				self._failed(endpoint, exc, failures)
+				if not live and pending:
+					launch()
+					live += 1
+				continue
+			self.stats(endpoint).success(opened.trace.ttft or 0.0, first_token=True)
+			for other in states:
+				if other is not state:
+					self._cancel(other)
+			return opened
+		raise failures[-1] if failures else RuntimeError("No providers configured")
+
+	@staticmethod
+	def _cancel(state: Dict[str, Any]) -> None:
+		state["cancelled"] = True
+		response = state.get("response")
+		if response is not None:
+			try:
+				response.close()
+			except Exception:
+				pass
+
+	def _open_round(self, candidates: List[Endpoint], messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]], params: Dict[str, Any], until: float, failures: List[BaseException]) -> Opened:
+		if self.hedge:
+			return self._race(candidates, messages, extra_headers, params, until, failures)
+		for endpoint in candidates:
+			try:
+				opened = self._open(endpoint, messages, extra_headers, params, {}, until)
+			except Cancelled:
+				raise
+			except Exception as exc:
+				self._failed(endpoint, exc, failures)
+				continue
+			self.stats(endpoint).success(opened.trace.ttft or 0.0, first_token=True)
+			return opened
+		raise failures[-1]
+
+	def stream(self, model: str, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]] = None, **params: Any) -> Iterator[str]:
+		candidates = self.candidates(model)
+		if not candidates:
+			raise RuntimeError("No providers configured")
+		until = deadline()
+		for attempt in itertools.count():
+			failures: List[BaseException] = []
+			try:
+				opened = self._open_round(candidates, messages, extra_headers, params, until, failures)
+				break
+			except Cancelled:
+				raise
+			except Exception:
+				delay = self._retry_delay(attempt, failures, until)
+				if delay is None:
+					raise
+			time.sleep(delay)
+			candidates = self.candidates(model)
+		error: Optional[BaseException] = None
+		status: Optional[str] = None
+		try:
+			if opened.first:
+				yield opened.first
+			for event in opened.events:
+				opened.trace.usage(getattr(event, "usage", None))
+				piece = delta_text(event)
+				if piece:
+					opened.trace.piece()
+					yield piece
+			# A response closed by cancel() can also just end early; don't pass it off as complete
+			check()
+		except (GeneratorExit, KeyboardInterrupt, Cancelled):
+			status = "cancelled"
+			raise
+		except BaseException as exc:
+			if not cancelled():
+				error = exc
+				raise
+			status = "cancelled"
+			raise Cancelled(current_scope().reason) from exc
+		finally:
+			opened.response.close()
+			opened.trace.finish(error, status)
+
+	# -- async ----------------------------------------------------------------
+
+	async def acomplete(self, model: str, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]] = None, **params: Any) -> str:
+		if self.hedge:
+			return "".join([piece async for piece in self.astream(model, messages, extra_headers, **params)])
+		until = deadline()
+		for attempt in itertools.count():
+			failures: List[BaseException] = []
+			try:
+				return await self._acomplete_round(model, messages, extra_headers, params, until, failures)
+			except Exception:
+				delay = self._retry_delay(attempt, failures, until)
+				if delay is None:
+					raise
+			await asyncio.sleep(delay)
+
+	async def _acomplete_round(self, model: str, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]], params: Dict[str, Any], until: float, failures: List[BaseException]) -> str:
+		for endpoint in self.candidates(model):
+			limiter = self.limiter(endpoint)
+			try:
+				await limiter.aacquire(until)
+			except RateLimited as exc:
+				await self._afailed(endpoint, exc, failures)
+				continue
+			client = get_client(endpoint.provider.api_key, endpoint.provider.base_url, asynchronous=True)
+			trace = Trace(endpoint.provider.name, endpoint.model, stream=False)
+			try:
+				raw = await client.chat.completions.with_raw_response.create(**self._request(endpoint, messages, extra_headers, params, False))
+				resp = raw.parse()
+			except Exception as exc:
+				trace.finish(exc)
+				await self._afailed(endpoint, exc, failures)
+				continue
+			await limiter.aobserve(raw.headers, raw.status_code)
+			trace.usage(getattr(resp, "usage", None))
+			trace.finish()
+			self.stats(endpoint).success(time.monotonic() - trace.started, first_token=False)
+			return resp.choices[0].message.content or ""
+		raise failures[-1] if failures else RuntimeError("No providers configured")
+
+	async def _aopen(self, endpoint: Endpoint, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]], params: Dict[str, Any], until: float, race: Dict[str, Any]) -> Opened:
+		limiter = self.limiter(endpoint)
+		await limiter.aacquire(until)
+		client = get_client(endpoint.provider.api_key, endpoint.provider.base_url, asynchronous=True)
+		trace = Trace(endpoint.provider.name, endpoint.model, stream=True)
+		try:
+			response = await client.chat.completions.create(**self._request(endpoint, messages, extra_headers, params, True))
+		except asyncio.CancelledError:
+			trace.finish(status="cancelled" if race.get("stopped") else "hedge_lost")
+			raise
+		except BaseException as exc:
+			trace.finish(exc)
+			raise
+		await limiter.aobserve(response.response.headers, response.response.status_code)
+		events = response.__aiter__()
+		try:
+			async for event in events:
+				trace.usage(getattr(event, "usage", None))
+				piece = delta_text(event)
+				if piece:
+					trace.first_token()
+					trace.piece()
+					return Opened(endpoint, response, events, piece, trace)
+		except asyncio.CancelledError:
+			await response.close()
+			trace.finish(status="cancelled" if race.get("stopped") else "hedge_lost")
+			raise
+		except BaseException as exc:
+			await response.close()
+			trace.finish(exc)
+			raise
+		return Opened(endpoint, response, events, "", trace)
+
+	async def _arace(self, candidates: List[Endpoint], messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]], params: Dict[str, Any], until: float, failures: List[BaseException]) -> Opened:
+		pending = list(candidates)
+		tasks: Dict["asyncio.Task[Opened]", Endpoint] = {}
+		race: Dict[str, Any] = {}
+
+		def launch() -> None:
+			endpoint = pending.pop(0)
+			tasks[asyncio.ensure_future(self._aopen(endpoint, messages, extra_headers, params, until, race))] = endpoint
+
+		launch()
+		try:
+			while tasks:
+				timeout = self.hedge_delay(candidates[0]) if self.hedge and pending and len(tasks) == 1 else None
+				done, _ = await asyncio.wait(list(tasks), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+				if not done:
+					launch()
+					continue
+				for task in done:
+					endpoint = tasks.pop(task)
+					exc = task.exception()
+					if exc is not None:
+						await self._afailed(endpoint, exc, failures)
+						continue
+					opened = task.result()
+					self.stats(endpoint).success(opened.trace.ttft or 0.0, first_token=True)
+					return opened
+				if not tasks and pending:
+					launch()
+		except asyncio.CancelledError:
+			# The caller was cancelled: the attempts still running were stopped, not outraced
+			race["stopped"] = True
+			raise
+		finally:
+			# Cancelling a loser closes its upstream connection
+			for task in tasks:
+				if not task.done():
+					task.cancel()
+				elif not task.cancelled() and task.exception() is None:
+					await task.result().response.close()
+					task.result().trace.finish(status="hedge_lost")
+		raise failures[-1] if failures else RuntimeError("No providers configured")
+
+	async def astream(self, model: str, messages: List[Dict[str, Any]], extra_headers: Optional[Dict[str, str]] = None, **params: Any) -> AsyncIterator[str]:
+		candidates = self.candidates(model)
+		if not candidates:
+			raise RuntimeError("No providers configured")
+		until = deadline()
+		for attempt in itertools.count():
+			failures: List[BaseException] = []
+			try:
+				opened = await self._arace(candidates, messages, extra_headers, params, until, failures)
+				break
+			except Exception:
+				delay = self._retry_delay(attempt, failures, until)
+				if delay is None:
+					raise
+			await asyncio.sleep(delay)
+			candidates = self.candidates(model)
+		error: Optional[BaseException] = None
+		status: Optional[str] = None
+		try:
+			if opened.first:
+				yield opened.first
+			async for event in opened.events:
+				opened.trace.usage(getattr(event, "usage", None))
+				piece = delta_text(event)
+				if piece:
+					opened.trace.piece()
+					yield piece
+		except (GeneratorExit, asyncio.CancelledError):
+			status = "cancelled"
+			raise
+		except BaseException as exc:
+			error = exc
+			raise
+		finally:
+			await opened.response.close()
+			opened.trace.finish(error, status)
+
+
+_default: Optional[Router] = None
+_custom: Dict[Tuple[str, str], Router] = {}
+_lock = threading.Lock()
+
+
+def default_router() -> Router:
+	global _default
+	with _lock:
+		if _default is None:
+			_default = Router.from_env()
+		return _default
+
+
+def router_for(api_key: str, base_url: str) -> Router:
+	# A single-endpoint router for keys entered at runtime (e.g. the Streamlit sidebar)
+	key = (base_url.rstrip("/"), api_key)
+	with _lock:
+		router = _custom.get(key)
+		if router is None:
+			router = _custom[key] = Router.from_env([Provider("custom", api_key, base_url)])
+		return router
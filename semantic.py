@@ -0,0 +1,305 @@
+"""Opt-in semantic completion cache: answers paraphrases of earlier questions.
+
+Sits behind the exact-match cache (cache.py). The latest user turn is embedded
+and compared, by cosine similarity, with earlier questions asked under the
+same model, parameters and preceding conversation, and with the same negation
+words ("not", "never", "without", "n't"); the best match at or above
+the threshold is served instead of an upstream call. Questions are embedded
+with SEMANTIC_CACHE_MODEL when it is set and sentence-transformers is
+installed, otherwise with hashed word and character n-grams (no download).
+The index is a NumPy matrix searched exhaustively (about a millisecond for a
+full 5000-entry index on one CPU); the least recently used entry is evicted
+when full.
+
+	SEMANTIC_CACHE            "1" to enable (default off; needs numpy)
+	SEMANTIC_CACHE_THRESHOLD  minimum cosine similarity for a hit (default 0.9 with a model, 0.8 hashed)
+	SEMANTIC_CACHE_SIZE       entries kept (default 5000)
+	SEMANTIC_CACHE_TTL        seconds an answer stays valid (default 3600)
+	SEMANTIC_CACHE_PATH       .npz file the index is saved to and loaded from (default unset)
+	SEMANTIC_CACHE_MODEL      sentence-transformers model name, e.g. all-MiniLM-L6-v2 (default unset)
+	SEMANTIC_CACHE_DIM        dimensions of the hashed embedding (default 1024)
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from cache import cache_key
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOKUP_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+LOOKUPS = REGISTRY.counter("chat_semantic_cache_lookups_total", "Semantic cache lookups by result")
+LOOKUP_SECONDS = REGISTRY.histogram("chat_semantic_cache_lookup_seconds", "Embedding plus index search time per lookup", LOOKUP_BUCKETS)
+
+WORD = re.compile(r"\w+")
+STOPWORDS = frozenset(
+	"a an the is are was were be been do does did i you we it its of in on at to for from and or "
+	"how what whats what's which who can could should would will please me my your with by about "
+	"this that these those there tell explain s".split()
+)
+CONTRACTED = frozenset(
+	"cannot cant dont doesnt didnt isnt arent wasnt werent couldnt shouldnt wouldnt wont hasnt havent hadnt mustnt".split()
+)
+NEGATION = re.compile(r"\b(?:not|no|never|nor|neither|none|nothing|nobody|nowhere|without|\w+n['’]t|" + "|".join(sorted(CONTRACTED)) + r")\b")
+# Saves are batched; the index is also written at exit
+SAVE_EVERY = 50
+
+
+class HashedEmbedder:
+	"""Signed feature hashing of content words, word pairs and character trigrams.
+
+	Stopwords are dropped so that phrasing ("how do I", "what's the") matters
+	less than what is asked about; pairs and trigrams are down-weighted and
+	only soften word-order and inflection differences.
+	"""
+
+	WEIGHTS = {"word": 1.0, "pair": 0.5, "trigram": 0.2}
+
+	def __init__(self, dim: int = 1024) -> None:
+		self.dim = dim
+		self.name = f"hashed-{dim}"
+
+	def __call__(self, text: str) -> Any:
+		import numpy as np
+
+		words = [w for w in WORD.findall(text.lower()) if w not in STOPWORDS]
+		features = [(w, self.WEIGHTS["word"]) for w in words]
+		features.extend((f"{a} {b}", self.WEIGHTS["pair"]) for a, b in zip(words, words[1:]))
+		for word in words:
+			padded = f"<{word}>"
+			features.extend((padded[i:i + 3], self.WEIGHTS["trigram"]) for i in range(len(padded) - 2))
+		vector = np.zeros(self.dim, dtype=np.float32)
+		for feature, weight in features:
+			# crc32 rather than hash(): vectors must match across processes and restarts
+			h = zlib.crc32(feature.encode("utf-8"))
+			vector[h % self.dim] += weight if h & 0x80000000 else -weight
+		norm = float(np.linalg.norm(vector))
+		return vector / norm if norm else vector
+
+
+class ModelEmbedder:
+	def __init__(self, name: str) -> None:
+		from sentence_transformers import SentenceTransformer
+
+		self.model = SentenceTransformer(name, device="cpu")
+		self.dim = int(self.model.get_sentence_embedding_dimension())
+		self.name = f"model-{name}"
+
+	def __call__(self, text: str) -> Any:
+		import numpy as np
+
+		return np.asarray(self.model.encode(text, normalize_embeddings=True), dtype=np.float32)
+
+
+def load_embedder() -> Callable[[str], Any]:
+	name = os.getenv("SEMANTIC_CACHE_MODEL", "").strip()
+	if name:
+		try:
+			return ModelEmbedder(name)
+		except Exception as exc:
+			logger.warning("semantic cache: model %s unavailable (%s); using hashed n-grams", name, exc)
+	return HashedEmbedder(int(os.getenv("SEMANTIC_CACHE_DIM", "1024")))
+
+
+def negations(text: str) -> List[str]:
+	"""The negation words in `text`, with "n't" and "cannot" spelled "not"."""
+	found = {"not" if word.endswith(("n't", "n’t")) or word in CONTRACTED else word for word in NEGATION.findall(text.lower())}
+	return sorted(found)
+
+
+def scope_of(model: str, messages: List[Mapping[str, object]], params: Optional[Mapping[str, object]] = None) -> int:
+	# Only the last turn may be paraphrased; everything before it has to match exactly.
+	# So do its negations: embeddings barely tell "is it safe" from "is it not safe".
+	key = cache_key(model, messages[:-1], params)
+	negated = negations(str(messages[-1].get("content") or "")) if messages else []
+	if negated:
+		key = hashlib.sha256(f"{key}:{' '.join(negated)}".encode("utf-8")).hexdigest()
+	return int(key[:15], 16)
+
+
+class SemanticCache:
+	def __init__(self, embed: Callable[[str], Any], threshold: float, max_entries: int = 5000, ttl: float = 3600.0, path: Optional[str] = None) -> None:
+		import numpy as np
+
+		self.embed = embed
+		self.threshold = threshold
+		self.max_entries = max(1, max_entries)
+		self.ttl = ttl
+		self.path = path
+		dim = embed.dim
+		self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+		self._scopes = np.zeros(self.max_entries, dtype=np.int64)
+		self._expires = np.zeros(self.max_entries, dtype=np.float64)
+		self._used = np.zeros(self.max_entries, dtype=np.float64)
+		self._answers: List[Optional[str]] = [None] * self.max_entries
+		self._lock = threading.Lock()
+		self._dirty = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.lookup_seconds = 0.0
+		if path:
+			self._load(path)
+			atexit.register(self.save)
+
+	@staticmethod
+	def question(messages: List[Mapping[str, object]]) -> Optional[str]:
+		if not messages or messages[-1].get("role") != "user":
+			return None
+		text = " ".join(str(messages[-1].get("content") or "").split())
+		return text or None
+
+	def get(self, model: str, messages: List[Mapping[str, object]], params: Optional[Mapping[str, object]] = None) -> Optional[str]:
+		import numpy as np
+
+		text = self.question(messages)
+		if text is None:
+			return None
+		started = time.perf_counter()
+		vector = self.embed(text)
+		scope = scope_of(model, messages, params)
+		now = time.time()
+		with self._lock:
+			candidates = np.flatnonzero((self._scopes == scope) & (self._expires > now))
+			answer = None
+			if len(candidates):
+				if len(candidates) * 8 > self.max_entries:
+					# Gathering many rows costs more than scoring them all
+					scores = (self._vectors @ vector)[candidates]
+				else:
+					scores = self._vectors[candidates] @ vector
+				best = int(scores.argmax())
+				if scores[best] >= self.threshold:
+					slot = int(candidates[best])
+					answer = self._answers[slot]
+					self._used[slot] = now
+			if answer is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+			elapsed = time.perf_counter() - started
+			self.lookup_seconds += elapsed
+		LOOKUPS.inc(result="miss" if answer is None else "hit")
+		LOOKUP_SECONDS.observe(elapsed)
+		return answer
+
+	def put(self, model: str, messages: List[Mapping[str, object]], answer: str, params: Optional[Mapping[str, object]] = None) -> None:
+		text = self.question(messages)
+		if text is None or not answer:
+			return
+		vector = self.embed(text)
+		scope = scope_of(model, messages, params)
+		now = time.time()
+		with self._lock:
+			# Reuse an expired or empty slot, otherwise evict the least recently used one
+			free = self._expires <= now
+			slot = int(free.argmax()) if free.any() else int(self._used.argmin())
+			if not free[slot]:
+				self.evictions += 1
+			self._vectors[slot] = vector
+			self._scopes[slot] = scope
+			self._expires[slot] = now + self.ttl
+			self._used[slot] = now
+			self._answers[slot] = answer
+			self._dirty += 1
+			save = self.path is not None and self._dirty >= SAVE_EVERY
+		if save:
+			self.save()
+
+	def stats(self) -> Dict[str, float]:
+		with self._lock:
+			lookups = self.hits + self.misses
+			return {
+				"hits": self.hits,
+				"misses": self.misses,
+				"hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+				"evictions": self.evictions,
+				"size": int((self._expires > time.time()).sum()),
+				"avg_lookup_ms": round(self.lookup_seconds / lookups * 1000, 3) if lookups else 0.0,
+			}
+
+	def save(self) -> None:
+		if not self.path:
+			return
+		import numpy as np
+
+		with self._lock:
+			if not self._dirty:
+				return
+			keep = np.flatnonzero(self._expires > time.time())
+			data = {
+				"embedder": np.array(self.embed.name),
+				"vectors": self._vectors[keep],
+				"scopes": self._scopes[keep],
+				"expires": self._expires[keep],
+				"used": self._used[keep],
+				# JSON rather than an object array, so loading never needs pickle
+				"answers": np.array(json.dumps([self._answers[i] for i in keep], ensure_ascii=False)),
+			}
+			self._dirty = 0
+		tmp = self.path + ".tmp.npz"
+		try:
+			np.savez(tmp, **data)
+			os.replace(tmp, self.path)
+		except OSError as exc:
+			logger.warning("semantic cache: could not save %s: %s", self.path, exc)
+
+	def _load(self, path: str) -> None:
+		import numpy as np
+
+		if not os.path.exists(path):
+			return
+		try:
+			with np.load(path, allow_pickle=False) as data:
+				if str(data["embedder"]) != self.embed.name:
+					logger.info("semantic cache: %s was built with another embedder; starting empty", path)
+					return
+				# Most recently used first, in case the saved index is bigger than this one
+				order = np.argsort(-data["used"])[:self.max_entries]
+				count = len(order)
+				self._vectors[:count] = data["vectors"][order]
+				self._scopes[:count] = data["scopes"][order]
+				self._expires[:count] = data["expires"][order]
+				self._used[:count] = data["used"][order]
+				answers = json.loads(str(data["answers"]))
+				for slot, i in enumerate(order):
+					self._answers[slot] = answers[i]
+		except (OSError, ValueError, KeyError) as exc:
+			logger.warning("semantic cache: could not load %s: %s", path, exc)
+
+
+_shared: Optional[SemanticCache] = None
+_shared_lock = threading.Lock()
+_unavailable = False
+
+
+def shared_semantic_cache() -> Optional[SemanticCache]:
+	global _shared, _unavailable
+	if os.getenv("SEMANTIC_CACHE", "0") != "1" or _unavailable:
+		return None
+	with _shared_lock:
+		if _shared is None:
+			try:
+				import numpy  # noqa: F401
+			except ImportError:
+				logger.warning("semantic cache: numpy is not installed; disabled")
+				_unavailable = True
+				return None
+			embed = load_embedder()
+			default_threshold = "0.8" if isinstance(embed, HashedEmbedder) else "0.9"
+			_shared = SemanticCache(
+				embed,
+				threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", default_threshold)),
+				max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "5000")),
+				ttl=float(os.getenv("SEMANTIC_CACHE_TTL", "3600")),
+				path=os.getenv("SEMANTIC_CACHE_PATH") or None,
+			)
+	return _shared
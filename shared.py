@@ -0,0 +1,264 @@
+"""State shared between processes, so web.py can run as several gunicorn workers.
+
+The response cache's second tier, rate-limit buckets and metrics go through
+one of these backends; conversations use the matching ConversationStore (see
+store.py).
+
+	SHARED_STATE       "memory" (default: this process only), "sqlite" or "redis"
+	SHARED_STATE_PATH  database file for the sqlite backend (default shared_state.db)
+	REDIS_URL          server for the redis backend and store (default redis://localhost:6379/0)
+
+SQLite runs in WAL mode, so readers never wait for the writer and every
+worker on one host can share the file. Redis also works across hosts; any
+server speaking the protocol will do (fakeredis's TcpFakeServer for local
+testing).
+"""
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+KEY_PREFIX = "chat:"
+
+
+class SharedState(ABC):
+	kind = "memory"
+
+	@abstractmethod
+	def get(self, key: str) -> Optional[str]:
+		...
+
+	@abstractmethod
+	def set(self, key: str, value: str, ttl: float) -> None:
+		...
+
+	@abstractmethod
+	def delete(self, key: str) -> None:
+		...
+
+	@abstractmethod
+	def items(self, prefix: str) -> Dict[str, str]:
+		"""Every live key starting with `prefix`, with its value."""
+
+	@abstractmethod
+	def take(self, bucket: str, rate: float, burst: float) -> float:
+		"""Take a token from a shared token bucket.
+
+		Returns 0.0 when one was taken, otherwise the seconds until one is due.
+		"""
+
+	@abstractmethod
+	def cap(self, bucket: str, tokens: float, rate: float, burst: float) -> None:
+		"""Lower a bucket to at most `tokens`; negative values pause it until refilled."""
+
+
+def _refill(state: Optional[Tuple[float, float]], rate: float, burst: float, now: float) -> float:
+	if state is None:
+		return burst
+	tokens, updated = state
+	return min(burst, tokens + max(0.0, now - updated) * rate)
+
+
+def _spend(tokens: float, rate: float) -> Tuple[float, float]:
+	# (tokens left, wait)
+	if tokens >= 1:
+		return tokens - 1, 0.0
+	return tokens, (1 - tokens) / rate
+
+
+class MemoryState(SharedState):
+	kind = "memory"
+
+	def __init__(self) -> None:
+		self._values: Dict[str, Tuple[str, float]] = {}
+		self._buckets: Dict[str, Tuple[float, float]] = {}
+		self._lock = threading.Lock()
+
+	def get(self, key: str) -> Optional[str]:
+		with self._lock:
+			entry = self._values.get(key)
+			if entry is None or entry[1] <= time.time():
+				return None
+			return entry[0]
+
+	def set(self, key: str, value: str, ttl: float) -> None:
+		with self._lock:
+			self._values[key] = (value, time.time() + ttl)
+
+	def delete(self, key: str) -> None:
+		with self._lock:
+			self._values.pop(key, None)
+
+	def items(self, prefix: str) -> Dict[str, str]:
+		now = time.time()
+		with self._lock:
+			return {k: v for k, (v, expires) in self._values.items() if k.startswith(prefix) and expires > now}
+
+	def take(self, bucket: str, rate: float, burst: float) -> float:
+		now = time.time()
+		with self._lock:
+			tokens, wait = _spend(_refill(self._buckets.get(bucket), rate, burst, now), rate)
+			self._buckets[bucket] = (tokens, now)
+		return wait
+
+	def cap(self, bucket: str, tokens: float, rate: float, burst: float) -> None:
+		now = time.time()
+		with self._lock:
+			self._buckets[bucket] = (min(tokens, _refill(self._buckets.get(bucket), rate, burst, now)), now)
+
+
+class SQLiteState(SharedState):
+	kind = "sqlite"
+
+	def __init__(self, path: str) -> None:
+		self.path = path
+		self._local = threading.local()
+		self._writes = 0
+		conn = self._conn()
+		conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+		conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+	def _conn(self) -> sqlite3.Connection:
+		# One connection per thread (and process: connections must not cross a fork);
+		# autocommit, with explicit transactions where it matters
+		conn = getattr(self._local, "conn", None)
+		if conn is None or self._local.pid != os.getpid():
+			conn = self._local.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+			self._local.pid = os.getpid()
+			conn.execute("PRAGMA journal_mode=WAL")
+			conn.execute("PRAGMA synchronous=NORMAL")
+		return conn
+
+	def get(self, key: str) -> Optional[str]:
+		row = self._conn().execute("SELECT value FROM kv WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+		return row[0] if row else None
+
+	def set(self, key: str, value: str, ttl: float) -> None:
+		conn = self._conn()
+		now = time.time()
+		conn.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)", (key, value, now + ttl))
+		self._writes += 1
+		# Expired rows are pruned in batches rather than on every write
+		if self._writes % 200 == 0:
+			conn.execute("DELETE FROM kv WHERE expires <= ?", (now,))
+
+	def delete(self, key: str) -> None:
+		self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+	def items(self, prefix: str) -> Dict[str, str]:
+		rows = self._conn().execute(
+			"SELECT key, value FROM kv WHERE key >= ? AND key < ? AND expires > ?",
+			(prefix, prefix + "\uffff", time.time()),
+		)
+		return dict(rows.fetchall())
+
+	def _update_bucket(self, bucket: str, change: Any) -> float:
+		conn = self._conn()
+		now = time.time()
+		conn.execute("BEGIN IMMEDIATE")
+		try:
+			row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (bucket,)).fetchone()
+			tokens, result = change(row, now)
+			conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (bucket, tokens, now))
+			conn.execute("COMMIT")
+		except BaseException:
+			conn.execute("ROLLBACK")
+			raise
+		return result
+
+	def take(self, bucket: str, rate: float, burst: float) -> float:
+		return self._update_bucket(bucket, lambda row, now: _spend(_refill(row, rate, burst, now), rate))
+
+	def cap(self, bucket: str, tokens: float, rate: float, burst: float) -> None:
+		self._update_bucket(bucket, lambda row, now: (min(tokens, _refill(row, rate, burst, now)), 0.0))
+
+
+class RedisState(SharedState):
+	kind = "redis"
+
+	def __init__(self, client: Any) -> None:
+		self.client = client
+
+	def get(self, key: str) -> Optional[str]:
+		value = self.client.get(KEY_PREFIX + key)
+		return value.decode("utf-8") if isinstance(value, bytes) else value
+
+	def set(self, key: str, value: str, ttl: float) -> None:
+		self.client.set(KEY_PREFIX + key, value, px=max(1, int(ttl * 1000)))
+
+	def delete(self, key: str) -> None:
+		self.client.delete(KEY_PREFIX + key)
+
+	def items(self, prefix: str) -> Dict[str, str]:
+		keys = list(self.client.scan_iter(match=KEY_PREFIX + prefix + "*", count=500))
+		if not keys:
+			return {}
+		found: Dict[str, str] = {}
+		for key, value in zip(keys, self.client.mget(keys)):
+			if value is not None:
+				key = key.decode("utf-8") if isinstance(key, bytes) else key
+				found[key[len(KEY_PREFIX):]] = value.decode("utf-8") if isinstance(value, bytes) else value
+		return found
+
+	def _update_bucket(self, bucket: str, change: Any, expire: float) -> float:
+		key = KEY_PREFIX + "bucket:" + bucket
+
+		def transaction(pipe: Any) -> float:
+			# WATCH/MULTI rather than a Lua script, so stand-ins without Lua work too
+			tokens, updated = pipe.hmget(key, "tokens", "updated")
+			now = time.time()
+			row = (float(tokens), float(updated)) if tokens is not None and updated is not None else None
+			tokens, result = change(row, now)
+			pipe.multi()
+			pipe.hset(key, mapping={"tokens": tokens, "updated": now})
+			pipe.expire(key, max(1, int(expire)))
+			return result
+
+		return self.client.transaction(transaction, key, value_from_callable=True)
+
+	def take(self, bucket: str, rate: float, burst: float) -> float:
+		# An idle bucket is full again after burst / rate seconds, so it can expire then
+		return self._update_bucket(bucket, lambda row, now: _spend(_refill(row, rate, burst, now), rate), burst / rate + 60)
+
+	def cap(self, bucket: str, tokens: float, rate: float, burst: float) -> None:
+		self._update_bucket(bucket, lambda row, now: (min(tokens, _refill(row, rate, burst, now)), 0.0), (burst - tokens) / rate + 60)
+
+
+_clients: Dict[str, Any] = {}
+_state: Optional[SharedState] = None
+_lock = threading.Lock()
+
+
+def redis_client(url: Optional[str] = None) -> Any:
+	url = url or os.getenv("REDIS_URL", "redis://localhost:6379/0")
+	with _lock:
+		client = _clients.get(url)
+		if client is None:
+			import redis
+
+			client = _clients[url] = redis.Redis.from_url(url)
+		return client
+
+
+def shared_state() -> SharedState:
+	global _state
+	with _lock:
+		if _state is not None:
+			return _state
+		kind = os.getenv("SHARED_STATE", "memory").strip().lower()
+	if kind == "sqlite":
+		state: SharedState = SQLiteState(os.getenv("SHARED_STATE_PATH", "shared_state.db"))
+	elif kind == "redis":
+		state = RedisState(redis_client())
+	else:
+		state = MemoryState()
+	with _lock:
+		if _state is None:
+			_state = state
+		return _state
+
+
+def is_shared() -> bool:
+	return shared_state().kind != "memory"
@@ -0,0 +1,360 @@
+const chat = document.getElementById('chat');
+const form = document.getElementById('send-form');
+const promptInput = document.getElementById('prompt');
+const sendBtn = document.getElementById('send');
+const stopBtn = document.getElementById('stop');
+// Aborting the fetch hangs up on the server, which stops generation and keeps the partial reply
+let inflight = null;
+
+function enhanceCodeBlocks(container){
+	container.querySelectorAll('pre code').forEach((code)=>{
+		const pre = code.parentElement;
+		const btn = document.createElement('button');
+		btn.className = 'copy-btn';
+		btn.type = 'button';
+		btn.textContent = 'Copy';
+		btn.addEventListener('click', async ()=>{
+			try{ await navigator.clipboard.writeText(code.textContent); btn.textContent='Copied'; setTimeout(()=>btn.textContent='Copy', 1200);}catch(e){ btn.textContent='Failed'; setTimeout(()=>btn.textContent='Copy', 1200);} 
+		});
+		pre.style.position = 'relative';
+		pre.prepend(btn);
+	});
+}
+
+// Only rows near the viewport stay in the DOM. The rest are swapped for spacers
+// of the same height and re-created from their HTML when scrolled back into view.
+const OVERSCAN = 2; // viewports kept mounted above and below
+const view = { entries: [], start: 0, end: 0, topHeight: 0, bottomHeight: 0, hasMore: chat.dataset.hasMore === '1', loading: false };
+const topSpacer = document.createElement('div');
+const bottomSpacer = document.createElement('div');
+
+function createRow(entry){
+	if(entry.el) return entry.el;
+	const row = document.createElement('div');
+	row.className = 'row';
+	const card = document.createElement('div');
+	card.className = 'card ' + (entry.role === 'user' ? 'msg-user' : 'msg-assistant');
+	const md = document.createElement('div');
+	md.className = 'md';
+	md.innerHTML = entry.html;
+	enhanceCodeBlocks(md);
+	card.appendChild(md);
+	row.appendChild(card);
+	entry.el = row;
+	entry.md = md;
+	return row;
+}
+
+function release(entry){
+	entry.md.querySelectorAll('.copy-btn').forEach((b)=>b.remove());
+	entry.html = entry.md.innerHTML;
+	entry.el = entry.md = null;
+}
+
+function unmount(entry){
+	entry.height = entry.el.offsetHeight;
+	entry.el.remove();
+	// A reply that is still streaming keeps painting into its detached node
+	if(!entry.live){ release(entry); }
+}
+
+function setSpacers(){
+	if(view.start === 0){ view.topHeight = 0; }
+	if(view.end === view.entries.length){ view.bottomHeight = 0; }
+	topSpacer.style.height = view.topHeight + 'px';
+	bottomSpacer.style.height = view.bottomHeight + 'px';
+}
+
+function heightOf(from, to){
+	let total = 0;
+	for(let i = from; i < to; i++){ total += view.entries[i].height; }
+	return total;
+}
+
+// Scrollbar jumps: rebuild the window around the new position instead of
+// mounting every row in between
+function reposition(top){
+	for(let i = view.start; i < view.end; i++){ unmount(view.entries[i]); }
+	let index = 0, offset = topSpacer.offsetTop;
+	while(index < view.entries.length - 1 && offset + view.entries[index].height < top){ offset += view.entries[index].height; index++; }
+	view.start = view.end = index;
+	view.topHeight = heightOf(0, index);
+	view.bottomHeight = heightOf(index, view.entries.length);
+	setSpacers();
+}
+
+function updateWindow(){
+	const margin = chat.clientHeight * OVERSCAN;
+	const top = chat.scrollTop - margin;
+	const bottom = chat.scrollTop + chat.clientHeight + margin;
+	const entries = view.entries;
+	if(view.end > view.start){
+		const first = entries[view.start].el, last = entries[view.end - 1].el;
+		if(first.offsetTop > bottom || last.offsetTop + last.offsetHeight < top){ reposition(top); }
+	}
+	while(view.end - view.start > 1){
+		const e = entries[view.start];
+		if(e.el.offsetTop + e.el.offsetHeight >= top) break;
+		unmount(e);
+		view.topHeight += e.height;
+		view.start++;
+		setSpacers();
+	}
+	while(view.end - view.start > 1){
+		const e = entries[view.end - 1];
+		if(e.el.offsetTop <= bottom) break;
+		unmount(e);
+		view.bottomHeight += e.height;
+		view.end--;
+		setSpacers();
+	}
+	while(view.start > 0 && topSpacer.offsetTop + view.topHeight > top){
+		const e = entries[--view.start];
+		topSpacer.after(createRow(e));
+		view.topHeight = Math.max(0, view.topHeight - e.height);
+		setSpacers();
+		// Heights can change between mounts (e.g. after a resize); keep the view still
+		chat.scrollTop += e.el.offsetHeight - e.height;
+	}
+	while(view.end < entries.length && bottomSpacer.offsetTop < bottom){
+		const e = entries[view.end++];
+		bottomSpacer.before(createRow(e));
+		view.bottomHeight = Math.max(0, view.bottomHeight - e.height);
+		setSpacers();
+	}
+	if(view.start === 0 && entries.length && view.hasMore && !view.loading && chat.scrollTop < margin){ loadOlder(); }
+}
+
+let windowPending = false;
+function scheduleWindow(){
+	if(!windowPending){ windowPending = true; requestAnimationFrame(()=>{ windowPending = false; updateWindow(); }); }
+}
+
+async function loadOlder(){
+	view.loading = true;
+	try{
+		const res = await fetch('/history?before=' + view.entries[0].id);
+		if(!res.ok || view.start !== 0) return;
+		const page = await res.json();
+		view.hasMore = page.next !== null;
+		// Pages come newest first
+		const older = page.messages.reverse().map((m)=>({ id: m.id, role: m.role, html: m.html }));
+		const before = chat.scrollHeight;
+		const frag = document.createDocumentFragment();
+		older.forEach((e)=>frag.appendChild(createRow(e)));
+		topSpacer.after(frag);
+		view.entries = older.concat(view.entries);
+		view.end += older.length;
+		chat.scrollTop += chat.scrollHeight - before;
+	}catch(e){
+	}finally{
+		view.loading = false;
+	}
+	scheduleWindow();
+}
+
+function scrollToBottom(){
+	chat.scrollTop = chat.scrollHeight;
+}
+
+function nearBottom(){
+	return chat.scrollHeight - chat.scrollTop - chat.clientHeight < 80;
+}
+
+function addMessage(role, html){
+	if(view.end < view.entries.length){
+		// Scrolled up into unmounted history: jump back to the latest rows first
+		for(let i = view.start; i < view.end; i++){ unmount(view.entries[i]); }
+		view.start = view.end = view.entries.length;
+		view.topHeight = heightOf(0, view.entries.length);
+		setSpacers();
+	}
+	const entry = { role, html };
+	view.entries.push(entry);
+	view.end = view.entries.length;
+	bottomSpacer.before(createRow(entry));
+	scrollToBottom();
+	scheduleWindow();
+	return entry;
+}
+
+function addTyping(){
+	const row = document.createElement('div');
+	row.className = 'row';
+	row.id = 'typing-row';
+	const card = document.createElement('div');
+	card.className = 'card msg-assistant';
+	card.innerHTML = '<div class="typing"><span class="dot"></span><span class="dot"></span><span class="dot"></span></div>';
+	row.appendChild(card);
+	bottomSpacer.before(row);
+	scrollToBottom();
+}
+
+function removeTyping(){
+	const t = document.getElementById('typing-row');
+	if(t){ t.remove(); }
+}
+
+// History arrives as server-rendered HTML; only the copy buttons are added here
+chat.querySelectorAll('.row').forEach((row)=>{
+	const md = row.querySelector('.md');
+	enhanceCodeBlocks(md);
+	view.entries.push({ id: Number(row.dataset.id), role: md.dataset.role, el: row, md: md });
+});
+view.end = view.entries.length;
+chat.prepend(topSpacer);
+chat.append(bottomSpacer);
+scrollToBottom();
+chat.addEventListener('scroll', scheduleWindow, { passive:true });
+window.addEventListener('resize', scheduleWindow);
+scheduleWindow();
+
+// A streaming reply: finished blocks are appended once, the tail is replaced
+function addReply(){
+	const entry = addMessage('assistant', '');
+	entry.live = true;
+	const md = entry.md;
+	const done = document.createElement('div');
+	const tail = document.createElement('div');
+	md.append(done, tail);
+	let appended = '';
+	let tailHtml = null;
+	let pending = false;
+	function paint(){
+		pending = false;
+		// Follow the reply only if the reader has not scrolled up into history
+		const follow = nearBottom();
+		if(appended){
+			const block = document.createElement('div');
+			block.innerHTML = appended;
+			enhanceCodeBlocks(block);
+			done.append(...block.childNodes);
+			appended = '';
+		}
+		if(tailHtml !== null){
+			tail.innerHTML = tailHtml;
+			enhanceCodeBlocks(tail);
+			tailHtml = null;
+		}
+		if(follow){ scrollToBottom(); }
+	}
+	return {
+		update(evt){
+			if(evt.append){ appended += evt.append; }
+			if(evt.tail !== undefined){ tailHtml = evt.tail; }
+			if(!pending){ pending = true; requestAnimationFrame(paint); }
+		},
+		text(message){
+			paint();
+			const p = document.createElement('p');
+			p.textContent = message;
+			tail.append(p);
+		},
+		isEmpty(){ paint(); return !done.childNodes.length && !tail.childNodes.length; },
+		end(){
+			paint();
+			entry.live = false;
+			if(!entry.el.isConnected){ release(entry); }
+			scheduleWindow();
+		},
+	};
+}
+
+function setStreaming(controller){
+	inflight = controller;
+	sendBtn.hidden = !!controller;
+	stopBtn.hidden = !controller;
+}
+
+stopBtn.addEventListener('click', ()=>{ if(inflight){ inflight.abort(); } });
+document.addEventListener('keydown', (e)=>{ if(e.key === 'Escape' && inflight){ inflight.abort(); } });
+
+// "/model <name>" switches this session's model (checked against the provider's catalog); "/model" shows it
+async function setModel(name){
+	promptInput.value = '';
+	const reply = addReply();
+	try{
+		const res = await fetch('/model', name === null ? {} : { method:'POST', headers:{ 'Content-Type':'application/json' }, body: JSON.stringify({ model: name }) });
+		const j = await res.json();
+		if(j.error){ reply.text('[model] ' + j.error); }
+		else {
+			reply.text('[model] ' + j.model);
+			const mark = document.querySelector('.watermark');
+			if(mark){ mark.textContent = 'potato.ai • Model: ' + j.model; }
+		}
+	}catch(err){ reply.text('[error] ' + err); }
+	reply.end();
+}
+
+form.addEventListener('submit', async (e)=>{
+	e.preventDefault();
+	const text = promptInput.value.trim();
+	if(!text || inflight) return;
+	const command = text.match(/^\/model(?:\s+(\S+))?$/);
+	if(command){ setModel(command[1] === undefined ? null : command[1]); return; }
+	const user = addMessage('user', '');
+	user.md.textContent = text;
+	promptInput.value = '';
+	addTyping();
+	let reply = null;
+	const controller = new AbortController();
+	setStreaming(controller);
+	try{
+		const res = await fetch('/send_stream', { method:'POST', headers:{ 'Content-Type':'application/json' }, body: JSON.stringify({ prompt: text }), signal: controller.signal });
+		const reader = res.body.getReader();
+		const decoder = new TextDecoder();
+		let buf = '';
+		while(true){
+			const { value, done } = await reader.read();
+			if(done) break;
+			buf += decoder.decode(value, { stream:true });
+			let nl;
+			while((nl = buf.indexOf('\n')) >= 0){
+				const line = buf.slice(0, nl).trim();
+				buf = buf.slice(nl + 1);
+				if(!line) continue;
+				const evt = JSON.parse(line);
+				if(evt.user_html){
+					user.html = evt.user_html;
+					if(user.md){ user.md.innerHTML = evt.user_html; enhanceCodeBlocks(user.md); }
+				}
+				if(evt.append === undefined && evt.tail === undefined && !evt.error) continue;
+				if(!reply){ removeTyping(); reply = addReply(); }
+				if(evt.append === undefined && evt.tail === undefined){ reply.text(evt.error); }
+				else { reply.update(evt); }
+			}
+		}
+		removeTyping();
+		if(!reply){ reply = addReply(); }
+		if(reply.isEmpty()){ reply.text('[no response]'); }
+		reply.end();
+	}catch(err){
+		removeTyping();
+		if(!reply){ reply = addReply(); }
+		reply.text(controller.signal.aborted ? '[stopped]' : '[error] ' + err);
+		reply.end();
+	}finally{
+		setStreaming(null);
+	}
+});
+
+// Lock handling
+const lockEl = document.getElementById('lock');
+const lockInput = document.getElementById('lock-input');
+const lockBtn = document.getElementById('lock-btn');
+const lockMsg = document.getElementById('lock-msg');
+async function tryUnlock(){
+	const pw = (lockInput.value||'').trim();
+	if(!pw) return;
+	lockBtn.disabled = true;
+	lockMsg.textContent = 'Checking...';
+	try{
+		const r = await fetch('/unlock', { method:'POST', headers:{ 'Content-Type':'application/json' }, body: JSON.stringify({ password: pw }) });
+		const j = await r.json();
+		if(j.ok){ lockEl.style.display='none'; }
+		else { lockMsg.textContent = 'Incorrect password'; }
+	} catch(e){ lockMsg.textContent = 'Error'; }
+	lockBtn.disabled = false;
+}
+lockBtn.addEventListener('click', (e)=>{ e.preventDefault(); tryUnlock(); });
+lockInput.addEventListener('keydown', (e)=>{ if(e.key==='Enter'){ e.preventDefault(); tryUnlock(); } });
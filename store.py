@@ -0,0 +1,245 @@
+"""Server-side conversation storage for the web front ends.
+
+The session cookie only carries a conversation id; messages live here.
+
+	CONVERSATION_STORE   "sqlite", "memory" or "redis" (default sqlite, or redis when SHARED_STATE=redis)
+	CONVERSATION_DB_URL  SQLAlchemy URL for the sql store (default sqlite:///conversations.db)
+
+SQLite databases are opened in WAL mode so several gunicorn workers can share
+one file; the redis store uses REDIS_URL (see shared.py).
+
+Appends are a single insert and loads are paginated newest-first by message
+id, so neither grows with the length of the conversation. Each message can
+carry its rendered HTML (see render.py) so pages never re-render history;
+loads for a prompt leave it out with html=False.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text, create_engine, event, func, insert, inspect, select, text
+
+from shared import redis_client
+
+
+Message = Dict[str, object]
+
+
+def as_api_messages(messages: List[Message]) -> List[Dict[str, str]]:
+	# Strip store bookkeeping (ids, timestamps) before sending upstream
+	return [{"role": m["role"], "content": m["content"]} for m in messages]
+
+
+def _without_html(messages: List[Message], html: bool) -> List[Message]:
+	return messages if html else [{k: v for k, v in m.items() if k != "html"} for m in messages]
+
+
+class ConversationStore(ABC):
+	@abstractmethod
+	def create(self) -> str:
+		...
+
+	@abstractmethod
+	def exists(self, conversation_id: str) -> bool:
+		...
+
+	@abstractmethod
+	def append(self, conversation_id: str, role: str, content: str, html: Optional[str] = None) -> int:
+		...
+
+	@abstractmethod
+	def load(self, conversation_id: str, limit: int = 50, before: Optional[int] = None, html: bool = True) -> List[Message]:
+		"""Return up to `limit` messages older than `before`, in chronological order."""
+
+	@abstractmethod
+	def head(self, conversation_id: str, limit: int = 1) -> List[Message]:
+		"""Return the oldest `limit` messages (e.g. the system prompt), without their HTML."""
+
+	@abstractmethod
+	def count(self, conversation_id: str) -> int:
+		...
+
+	@abstractmethod
+	def messages(self, conversation_id: str) -> List[Message]:
+		...
+
+
+class MemoryConversationStore(ConversationStore):
+	def __init__(self) -> None:
+		self._lock = threading.Lock()
+		self._conversations: Dict[str, List[Message]] = {}
+
+	def create(self) -> str:
+		conversation_id = uuid.uuid4().hex
+		with self._lock:
+			self._conversations[conversation_id] = []
+		return conversation_id
+
+	def exists(self, conversation_id: str) -> bool:
+		return conversation_id in self._conversations
+
+	def append(self, conversation_id: str, role: str, content: str, html: Optional[str] = None) -> int:
+		with self._lock:
+			log = self._conversations.setdefault(conversation_id, [])
+			message_id = len(log) + 1
+			log.append({"id": message_id, "role": role, "content": content, "html": html, "created_at": time.time()})
+		return message_id
+
+	def load(self, conversation_id: str, limit: int = 50, before: Optional[int] = None, html: bool = True) -> List[Message]:
+		log = self._conversations.get(conversation_id, [])
+		# Ids are 1-based positions, so a page is a slice; callers get copies, as from the other stores
+		end = len(log) if before is None else max(0, min(len(log), before - 1))
+		return _without_html([dict(m) for m in log[max(0, end - limit):end]], html)
+
+	def head(self, conversation_id: str, limit: int = 1) -> List[Message]:
+		return _without_html(self._conversations.get(conversation_id, [])[:limit], False)
+
+	def count(self, conversation_id: str) -> int:
+		return len(self._conversations.get(conversation_id, []))
+
+	def messages(self, conversation_id: str) -> List[Message]:
+		return [dict(m) for m in self._conversations.get(conversation_id, [])]
+
+
+def _sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+	# Readers don't block the writer, and a busy writer is waited for instead of failing
+	cursor = dbapi_connection.cursor()
+	cursor.execute("PRAGMA journal_mode=WAL")
+	cursor.execute("PRAGMA synchronous=NORMAL")
+	cursor.execute("PRAGMA busy_timeout=10000")
+	cursor.close()
+
+
+class SQLConversationStore(ConversationStore):
+	def __init__(self, url: str) -> None:
+		self.engine = create_engine(url, future=True)
+		if self.engine.dialect.name == "sqlite":
+			event.listen(self.engine, "connect", _sqlite_pragmas)
+		metadata = MetaData()
+		self.conversations = Table(
+			"conversations",
+			metadata,
+			Column("id", String(32), primary_key=True),
+			Column("created_at", Float, nullable=False),
+		)
+		self.message_table = Table(
+			"messages",
+			metadata,
+			Column("id", Integer, primary_key=True, autoincrement=True),
+			Column("conversation_id", String(32), ForeignKey("conversations.id"), nullable=False),
+			Column("role", String(16), nullable=False),
+			Column("content", Text, nullable=False),
+			Column("html", Text, nullable=True),
+			Column("created_at", Float, nullable=False),
+			Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+		)
+		metadata.create_all(self.engine)
+		# With gunicorn's preload the master opened a pooled connection; a worker must not reuse it
+		os.register_at_fork(after_in_child=lambda: self.engine.dispose(close=False))
+		# Databases created before messages had cached HTML
+		if "html" not in {c["name"] for c in inspect(self.engine).get_columns("messages")}:
+			with self.engine.begin() as conn:
+				conn.execute(text("ALTER TABLE messages ADD COLUMN html TEXT"))
+
+	def create(self) -> str:
+		conversation_id = uuid.uuid4().hex
+		with self.engine.begin() as conn:
+			conn.execute(insert(self.conversations).values(id=conversation_id, created_at=time.time()))
+		return conversation_id
+
+	def exists(self, conversation_id: str) -> bool:
+		with self.engine.connect() as conn:
+			row = conn.execute(select(self.conversations.c.id).where(self.conversations.c.id == conversation_id)).first()
+		return row is not None
+
+	def append(self, conversation_id: str, role: str, content: str, html: Optional[str] = None) -> int:
+		with self.engine.begin() as conn:
+			result = conn.execute(
+				insert(self.message_table).values(
+					conversation_id=conversation_id, role=role, content=content, html=html, created_at=time.time()
+				)
+			)
+		return int(result.inserted_primary_key[0])
+
+	def load(self, conversation_id: str, limit: int = 50, before: Optional[int] = None, html: bool = True) -> List[Message]:
+		m = self.message_table
+		columns = [m.c.id, m.c.role, m.c.content, m.c.created_at] + ([m.c.html] if html else [])
+		query = select(*columns).where(m.c.conversation_id == conversation_id)
+		if before is not None:
+			query = query.where(m.c.id < before)
+		query = query.order_by(m.c.id.desc()).limit(limit)
+		with self.engine.connect() as conn:
+			rows = conn.execute(query).mappings().all()
+		return [dict(row) for row in reversed(rows)]
+
+	def head(self, conversation_id: str, limit: int = 1) -> List[Message]:
+		m = self.message_table
+		query = select(m.c.id, m.c.role, m.c.content, m.c.created_at).where(m.c.conversation_id == conversation_id).order_by(m.c.id).limit(limit)
+		with self.engine.connect() as conn:
+			return [dict(row) for row in conn.execute(query).mappings()]
+
+	def count(self, conversation_id: str) -> int:
+		m = self.message_table
+		with self.engine.connect() as conn:
+			return int(conn.execute(select(func.count()).select_from(m).where(m.c.conversation_id == conversation_id)).scalar_one())
+
+	def messages(self, conversation_id: str) -> List[Message]:
+		m = self.message_table
+		query = select(m.c.id, m.c.role, m.c.content, m.c.html, m.c.created_at).where(m.c.conversation_id == conversation_id).order_by(m.c.id)
+		with self.engine.connect() as conn:
+			return [dict(row) for row in conn.execute(query).mappings()]
+
+
+class RedisConversationStore(ConversationStore):
+	"""One list per conversation; a message's id is its 1-based position, as in the memory store."""
+
+	def __init__(self, client: Any, prefix: str = "chat:conversation:") -> None:
+		self.client = client
+		self.prefix = prefix
+
+	def create(self) -> str:
+		conversation_id = uuid.uuid4().hex
+		self.client.set(self.prefix + conversation_id, time.time())
+		return conversation_id
+
+	def exists(self, conversation_id: str) -> bool:
+		return bool(self.client.exists(self.prefix + conversation_id))
+
+	def append(self, conversation_id: str, role: str, content: str, html: Optional[str] = None) -> int:
+		record = json.dumps({"role": role, "content": content, "html": html, "created_at": time.time()}, ensure_ascii=False)
+		return int(self.client.rpush(self.prefix + conversation_id + ":messages", record))
+
+	def _range(self, conversation_id: str, start: int, end: int) -> List[Message]:
+		if end <= start:
+			return []
+		rows = self.client.lrange(self.prefix + conversation_id + ":messages", start, end - 1)
+		return [{"id": start + i + 1, **json.loads(row)} for i, row in enumerate(rows)]
+
+	def load(self, conversation_id: str, limit: int = 50, before: Optional[int] = None, html: bool = True) -> List[Message]:
+		count = int(self.client.llen(self.prefix + conversation_id + ":messages"))
+		end = count if before is None else max(0, min(count, before - 1))
+		return _without_html(self._range(conversation_id, max(0, end - limit), end), html)
+
+	def head(self, conversation_id: str, limit: int = 1) -> List[Message]:
+		return _without_html(self._range(conversation_id, 0, limit), False)
+
+	def count(self, conversation_id: str) -> int:
+		return int(self.client.llen(self.prefix + conversation_id + ":messages"))
+
+	def messages(self, conversation_id: str) -> List[Message]:
+		rows = self.client.lrange(self.prefix + conversation_id + ":messages", 0, -1)
+		return [{"id": i + 1, **json.loads(row)} for i, row in enumerate(rows)]
+
+
+def create_store() -> ConversationStore:
+	default = "redis" if os.getenv("SHARED_STATE", "").strip().lower() == "redis" else "sqlite"
+	kind = os.getenv("CONVERSATION_STORE", default).strip().lower()
+	if kind == "memory":
+		return MemoryConversationStore()
+	if kind == "redis":
+		return RedisConversationStore(redis_client())
+	return SQLConversationStore(os.getenv("CONVERSATION_DB_URL", "sqlite:///conversations.db"))
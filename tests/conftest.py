@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing web.py must not touch conversations.db or reach a provider
+os.environ.setdefault("CONVERSATION_STORE", "memory")
+os.environ.setdefault("WARMUP", "0")
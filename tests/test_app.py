@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+pytest.importorskip("streamlit")
+
+from streamlit.testing.v1 import AppTest
+
+import completions
+import warmup
+
+# app.FOLD_AFTER; importing app.py would run the script
+FOLD_AFTER = 20
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+@pytest.fixture
+def at(monkeypatch):
+	monkeypatch.setattr(completions, "stream", lambda router, model, messages, headers: iter(["hel", "lo"]))
+	monkeypatch.setattr(warmup, "check_model", lambda router, model: None)
+	at = AppTest.from_file(APP, default_timeout=30)
+	at.run()
+	at.text_input(key="api_key").input("key").run()
+	return at
+
+
+def send(at, count):
+	for i in range(count):
+		# The chat input is written to st.bottom from inside the chat fragment
+		at.chat_input[0].set_value(f"question {i}").run()
+		assert not at.exception
+
+
+def test_chat_input_sends_from_the_fragment(at):
+	send(at, 1)
+	assert [(m["role"], m["content"]) for m in at.session_state.messages[1:]] == [("user", "question 0"), ("assistant", "hello")]
+
+
+def test_full_runs_draw_a_bounded_number_of_messages(at):
+	send(at, 3 * FOLD_AFTER)
+	at.run()
+	assert len(at.session_state.messages) == 1 + 6 * FOLD_AFTER
+	# Every fold is pre-rendered once and hidden; the last one is drawn as chat
+	assert len(at.session_state.folds) == 5
+	assert len(at.chat_message) == FOLD_AFTER
+	assert len(at.get("html")) == 0
+
+	at.toggle(key="show_earlier").set_value(True).run()
+	assert len(at.get("html")) == 5
+	assert "question 0" in at.get("html")[0].proto.body
+
+
+def test_clear_drops_the_folds(at):
+	send(at, FOLD_AFTER)
+	at.button[0].click().run()
+	assert len(at.session_state.messages) == 1
+	assert at.session_state.folds == []
+	assert len(at.toggle) == 0
+
+
+def test_model_is_checked_only_when_the_selection_changes(at, monkeypatch):
+	checked = []
+
+	def check_model(router, model):
+		checked.append(model)
+		return f"no model named {model}" if model == "missing" else None
+
+	monkeypatch.setattr(warmup, "check_model", check_model)
+	at.text_input(key="model").input("missing").run()
+	at.text_input(key="referer").input("https://example.test").run()
+	at.text_input(key="title").input("Chat").run()
+	assert checked == ["missing"]
+	assert at.warning[0].value == "no model named missing"
+	at.text_input(key="model").input("gpt-4o-mini").run()
+	assert checked == ["missing", "gpt-4o-mini"]
+	assert len(at.warning) == 0
@@ -0,0 +1,162 @@
+import asyncio
+import json
+
+import pytest
+from flask.sessions import SecureCookieSession
+
+import asgi
+import completions
+from asgi import ConcurrencyGate, Overloaded
+
+
+class Client:
+	"""One ASGI request: sends `body`, then disconnects once `hang_up` is set."""
+
+	def __init__(self, body=b"", hang_up=None):
+		self.messages = [{"type": "http.request", "body": body, "more_body": False}]
+		self.hang_up = hang_up or asyncio.Event()
+		self.sent = []
+
+	async def receive(self):
+		if self.messages:
+			return self.messages.pop(0)
+		await self.hang_up.wait()
+		return {"type": "http.disconnect"}
+
+	async def send(self, message):
+		self.sent.append(message)
+
+	@property
+	def status(self):
+		return self.sent[0]["status"]
+
+	@property
+	def body(self):
+		return b"".join(m.get("body", b"") for m in self.sent[1:])
+
+
+def chat_scope(path="/send_json"):
+	# "session=<signed value>" out of the Set-Cookie header
+	cookie = asgi.session_cookie(SecureCookieSession({"unlocked": True}))[1].split(b";")[0]
+	return {"type": "http", "method": "POST", "path": path, "headers": [(b"cookie", cookie)]}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+	release = asyncio.Event()
+	calls = []
+
+	async def astream(router, model, messages, headers):
+		calls.append(messages[-1]["content"])
+		yield "hello"
+		await release.wait()
+		yield " world"
+
+	monkeypatch.setattr(asgi.router, "providers", [object()])
+	monkeypatch.setattr(completions, "astream", astream)
+	return release, calls
+
+
+def stored_turns(prompt):
+	"""The stored turns of the newest conversation opened with `prompt`."""
+	for conversation_id in reversed(list(asgi.store._conversations)):
+		turns = [(m["role"], m["content"]) for m in asgi.store.messages(conversation_id)][1:]
+		if turns and turns[0] == ("user", prompt):
+			return turns
+	return []
+
+
+def test_gate_queues_then_rejects():
+	async def main():
+		gate = ConcurrencyGate(limit=1, queue=1)
+		release = asyncio.Event()
+		order = []
+
+		async def hold(name):
+			async with gate:
+				order.append(name)
+				await release.wait()
+
+		first = asyncio.ensure_future(hold("first"))
+		await asyncio.sleep(0)
+		second = asyncio.ensure_future(hold("second"))
+		await asyncio.sleep(0)
+		assert (gate.active, gate.waiting) == (1, 1)
+		with pytest.raises(Overloaded):
+			async with gate:
+				pass
+		release.set()
+		await asyncio.gather(first, second)
+		assert order == ["first", "second"]
+		assert (gate.active, gate.waiting) == (0, 0)
+
+	asyncio.run(main())
+
+
+def test_reply_is_sent_and_stored(upstream):
+	release, calls = upstream
+	release.set()
+	client = Client(json.dumps({"prompt": "hi"}).encode())
+	asyncio.run(asgi.app(chat_scope(), client.receive, client.send))
+	assert client.status == 200
+	assert json.loads(client.body)["assistant"] == "hello world"
+	assert calls == ["hi"]
+	assert stored_turns("hi") == [("user", "hi"), ("assistant", "hello world")]
+
+
+def test_overload_answers_503_and_keeps_turns_paired(monkeypatch, upstream):
+	monkeypatch.setattr(asgi, "gate", ConcurrencyGate(limit=1, queue=0))
+
+	async def main():
+		busy = Client(json.dumps({"prompt": "first"}).encode())
+		first = asyncio.ensure_future(asgi.app(chat_scope(), busy.receive, busy.send))
+		while asgi.gate.active == 0:
+			await asyncio.sleep(0.01)
+		rejected = Client(json.dumps({"prompt": "second"}).encode())
+		await asgi.app(chat_scope(), rejected.receive, rejected.send)
+		upstream[0].set()
+		await first
+		return rejected
+
+	rejected = asyncio.run(main())
+	assert rejected.status == 503
+	assert (b"retry-after", b"1") in rejected.sent[0]["headers"]
+	assert stored_turns("second") == [("user", "second"), ("assistant", "[busy] Server is at capacity, please retry")]
+	assert stored_turns("first") == [("user", "first"), ("assistant", "hello world")]
+
+
+def test_disconnect_cancels_the_stream_and_stores_the_partial_reply(upstream):
+	async def main():
+		client = Client(json.dumps({"prompt": "hi"}).encode())
+		task = asyncio.ensure_future(asgi.app(chat_scope("/send_stream"), client.receive, client.send))
+		while b"hello" not in client.body:
+			await asyncio.sleep(0.01)
+		client.hang_up.set()
+		await asyncio.wait_for(task, 2)
+		return client
+
+	client = asyncio.run(main())
+	assert b"done" not in client.body
+	assert stored_turns("hi") == [("user", "hi"), ("assistant", "hello")]
+
+
+def test_lifespan_starts_warm_up_and_closes_clients(monkeypatch):
+	events = []
+	monkeypatch.setattr(asgi.warmup, "astart", lambda router, model: events.append("warm-up"))
+
+	async def aclose_all():
+		events.append("closed")
+
+	monkeypatch.setattr(asgi, "aclose_all", aclose_all)
+	messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+	sent = []
+
+	async def receive():
+		return messages.pop(0)
+
+	async def send(message):
+		sent.append(message["type"])
+
+	asyncio.run(asgi.app({"type": "lifespan"}, receive, send))
+	assert events == ["warm-up", "closed"]
+	assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
@@ -0,0 +1,61 @@
+import pytest
+
+from assets import accepted_encodings, build_asset
+
+DATA = b"body { color: red; }\n" * 200
+
+
+@pytest.fixture
+def asset():
+	built = build_asset("chat.css", DATA)
+	if built.br is None:
+		# Brotli is optional; stand in for it so the choice between encodings is tested
+		built.br = b"brotli"
+	return built
+
+
+def test_accept_encoding_parsing():
+	assert accepted_encodings("gzip, br;q=0.5, *;q=0") == {"gzip": 1.0, "br": 0.5, "*": 0.0}
+	assert accepted_encodings("") == {}
+	assert accepted_encodings("br;q=bogus") == {"br": 0.0}
+
+
+@pytest.mark.parametrize("header, encoding", [
+	("gzip, deflate, br", "br"),
+	("gzip", "gzip"),
+	("br;q=0, gzip", "gzip"),
+	("br;q=0.2, gzip;q=0.8", "gzip"),
+	("gzip;q=0, br;q=0", None),
+	("*", "br"),
+	("*;q=0.5, br;q=0", "gzip"),
+	("identity", None),
+	("", None),
+	("brotli", None),
+])
+def test_body_honours_q_values(asset, header, encoding):
+	body, chosen = asset.body(header)
+	assert chosen == encoding
+	assert body == {"br": asset.br, "gzip": asset.gzip, None: asset.data}[encoding]
+
+
+def test_each_encoding_has_its_own_etag(asset):
+	etags = {asset.etag_for(encoding) for encoding in ("br", "gzip", None)}
+	assert len(etags) == 3
+	assert asset.etag_for(None) == asset.etag
+
+
+def test_served_asset_revalidates_per_encoding():
+	import web
+
+	asset = web.assets.by_name["chat.css"]
+	client = web.app.test_client()
+	gzip_response = client.get(asset.url, headers={"Accept-Encoding": "gzip"})
+	plain_response = client.get(asset.url, headers={"Accept-Encoding": "identity"})
+	assert gzip_response.headers["Content-Encoding"] == "gzip"
+	assert "Content-Encoding" not in plain_response.headers
+	assert "Accept-Encoding" in gzip_response.headers["Vary"]
+	assert gzip_response.headers["ETag"] != plain_response.headers["ETag"]
+	# A cached gzip body doesn't validate a request for the identity one
+	revalidated = client.get(asset.url, headers={"Accept-Encoding": "identity", "If-None-Match": gzip_response.headers["ETag"]})
+	assert revalidated.status_code == 200
+	assert client.get(asset.url, headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_response.headers["ETag"]}).status_code == 304
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import json
+
+import pytest
+
+import batch
+import completions
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+	state = {"active": 0, "peak": 0, "calls": [], "fail": set()}
+
+	async def acomplete(router, model, messages, headers):
+		prompt = messages[-1]["content"]
+		state["calls"].append(prompt)
+		state["active"] += 1
+		state["peak"] = max(state["peak"], state["active"])
+		await asyncio.sleep(0.01)
+		state["active"] -= 1
+		if prompt in state["fail"]:
+			raise RuntimeError("upstream down")
+		return f"answer to {prompt}"
+
+	monkeypatch.setattr(completions, "acomplete", acomplete)
+	return state
+
+
+def arguments(tmp_path, prompts, concurrency=3):
+	path = tmp_path / "prompts.jsonl"
+	path.write_text("".join(json.dumps(p) + "\n" for p in prompts), encoding="utf-8")
+	parser = argparse.ArgumentParser()
+	batch.add_arguments(parser)
+	return parser.parse_args([str(path), "-c", str(concurrency)])
+
+
+def results(tmp_path):
+	lines = (tmp_path / "prompts.results.jsonl").read_text(encoding="utf-8").splitlines()
+	return [json.loads(line) for line in lines]
+
+
+def run(args, system=""):
+	summary = batch.Summary()
+	asyncio.run(batch.run(args, None, "m", {}, system, summary))
+	return summary
+
+
+def test_prompts_run_concurrently_up_to_the_limit(tmp_path, upstream):
+	args = arguments(tmp_path, [{"id": f"p{i}", "prompt": f"q{i}"} for i in range(12)])
+	summary = run(args, system="be brief")
+	assert upstream["peak"] == 3
+	assert summary.done == 12 and summary.failed == 0
+	records = {r["id"]: r for r in results(tmp_path)}
+	assert set(records) == {f"p{i}" for i in range(12)}
+	assert records["p4"]["output"] == "answer to q4"
+	assert records["p4"]["tokens_in"] > 0 and records["p4"]["tokens_out"] > 0
+
+
+def test_a_rerun_skips_finished_prompts_and_retries_failures(tmp_path, upstream):
+	args = arguments(tmp_path, ["first", "second", {"id": "x", "messages": [{"role": "user", "content": "third"}]}])
+	upstream["fail"].add("second")
+	summary = run(args)
+	assert (summary.done, summary.failed) == (2, 1)
+	errors = {r["id"]: r["error"] for r in results(tmp_path)}
+	assert errors == {"1": None, "2": "RuntimeError: upstream down", "x": None}
+
+	upstream["fail"].clear()
+	upstream["calls"].clear()
+	summary = run(args)
+	assert upstream["calls"] == ["second"]
+	assert (summary.done, summary.skipped) == (1, 2)
+	# Readers keep the last line per id
+	last = {r["id"]: r for r in results(tmp_path)}
+	assert last["2"]["output"] == "answer to second"
+
+
+def test_a_half_written_line_is_dropped_before_resuming(tmp_path, upstream):
+	args = arguments(tmp_path, ["first", "second"])
+	out = tmp_path / "prompts.results.jsonl"
+	out.write_text(json.dumps({"id": "1", "output": "answer to first", "error": None}) + '\n{"id": "2", "out', encoding="utf-8")
+	run(args)
+	assert upstream["calls"] == ["second"]
+	assert [r["id"] for r in results(tmp_path)] == ["1", "2"]
@@ -0,0 +1,87 @@
+import pytest
+
+import cache
+from cache import CompletionCache, SharedTier, cache_key
+from shared import SQLiteState
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	now = [1000.0]
+	monkeypatch.setattr(cache.time, "time", lambda: now[0])
+	return now
+
+
+def test_key_ignores_whitespace_but_not_params():
+	messages = [{"role": "user", "content": "hello  world\n"}]
+	same = [{"role": "user", "content": " hello world"}]
+	assert cache_key("m", messages) == cache_key("m", same)
+	assert cache_key("m", messages) != cache_key("m", messages, {"temperature": 0.2})
+	assert cache_key("m", messages) != cache_key("other", messages)
+
+
+def test_memory_tier_evicts_the_least_recently_used():
+	completions = CompletionCache(max_entries=2)
+	completions.put("a", "1")
+	completions.put("b", "2")
+	assert completions.get("a") == "1"
+	completions.put("c", "3")
+	assert completions.get("b") is None
+	assert (completions.get("a"), completions.get("c")) == ("1", "3")
+	assert completions.stats()["evictions"] == 1
+
+
+def test_answers_expire_after_the_ttl(clock):
+	completions = CompletionCache(ttl=60)
+	completions.put("a", "1")
+	clock[0] += 59
+	assert completions.get("a") == "1"
+	clock[0] += 2
+	assert completions.get("a") is None
+	assert completions.stats()["expirations"] == 1
+
+
+def test_disk_tier_survives_a_restart(tmp_path, clock):
+	path = str(tmp_path / "completions.db")
+	CompletionCache(ttl=60, path=path).put("a", "1")
+	restarted = CompletionCache(ttl=60, path=path)
+	assert restarted.get("a") == "1"
+	assert restarted.stats()["disk_hits"] == 1
+	# Promoted into memory, so the next read doesn't touch the disk
+	assert restarted.get("a") == "1"
+	assert restarted.stats()["disk_hits"] == 1
+	clock[0] += 61
+	assert CompletionCache(ttl=60, path=path).get("a") is None
+	assert restarted.disk.get("a") is None
+
+
+def test_disk_tier_prunes_to_its_row_limit(tmp_path):
+	completions = CompletionCache(max_entries=10, path=str(tmp_path / "completions.db"), disk_max=50)
+	for i in range(100):
+		completions.put(f"k{i}", str(i))
+	count = completions.disk._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+	assert count == 50
+	assert completions.stats()["evictions"] == 90 + 50
+
+
+def test_workers_share_answers_through_the_shared_tier(tmp_path):
+	path = str(tmp_path / "shared.db")
+	first = CompletionCache(tier=SharedTier(SQLiteState(path)))
+	second = CompletionCache(tier=SharedTier(SQLiteState(path)))
+	first.put("a", "answer")
+	assert second.get("a") == "answer"
+	assert second.stats()["disk_hits"] == 1
+	assert second.get("b") is None
+
+
+def test_shared_cache_is_off_unless_enabled(monkeypatch, tmp_path):
+	monkeypatch.setattr(cache, "_shared", None)
+	monkeypatch.delenv("COMPLETION_CACHE", raising=False)
+	assert cache.shared_cache() is None
+	monkeypatch.setenv("COMPLETION_CACHE", "1")
+	monkeypatch.setenv("COMPLETION_CACHE_PATH", str(tmp_path / "completions.db"))
+	monkeypatch.setenv("COMPLETION_CACHE_SIZE", "7")
+	completions = cache.shared_cache()
+	assert completions is cache.shared_cache()
+	assert completions.max_entries == 7
+	assert completions.disk is not None
@@ -0,0 +1,70 @@
+import socket
+import time
+
+import pytest
+
+from cancel import CancelScope, DisconnectWatcher
+
+
+def wait_for(condition, timeout=2.0):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		if time.monotonic() > deadline:
+			return False
+		time.sleep(0.01)
+	return True
+
+
+@pytest.fixture
+def connection():
+	server, client = socket.socketpair()
+	yield server, client
+	server.close()
+	client.close()
+
+
+def test_peer_hanging_up_cancels_the_scope(connection):
+	server, client = connection
+	watcher = DisconnectWatcher(interval=0.02)
+	with watcher.watch(server, CancelScope()) as scope:
+		client.close()
+		assert wait_for(lambda: scope.cancelled)
+	assert scope.reason == "disconnected"
+	# Peeking consumed nothing
+	assert server.recv(1) == b""
+
+
+def test_connected_peer_is_left_alone(connection):
+	server, client = connection
+	watcher = DisconnectWatcher(interval=0.02)
+	with watcher.watch(server, CancelScope()) as scope:
+		assert not wait_for(lambda: scope.cancelled, timeout=0.2)
+
+
+def test_more_request_bytes_stop_the_watch_without_cancelling(connection):
+	server, client = connection
+	watcher = DisconnectWatcher(interval=0.02)
+	with watcher.watch(server, CancelScope()) as scope:
+		client.sendall(b"x")
+		assert wait_for(lambda: not watcher._selector.get_map())
+		client.close()
+		assert not wait_for(lambda: scope.cancelled, timeout=0.2)
+	# The pipelined byte is still there for the server to read
+	assert server.recv(1) == b"x"
+
+
+def test_finished_replies_are_no_longer_watched(connection):
+	server, client = connection
+	watcher = DisconnectWatcher(interval=0.02)
+	with watcher.watch(server, CancelScope()) as scope:
+		pass
+	client.close()
+	assert not wait_for(lambda: scope.cancelled, timeout=0.2)
+
+
+def test_servers_without_a_socket_are_not_watched():
+	watcher = DisconnectWatcher(interval=0.02)
+	with watcher.watch(None, CancelScope()) as scope:
+		pass
+	assert not scope.cancelled
+	assert watcher._selector is None
@@ -0,0 +1,198 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from coalesce import COALESCED, Coalescer
+
+
+class Boom(Exception):
+	pass
+
+
+def joined(mode):
+	return COALESCED.snapshot().get((("mode", mode),), 0.0)
+
+
+def run_concurrently(count, target):
+	"""Run `target` on `count` threads; returns each one's result or exception."""
+	results = [None] * count
+
+	def run(index):
+		try:
+			results[index] = target()
+		except BaseException as exc:
+			results[index] = exc
+
+	threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+	for thread in threads:
+		thread.start()
+	return threads, results
+
+
+def wait_for(condition, timeout=5.0):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		assert time.monotonic() < deadline, "timed out"
+		time.sleep(0.005)
+
+
+def test_identical_completions_make_one_upstream_call():
+	coalescer = Coalescer()
+	calls = []
+	release = threading.Event()
+	before = joined("complete")
+
+	def call():
+		calls.append(1)
+		release.wait(5)
+		return "answer"
+
+	threads, results = run_concurrently(8, lambda: coalescer.complete("key", call))
+	wait_for(lambda: joined("complete") - before == 7)
+	release.set()
+	for thread in threads:
+		thread.join(5)
+	assert calls == [1]
+	assert results == ["answer"] * 8
+
+
+def test_completion_error_reaches_every_waiter():
+	coalescer = Coalescer()
+	calls = []
+	release = threading.Event()
+	before = joined("complete")
+
+	def call():
+		calls.append(1)
+		release.wait(5)
+		raise Boom("upstream failed")
+
+	threads, results = run_concurrently(5, lambda: coalescer.complete("key", call))
+	wait_for(lambda: joined("complete") - before == 4)
+	release.set()
+	for thread in threads:
+		thread.join(5)
+	assert calls == [1]
+	assert all(isinstance(result, Boom) for result in results)
+	# The failed flight is forgotten, so the next request calls upstream again
+	assert coalescer.complete("key", lambda: "retry") == "retry"
+
+
+def test_stream_subscribers_share_one_source():
+	coalescer = Coalescer()
+	calls = []
+	release = threading.Event()
+	before = joined("stream")
+
+	def source():
+		calls.append(1)
+		yield "a"
+		release.wait(5)
+		yield "b"
+		yield "c"
+
+	threads, results = run_concurrently(6, lambda: "".join(coalescer.stream("key", source)))
+	wait_for(lambda: joined("stream") - before == 5)
+	release.set()
+	for thread in threads:
+		thread.join(5)
+	assert calls == [1]
+	# Late joiners get the chunks produced before they arrived too
+	assert results == ["abc"] * 6
+
+
+def test_stream_error_reaches_every_subscriber():
+	coalescer = Coalescer()
+	release = threading.Event()
+	before = joined("stream")
+
+	def source():
+		yield "partial"
+		release.wait(5)
+		raise Boom("stream failed")
+
+	threads, results = run_concurrently(4, lambda: list(coalescer.stream("key", source)))
+	wait_for(lambda: joined("stream") - before == 3)
+	release.set()
+	for thread in threads:
+		thread.join(5)
+	assert all(isinstance(result, Boom) for result in results)
+
+
+def test_abandoned_stream_closes_the_source():
+	coalescer = Coalescer()
+	closed = threading.Event()
+
+	def source():
+		try:
+			yield "first"
+			while True:
+				time.sleep(0.01)
+				yield "more"
+		finally:
+			closed.set()
+
+	stream = coalescer.stream("key", source)
+	assert next(stream) == "first"
+	stream.close()
+	assert closed.wait(5)
+
+
+def test_async_completions_make_one_upstream_call():
+	coalescer = Coalescer()
+	calls = []
+
+	async def call():
+		calls.append(1)
+		await asyncio.sleep(0.05)
+		return "answer"
+
+	async def main():
+		return await asyncio.gather(*(coalescer.acomplete("key", call) for _ in range(8)))
+
+	assert asyncio.run(main()) == ["answer"] * 8
+	assert calls == [1]
+
+
+def test_async_completion_error_reaches_every_waiter():
+	coalescer = Coalescer()
+	calls = []
+
+	async def call():
+		calls.append(1)
+		await asyncio.sleep(0.05)
+		raise Boom("upstream failed")
+
+	async def main():
+		return await asyncio.gather(*(coalescer.acomplete("key", call) for _ in range(5)), return_exceptions=True)
+
+	results = asyncio.run(main())
+	assert calls == [1]
+	assert all(isinstance(result, Boom) for result in results)
+
+
+def test_async_stream_subscribers_share_one_source_and_its_error():
+	coalescer = Coalescer()
+	calls = []
+
+	async def source():
+		calls.append(1)
+		yield "a"
+		await asyncio.sleep(0.05)
+		yield "b"
+		raise Boom("stream failed")
+
+	async def read():
+		chunks = []
+		with pytest.raises(Boom):
+			async for chunk in coalescer.astream("key", source):
+				chunks.append(chunk)
+		return "".join(chunks)
+
+	async def main():
+		return await asyncio.gather(*(read() for _ in range(4)))
+
+	assert asyncio.run(main()) == ["ab"] * 4
+	assert calls == [1]
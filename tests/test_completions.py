@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import completions
+
+
+class SlowCache:
+	"""A completion cache whose tiers take `delay` seconds per round trip."""
+
+	def __init__(self, delay):
+		self.delay = delay
+		self.values = {}
+
+	def get(self, key):
+		time.sleep(self.delay)
+		return self.values.get(key)
+
+	def put(self, key, value):
+		time.sleep(self.delay)
+		self.values[key] = value
+
+
+class Router:
+	async def acomplete(self, model, messages, extra_headers, **params):
+		return "answer"
+
+	async def astream(self, model, messages, extra_headers, **params):
+		for piece in ("ans", "wer"):
+			yield piece
+
+
+def longest_stall(work):
+	"""Run `work` next to a 10ms ticker; returns the longest gap between ticks."""
+
+	async def main():
+		ticks = []
+
+		async def tick():
+			while True:
+				ticks.append(time.monotonic())
+				await asyncio.sleep(0.01)
+
+		ticker = asyncio.ensure_future(tick())
+		result = await work()
+		ticker.cancel()
+		return result, max(b - a for a, b in zip(ticks, ticks[1:]))
+
+	return asyncio.run(main())
+
+
+def ask(question):
+	return [{"role": "user", "content": question}]
+
+
+def test_async_complete_keeps_the_loop_free_during_cache_calls(monkeypatch):
+	cache = SlowCache(0.2)
+	monkeypatch.setattr(completions, "shared_cache", lambda: cache)
+	monkeypatch.setattr(completions, "shared_coalescer", lambda: None)
+	text, stall = longest_stall(lambda: completions.acomplete(Router(), "m", ask("hi")))
+	assert text == "answer"
+	assert stall < 0.1
+	# The answer was stored, and is served from the cache next time
+	assert list(cache.values.values()) == ["answer"]
+
+
+def test_async_stream_keeps_the_loop_free_during_cache_calls(monkeypatch):
+	cache = SlowCache(0.2)
+	monkeypatch.setattr(completions, "shared_cache", lambda: cache)
+	monkeypatch.setattr(completions, "shared_coalescer", lambda: None)
+
+	async def read():
+		return "".join([piece async for piece in completions.astream(Router(), "m", ask("hi"))])
+
+	for _ in range(2):
+		text, stall = longest_stall(read)
+		assert text == "answer"
+		assert stall < 0.1
+	assert list(cache.values.values()) == ["answer"]
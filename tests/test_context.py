@@ -0,0 +1,113 @@
+import threading
+
+from context import ContextWindow
+from store import MemoryConversationStore, SQLConversationStore
+
+
+def conversation(store, turns, words=40):
+	conversation_id = store.create()
+	store.append(conversation_id, "system", "You are a helpful, concise assistant.")
+	for turn in range(turns):
+		store.append(conversation_id, "user", f"question {turn} " + "word " * words)
+		store.append(conversation_id, "assistant", f"answer {turn} " + "word " * words, "<p>html</p>")
+	return conversation_id
+
+
+def fit_tail(window, store, conversation_id, reads=None):
+	def load(limit, before):
+		page = store.load(conversation_id, limit, before, html=False)
+		if reads is not None:
+			reads.extend(page)
+		return page
+
+	return window.fit_tail(store.head(conversation_id, 4), load, store.count(conversation_id))
+
+
+def test_short_conversation_matches_fit():
+	store = MemoryConversationStore()
+	conversation_id = conversation(store, 3)
+	window = ContextWindow(budget=6000)
+	kept, stats = fit_tail(window, store, conversation_id)
+	expected, _ = window.fit(store.messages(conversation_id))
+	assert [m["content"] for m in kept] == [m["content"] for m in expected]
+	assert stats.messages_after == 7
+
+
+def test_reads_do_not_grow_with_the_conversation():
+	store = SQLConversationStore("sqlite://")
+	window = ContextWindow(budget=1000, trim_step=250)
+	read_counts = []
+	for turns in (50, 200, 800):
+		conversation_id = conversation(store, turns)
+		reads = []
+		kept, _ = fit_tail(window, store, conversation_id, reads)
+		read_counts.append(len(reads))
+		assert kept[0]["role"] == "system"
+		assert kept[-1]["content"].startswith(f"answer {turns - 1} ")
+		assert all("html" not in m for m in reads)
+	# The newest, partial page and at most one whole page, however long the conversation
+	assert max(read_counts) < 2 * 64
+
+
+def first_history_messages(window, paged):
+	store = MemoryConversationStore()
+	conversation_id = conversation(store, 40)
+	starts = []
+	for turn in range(40, 100):
+		store.append(conversation_id, "user", f"question {turn} " + "word " * 40)
+		if paged:
+			kept, stats = fit_tail(window, store, conversation_id)
+		else:
+			kept, stats = window.fit(store.messages(conversation_id))
+		assert stats.tokens_after <= 1000
+		starts.append(kept[1]["content"])
+		store.append(conversation_id, "assistant", f"answer {turn} " + "word " * 40)
+	return starts
+
+
+def test_kept_prefix_is_as_stable_as_with_the_whole_transcript():
+	# The first history message sent changes at checkpoints, not on every turn
+	paged = len(set(first_history_messages(ContextWindow(budget=1000, trim_step=250), True)))
+	whole = len(set(first_history_messages(ContextWindow(budget=1000, trim_step=250), False)))
+	exact = len(set(first_history_messages(ContextWindow(budget=1000, trim_step=0), True)))
+	# Checkpoints count from the oldest message read, so each whole page left behind (two of
+	# 64 over these 120 messages) can move the cut once more than with the whole transcript
+	assert paged <= whole + 2
+	assert paged < exact / 1.5
+
+
+def test_interleaved_conversations_read_only_their_own_pages():
+	store = SQLConversationStore("sqlite://")
+	window = ContextWindow(budget=1000, trim_step=250)
+	first, second = store.create(), store.create()
+	for conversation_id in (first, second):
+		store.append(conversation_id, "system", "You are a helpful, concise assistant.")
+	# Every other row belongs to the other conversation, so global ids say little about position
+	for turn in range(200):
+		for conversation_id in (first, second):
+			store.append(conversation_id, "user", f"question {turn} " + "word " * 40)
+			store.append(conversation_id, "assistant", f"answer {turn} " + "word " * 40)
+	reads = []
+	kept, _ = fit_tail(window, store, first, reads)
+	assert kept[-1]["content"].startswith("answer 199 ")
+	assert {m["id"] for m in reads} <= {m["id"] for m in store.messages(first)}
+	# The newest, partial page (401 % 64 = 17 messages) and one whole page
+	assert len(reads) == 17 + 64
+
+
+def test_running_totals_add_up_across_threads():
+	window = ContextWindow(budget=100000)
+	messages = [{"role": "user", "content": "word " * 10}]
+	_, stats = window.fit(messages)
+
+	def fit_many():
+		for _ in range(500):
+			window.fit(messages)
+
+	threads = [threading.Thread(target=fit_many) for _ in range(8)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert window.total_before == stats.tokens_before * 4001
+	assert window.total_after == stats.tokens_after * 4001
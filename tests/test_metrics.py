@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+
+from metrics import CANCELLED, REQUESTS, SAVED_TOKENS, TOKENS, Registry, Trace
+from shared import MemoryState
+
+
+def worker(state, name, buckets=(0.1, 1.0)):
+	"""One worker process's registry, publishing to `state` under its own key."""
+	registry = Registry()
+	registry.counter("requests_total", "Requests")
+	registry.histogram("latency_seconds", "Latency", buckets)
+	registry.shared = state
+	registry._publish_key = lambda: f"metrics:host:{name}"
+	return registry
+
+
+def sample(text, line):
+	for row in text.splitlines():
+		if row.startswith(line + " "):
+			return float(row.rsplit(" ", 1)[1])
+	return None
+
+
+def test_histogram_buckets_are_cumulative():
+	registry = Registry()
+	latency = registry.histogram("latency_seconds", "Latency", (0.1, 1.0))
+	for value in (0.05, 0.5, 0.7, 3.0):
+		latency.observe(value, route="/send")
+	text = registry.render()
+	assert sample(text, 'latency_seconds_bucket{route="/send",le="0.1"}') == 1
+	assert sample(text, 'latency_seconds_bucket{route="/send",le="1"}') == 3
+	assert sample(text, 'latency_seconds_bucket{route="/send",le="+Inf"}') == 4
+	assert sample(text, 'latency_seconds_count{route="/send"}') == 4
+	assert sample(text, 'latency_seconds_sum{route="/send"}') == 4.25
+
+
+def test_label_values_are_escaped():
+	registry = Registry()
+	registry.counter("errors_total", "Errors").inc(error='say "hi"\n')
+	assert 'errors_total{error="say \\"hi\\"\\n"} 1' in registry.render()
+
+
+def test_totals_add_up_across_workers():
+	state = MemoryState()
+	first, second = worker(state, "1"), worker(state, "2")
+	first.metrics[0].inc(3, status="ok")
+	second.metrics[0].inc(2, status="ok")
+	second.metrics[0].inc(status="error")
+	first.metrics[1].observe(0.05)
+	second.metrics[1].observe(0.5)
+	first.publish()
+	second.publish()
+	for registry in (first, second):
+		text = registry.render()
+		assert sample(text, 'requests_total{status="ok"}') == 5
+		assert sample(text, 'requests_total{status="error"}') == 1
+		assert sample(text, 'latency_seconds_bucket{le="0.1"}') == 1
+		assert sample(text, 'latency_seconds_count') == 2
+
+
+def test_own_stale_publish_is_not_counted_twice():
+	state = MemoryState()
+	registry = worker(state, "1")
+	registry.metrics[0].inc(status="ok")
+	registry.publish()
+	registry.metrics[0].inc(status="ok")
+	# Live values are used for this worker, not what it published earlier
+	assert sample(registry.render(), 'requests_total{status="ok"}') == 2
+
+
+def test_workers_with_other_buckets_are_skipped():
+	state = MemoryState()
+	first, other = worker(state, "1"), worker(state, "2", buckets=(0.5,))
+	first.metrics[1].observe(0.05)
+	other.metrics[1].observe(0.05)
+	other.publish()
+	assert sample(first.render(), "latency_seconds_count") == 1
+
+
+def test_trace_records_outcome_tokens_and_savings():
+	labels = {"provider": "metrics-test", "model": "m"}
+	finished = Trace("metrics-test", "m", stream=True)
+	finished.first_token()
+	finished.usage(SimpleNamespace(prompt_tokens=30, completion_tokens=100, prompt_tokens_details=None))
+	finished.finish()
+	assert REQUESTS.snapshot()[(("error", ""), ("model", "m"), ("provider", "metrics-test"), ("status", "ok"))] == 1
+	assert TOKENS.snapshot()[(("direction", "out"), ("model", "m"), ("provider", "metrics-test"))] == 100
+	stopped = Trace("metrics-test", "m", stream=True)
+	for _ in range(40):
+		stopped.piece()
+	stopped.finish(status="cancelled")
+	key = tuple(sorted(labels.items()))
+	assert CANCELLED.snapshot()[key] == 1
+	# The typical reply is 100 tokens and 40 had been streamed
+	assert SAVED_TOKENS.snapshot()[key] == 60
+	assert stopped.extra["tokens_saved"] == 60
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from output import MarkdownBlocks, StreamWriter
+
+
+class Sink:
+	def __init__(self):
+		self.chunks = []
+		self.arrived = threading.Event()
+
+	def __call__(self, chunk):
+		self.chunks.append((time.monotonic(), chunk))
+		self.arrived.set()
+
+
+def test_first_delta_goes_out_at_once_and_the_rest_are_batched():
+	sink = Sink()
+	with StreamWriter(sink, interval=10) as writer:
+		for delta in ("a", "b", "c"):
+			writer.write(delta)
+	assert [chunk for _, chunk in sink.chunks] == ["a", "bc"]
+	assert writer.text() == "abc"
+
+
+def test_held_back_text_is_flushed_when_the_upstream_stalls():
+	sink = Sink()
+	writer = StreamWriter(sink, interval=0.05)
+	writer.write("first ")
+	sink.arrived.clear()
+	written = time.monotonic()
+	writer.write("second")
+	# No further delta arrives; the text must not wait for one
+	assert sink.arrived.wait(1)
+	assert sink.chunks[-1][1] == "second"
+	assert sink.chunks[-1][0] - written < 0.05 + 0.05
+	assert writer.flushes == 2
+
+
+def test_size_limit_forces_a_flush():
+	sink = Sink()
+	with StreamWriter(sink, interval=10, max_chars=4) as writer:
+		for delta in "abcdefgh":
+			writer.write(delta)
+	assert "".join(chunk for _, chunk in sink.chunks) == "abcdefgh"
+	assert all(len(chunk) <= 4 for _, chunk in sink.chunks)
+
+
+def test_closing_cancels_the_timer():
+	sink = Sink()
+	threads = []
+	with StreamWriter(sink, interval=0.05, on_thread=threads.append) as writer:
+		writer.write("a")
+		writer.write("b")
+	time.sleep(0.1)
+	assert [chunk for _, chunk in sink.chunks] == ["a", "b"]
+	assert len(threads) == 1 and not threads[0].is_alive()
+
+
+def test_markdown_blocks_finish_at_blank_lines_outside_fences():
+	blocks = MarkdownBlocks()
+	assert blocks.feed("# Title\n\nSome ") == ""
+	# The blank line inside the fence doesn't end the code block
+	assert blocks.feed("text\n\n```\ncode\n\nmore\n") == "# Title\n\nSome text\n\n"
+	assert blocks.feed("```\n\nEnd\n") == "```\ncode\n\nmore\n```\n\n"
+	assert blocks.finish() == "End\n"
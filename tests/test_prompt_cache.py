@@ -0,0 +1,95 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import router as router_module
+from prompt_cache import MAX_BREAKPOINTS, cache_mode, with_breakpoints
+from providers import Provider
+from router import Router
+
+OPENROUTER = Provider("openrouter", "key", "https://openrouter.ai/api/v1")
+DEEPSEEK = Provider("deepseek", "key", "https://api.deepseek.com")
+
+
+class Upstream:
+	"""Records each request's messages; fails or streams one piece."""
+
+	def __init__(self, fail=False):
+		self.fail = fail
+		self.requests = []
+		self.chat = SimpleNamespace(completions=self)
+
+	def create(self, **kwargs):
+		self.requests.append(kwargs["messages"])
+		if self.fail:
+			raise ConnectionError("upstream failed")
+		return Stream()
+
+
+class Stream:
+	response = SimpleNamespace(headers={}, status_code=200)
+
+	def __init__(self):
+		self.closed = threading.Event()
+
+	def __iter__(self):
+		yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content="ok"))], usage=None)
+
+	def close(self):
+		self.closed.set()
+
+
+def chat(turns):
+	messages = [{"role": "system", "content": "be brief"}]
+	for i in range(turns):
+		messages.append({"role": "user", "content": f"question {i}"})
+		messages.append({"role": "assistant", "content": f"answer {i}"})
+	return messages[:-1]
+
+
+def marked(messages):
+	return [i for i, m in enumerate(messages) if isinstance(m["content"], list)]
+
+
+@pytest.mark.parametrize("provider, model, mode", [
+	(OPENROUTER, "anthropic/claude-3.5-sonnet", "breakpoints"),
+	(OPENROUTER, "google/gemini-2.0-flash", "breakpoints"),
+	(OPENROUTER, "openai/gpt-4o-mini", "auto"),
+	(DEEPSEEK, "anthropic/claude-3.5-sonnet", "auto"),
+])
+def test_breakpoints_only_where_the_provider_needs_them(provider, model, mode):
+	assert cache_mode(provider, model) == mode
+
+
+def test_environment_overrides(monkeypatch):
+	monkeypatch.setenv("DEEPSEEK_PROMPT_CACHE", "breakpoints")
+	assert cache_mode(DEEPSEEK, "deepseek-chat") == "breakpoints"
+	monkeypatch.setenv("PROMPT_CACHE", "0")
+	assert cache_mode(DEEPSEEK, "deepseek-chat") == "auto"
+	assert cache_mode(OPENROUTER, "anthropic/claude-3.5-sonnet") == "auto"
+
+
+def test_breakpoints_go_on_the_system_prompt_and_the_last_two_user_turns():
+	messages = chat(5)
+	prepared = with_breakpoints(messages)
+	assert marked(prepared) == [0, 7, 9]
+	assert prepared[9]["content"] == [{"type": "text", "text": "question 4", "cache_control": {"type": "ephemeral"}}]
+	assert len(marked(prepared)) <= MAX_BREAKPOINTS
+	# The caller's list is left as plain strings
+	assert marked(messages) == []
+	# The next turn marks the user turn the previous request wrote to the cache
+	assert 9 in marked(with_breakpoints(chat(6)))
+
+
+def test_router_marks_only_requests_to_endpoints_that_need_it(monkeypatch):
+	anthropic = Provider("openrouter", "key", "https://openrouter.ai/api/v1", ("anthropic/claude-3.5-sonnet",))
+	fallback = Provider("deepseek", "key", "https://api.deepseek.com", ("deepseek-chat",))
+	upstreams = {anthropic.base_url: Upstream(fail=True), fallback.base_url: Upstream()}
+	monkeypatch.setattr(router_module, "get_client", lambda api_key, base_url, asynchronous=False: upstreams[base_url])
+	monkeypatch.setattr(router_module, "retryable", lambda exc: True)
+	router = Router([anthropic, fallback], max_attempts=3, cooldown=30.0)
+	messages = chat(2)
+	assert "".join(router.stream("anthropic/claude-3.5-sonnet", messages)) == "ok"
+	assert marked(upstreams[anthropic.base_url].requests[0]) == [0, 1, 3]
+	assert upstreams[fallback.base_url].requests == [messages]
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from ratelimit import ProviderLimiter, RateLimited, as_user
+from shared import MemoryState, SQLiteState
+
+
+def far():
+	return time.monotonic() + 10
+
+
+def timed(call):
+	started = time.monotonic()
+	call()
+	return time.monotonic() - started
+
+
+def test_burst_is_served_at_once_then_paced():
+	limiter = ProviderLimiter("burst", rate=10, burst=3)
+	assert timed(lambda: [limiter.acquire(far()) for _ in range(3)]) < 0.05
+	# The fourth waits for one token at 10/s
+	assert 0.05 < timed(lambda: limiter.acquire(far())) < 0.3
+
+
+def test_bucket_refills_at_the_rate():
+	limiter = ProviderLimiter("refill", rate=20, burst=2)
+	for _ in range(2):
+		limiter.acquire(far())
+	time.sleep(0.11)
+	# Two tokens came back in 0.1s, and no more than the burst
+	assert timed(lambda: [limiter.acquire(far()) for _ in range(2)]) < 0.03
+	assert timed(lambda: limiter.acquire(far())) > 0.02
+
+
+def test_deadline_raises_rate_limited():
+	limiter = ProviderLimiter("deadline", rate=0.5, burst=1)
+	limiter.acquire(far())
+	with pytest.raises(RateLimited):
+		limiter.acquire(time.monotonic() + 0.1)
+	assert limiter.snapshot()["queued"] == 0
+
+
+def test_queue_is_bounded_per_user():
+	limiter = ProviderLimiter("queue", rate=0.5, burst=1, per_user=1)
+	limiter.acquire(far())
+
+	def wait_in_queue():
+		with as_user("alice"):
+			pytest.raises(RateLimited, limiter.acquire, time.monotonic() + 0.5)
+
+	waiting = threading.Thread(target=wait_in_queue)
+	waiting.start()
+	time.sleep(0.05)
+	with as_user("alice"):
+		with pytest.raises(RateLimited, match="too many"):
+			limiter.acquire(far())
+	# Another user still gets a place in the queue
+	with as_user("bob"):
+		with pytest.raises(RateLimited, match="deadline"):
+			limiter.acquire(time.monotonic() + 0.05)
+	waiting.join()
+
+
+def test_429_halves_the_rate_and_pauses():
+	limiter = ProviderLimiter("adaptive", rate=8, burst=4)
+	limiter.observe({"retry-after": "0.2"}, 429)
+	snapshot = limiter.snapshot()
+	assert snapshot["rate"] == 4
+	assert snapshot["paused"] > 0.1
+	assert timed(lambda: limiter.acquire(far())) > 0.15
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def shared(request, tmp_path):
+	if request.param == "memory":
+		return MemoryState()
+	return SQLiteState(str(tmp_path / "shared.db"))
+
+
+def test_limiters_sharing_a_bucket_share_its_tokens(shared):
+	# Two workers' limiters for the same provider
+	first = ProviderLimiter("shared", rate=10, burst=3, shared=shared, bucket="ratelimit:test")
+	second = ProviderLimiter("shared", rate=10, burst=3, shared=shared, bucket="ratelimit:test")
+	assert timed(lambda: [first.acquire(far()), second.acquire(far()), first.acquire(far())]) < 0.05
+	# The burst is used up for both of them
+	assert timed(lambda: second.acquire(far())) > 0.05
+
+
+def test_pause_reaches_the_other_limiter(shared):
+	first = ProviderLimiter("pause", rate=10, burst=3, shared=shared, bucket="ratelimit:pause")
+	second = ProviderLimiter("pause", rate=10, burst=3, shared=shared, bucket="ratelimit:pause")
+	first.observe({"retry-after": "0.2"}, 429)
+	assert timed(lambda: second.acquire(far())) > 0.15
+
+
+class SlowState(MemoryState):
+	"""A shared backend with a slow round trip."""
+
+	def take(self, bucket, rate, burst):
+		time.sleep(0.2)
+		return super().take(bucket, rate, burst)
+
+
+def test_shared_round_trip_does_not_hold_the_lock():
+	limiter = ProviderLimiter("slow", rate=10, burst=3, shared=SlowState())
+	taker = threading.Thread(target=limiter.acquire, args=(far(),))
+	taker.start()
+	time.sleep(0.05)
+	# snapshot() needs the lock; it must not wait for the other thread's round trip
+	assert timed(limiter.snapshot) < 0.05
+	taker.join()
+
+
+def test_async_acquire_keeps_the_event_loop_free():
+	limiter = ProviderLimiter("slow-async", rate=10, burst=3, shared=SlowState())
+
+	async def main():
+		ticks = []
+
+		async def tick():
+			while True:
+				ticks.append(time.monotonic())
+				await asyncio.sleep(0.01)
+
+		ticker = asyncio.ensure_future(tick())
+		await limiter.aacquire(far())
+		ticker.cancel()
+		return max(b - a for a, b in zip(ticks, ticks[1:]))
+
+	assert asyncio.run(main()) < 0.1
@@ -0,0 +1,58 @@
+import re
+
+import pytest
+
+from render import IncrementalRenderer, clean_urls, render_markdown, safe_url
+
+
+def urls(html):
+	return re.findall(r'(?:href|src)="([^"]*)"', html)
+
+
+@pytest.mark.parametrize("markdown", [
+	"[x](javascript:alert(document.cookie))",
+	"[x](JavaScript:alert(1))",
+	"[x](javascript&#58;alert(document.cookie))",
+	"[x](javascript&colon;alert(1))",
+	"[x](&#106;avascript&#58;alert(1))",
+	"[x](javascript&#x3a;alert(1))",
+	"[x](javascript&#X3A;alert(1))",
+	"[x](&#x6A;&#x61;&#x76;&#x61;script:alert(1))",
+	"[x](java&#9;script:alert(1))",
+	"[x](jav&#x0A;ascript:alert(1))",
+	"[x](&#0;javascript:alert(1))",
+	"[x](javascript&amp;#58;alert(1))",
+	"[x](vbscript&#58;msgbox(1))",
+	"[x](data&#58;text/html;base64,PHNjcmlwdD4=)",
+	"![i](javascript&#x3a;alert(1))",
+	"![i](javascript&colon;alert(1))",
+	"![i](data:image/svg+xml;base64,PHN2Zz4=)",
+])
+def test_encoded_schemes_are_dropped(markdown):
+	assert urls(render_markdown(markdown)) == ["#"]
+
+
+@pytest.mark.parametrize("url", [
+	"https://example.com/a:b",
+	"http://example.com",
+	"mailto:someone@example.com",
+	"/relative/path:with-colon",
+	"page?a=b:c",
+	"#section",
+])
+def test_safe_urls_are_kept(url):
+	assert safe_url(url)
+	assert urls(render_markdown(f"[x]({url})")) == [url.replace("&", "&amp;")]
+
+
+def test_streamed_replies_are_sanitized_too():
+	renderer = IncrementalRenderer()
+	events = [renderer.feed(piece) for piece in ("[x](javascript", "&#58;alert(1))\n\n", "more")]
+	events.append(renderer.finish())
+	html = "".join(event.get("append", "") + event.get("tail", "") for event in events)
+	assert urls(html) and set(urls(html)) == {"#"}
+
+
+def test_stored_html_is_cleaned():
+	stored = '<p><a href="javascript&#58;alert(1)">x</a> <img src="https://example.com/i.png"></p>'
+	assert urls(clean_urls(stored)) == ["#", "https://example.com/i.png"]
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import router as router_module
+from metrics import REQUESTS
+from providers import Provider
+from router import Router
+
+
+class UpstreamError(Exception):
+	status_code = 500
+
+
+def event(text):
+	return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+
+class Stream:
+	"""A streamed completion that sends `pieces` after `delay` seconds; closing it ends the read."""
+
+	def __init__(self, pieces, delay):
+		self.pieces = pieces
+		self.delay = delay
+		self.closed = threading.Event()
+		self.response = SimpleNamespace(headers={}, status_code=200)
+
+	def __iter__(self):
+		if self.closed.wait(self.delay):
+			raise ConnectionError("stream closed")
+		for piece in self.pieces:
+			yield event(piece)
+
+	def close(self):
+		self.closed.set()
+
+
+class AsyncStream(Stream):
+	def __aiter__(self):
+		return self._events()
+
+	async def _events(self):
+		await asyncio.sleep(self.delay)
+		for piece in self.pieces:
+			yield event(piece)
+
+	async def close(self):
+		self.closed.set()
+
+
+class Upstream:
+	"""Stands in for one provider's client: fails, or streams `pieces` after `delay`."""
+
+	def __init__(self, pieces=("hello", " world"), delay=0.0, fail=False):
+		self.pieces = pieces
+		self.delay = delay
+		self.fail = fail
+		self.streams = []
+		self.chat = SimpleNamespace(completions=self)
+
+	def create(self, **kwargs):
+		if self.fail:
+			raise UpstreamError("upstream failed")
+		stream = Stream(self.pieces, self.delay)
+		self.streams.append(stream)
+		return stream
+
+
+class AsyncUpstream(Upstream):
+	async def create(self, **kwargs):
+		if self.fail:
+			raise UpstreamError("upstream failed")
+		stream = AsyncStream(self.pieces, self.delay)
+		self.streams.append(stream)
+		return stream
+
+
+def make_router(monkeypatch, upstreams, **options):
+	"""A router over one provider per entry of `upstreams` (name -> Upstream)."""
+	providers = [Provider(name, "key", f"http://{name}.test/v1", (f"{name}-model",)) for name in upstreams]
+	monkeypatch.setattr(router_module, "get_client", lambda api_key, base_url, asynchronous=False: upstreams[base_url.split("//")[1].split(".")[0]])
+	return Router(providers, max_attempts=3, cooldown=30.0, **options)
+
+
+def requests_for(provider, status, error=""):
+	labels = (("error", error), ("model", f"{provider}-model"), ("provider", provider), ("status", status))
+	return REQUESTS.snapshot().get(labels, 0.0)
+
+
+def wait_for(condition, timeout=2.0):
+	deadline = time.monotonic() + timeout
+	while not condition():
+		assert time.monotonic() < deadline, "timed out"
+		time.sleep(0.01)
+
+
+def test_failover_moves_past_a_failing_provider(monkeypatch):
+	router = make_router(monkeypatch, {"failover-bad": Upstream(fail=True), "failover-good": Upstream()})
+	assert "".join(router.stream("failover-bad-model", [{"role": "user", "content": "hi"}])) == "hello world"
+	assert requests_for("failover-bad", "error", "UpstreamError") == 1
+	assert requests_for("failover-good", "ok") == 1
+	snapshot = router.snapshot()
+	assert snapshot["failover-bad:failover-bad-model"]["errors"] == 1
+	assert snapshot["failover-bad:failover-bad-model"]["cooling_down"]
+	# The failing endpoint now goes after the healthy one
+	assert [e.name for e in router.candidates("failover-bad-model")] == ["failover-good:failover-good-model", "failover-bad:failover-bad-model"]
+
+
+def test_every_provider_failing_raises_the_last_error(monkeypatch):
+	router = make_router(monkeypatch, {"allbad-a": Upstream(fail=True), "allbad-b": Upstream(fail=True)})
+	monkeypatch.setattr(router_module, "retryable", lambda exc: False)
+	with pytest.raises(UpstreamError):
+		list(router.stream("allbad-a-model", [{"role": "user", "content": "hi"}]))
+	assert requests_for("allbad-a", "error", "UpstreamError") == 1
+	assert requests_for("allbad-b", "error", "UpstreamError") == 1
+
+
+def test_hedge_wins_and_closes_the_slow_stream(monkeypatch):
+	slow = Upstream(pieces=("slow",), delay=5.0)
+	fast = Upstream(pieces=("fast",))
+	router = make_router(monkeypatch, {"hedge-slow": slow, "hedge-fast": fast}, hedge=True, hedge_min=0.05, hedge_max=0.05)
+	started = time.monotonic()
+	assert "".join(router.stream("hedge-slow-model", [{"role": "user", "content": "hi"}])) == "fast"
+	assert time.monotonic() - started < 2.0
+	assert slow.streams[0].closed.is_set()
+	wait_for(lambda: requests_for("hedge-slow", "hedge_lost") == 1)
+	assert requests_for("hedge-fast", "ok") == 1
+	assert requests_for("hedge-slow", "error", "ConnectionError") == 0
+
+
+def test_no_hedge_before_the_delay(monkeypatch):
+	primary = Upstream(pieces=("primary",), delay=0.05)
+	backup = Upstream(pieces=("backup",))
+	router = make_router(monkeypatch, {"nohedge-primary": primary, "nohedge-backup": backup}, hedge=True, hedge_min=1.0, hedge_max=1.0)
+	assert "".join(router.stream("nohedge-primary-model", [{"role": "user", "content": "hi"}])) == "primary"
+	assert backup.streams == []
+
+
+def test_async_failover(monkeypatch):
+	router = make_router(monkeypatch, {"afailover-bad": AsyncUpstream(fail=True), "afailover-good": AsyncUpstream()})
+
+	async def reply():
+		return "".join([piece async for piece in router.astream("afailover-bad-model", [{"role": "user", "content": "hi"}])])
+
+	assert asyncio.run(reply()) == "hello world"
+	assert requests_for("afailover-bad", "error", "UpstreamError") == 1
+	assert requests_for("afailover-good", "ok") == 1
+
+
+def test_async_hedge_cancels_the_loser(monkeypatch):
+	slow = AsyncUpstream(pieces=("slow",), delay=5.0)
+	fast = AsyncUpstream(pieces=("fast",))
+	router = make_router(monkeypatch, {"ahedge-slow": slow, "ahedge-fast": fast}, hedge=True, hedge_min=0.05, hedge_max=0.05)
+
+	async def reply():
+		return "".join([piece async for piece in router.astream("ahedge-slow-model", [{"role": "user", "content": "hi"}])])
+
+	started = time.monotonic()
+	assert asyncio.run(reply()) == "fast"
+	assert time.monotonic() - started < 2.0
+	assert slow.streams[0].closed.is_set()
+	assert requests_for("ahedge-slow", "hedge_lost") == 1
+	assert requests_for("ahedge-fast", "ok") == 1
@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from semantic import HashedEmbedder, SemanticCache, negations
+
+
+def ask(question):
+	return [{"role": "system", "content": "be brief"}, {"role": "user", "content": question}]
+
+
+@pytest.fixture
+def cache():
+	return SemanticCache(HashedEmbedder(), threshold=0.8)
+
+
+def test_paraphrase_is_a_hit(cache):
+	cache.put("m", ask("Is it safe to take ibuprofen?"), "Usually, yes.")
+	assert cache.get("m", ask("Is ibuprofen safe to take?")) == "Usually, yes."
+	assert cache.get("other-model", ask("Is ibuprofen safe to take?")) is None
+
+
+@pytest.mark.parametrize(
+	"stored, asked",
+	[
+		("Is it safe to take ibuprofen?", "Is it not safe to take ibuprofen?"),
+		("Is it not safe to take ibuprofen?", "Is it safe to take ibuprofen?"),
+		("Is it safe to take ibuprofen?", "Isn't it safe to take ibuprofen?"),
+		("Can I take ibuprofen with food?", "Can I take ibuprofen without food?"),
+		("Should I ever mix these drugs?", "Should I never mix these drugs?"),
+	],
+)
+def test_differing_negation_is_never_a_hit(cache, stored, asked):
+	embed = HashedEmbedder()
+	cache.put("m", ask(stored), "stored answer")
+	# Close enough on similarity alone; only the negation tells them apart
+	assert float(embed(stored) @ embed(asked)) > 0.7
+	assert cache.get("m", ask(asked)) is None
+
+
+def test_matching_negation_still_hits(cache):
+	cache.put("m", ask("Is it not safe to take ibuprofen?"), "It can be, for some people.")
+	assert cache.get("m", ask("Is ibuprofen not safe to take?")) == "It can be, for some people."
+
+
+def test_negation_spellings():
+	assert negations("Is it safe?") == []
+	assert negations("Isn't it safe? isnt it? It cannot be") == ["not"]
+	assert negations("Can I go without food, or never?") == ["never", "without"]
+	assert negations("Is nothing notable known?") == ["nothing"]
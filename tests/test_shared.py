@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from shared import MemoryState, SharedState, SQLiteState
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def state(request, tmp_path):
+	if request.param == "memory":
+		return MemoryState()
+	return SQLiteState(str(tmp_path / "shared.db"))
+
+
+def test_incomplete_backend_cannot_be_created():
+	class GetOnly(SharedState):
+		def get(self, key):
+			return None
+
+	with pytest.raises(TypeError, match="abstract"):
+		GetOnly()
+
+
+def test_values_expire_and_can_be_deleted(state):
+	state.set("chat:a", "1", 60)
+	state.set("chat:b", "2", 0.05)
+	state.set("other:c", "3", 60)
+	assert state.get("chat:a") == "1"
+	assert state.items("chat:") == {"chat:a": "1", "chat:b": "2"}
+	time.sleep(0.1)
+	assert state.get("chat:b") is None
+	state.delete("chat:a")
+	assert state.items("chat:") == {}
+
+
+def test_take_spends_the_burst_then_reports_the_wait(state):
+	assert [state.take("bucket", 10, 2) for _ in range(2)] == [0.0, 0.0]
+	assert 0.05 < state.take("bucket", 10, 2) <= 0.1
+
+
+def test_cap_below_zero_pauses_the_bucket(state):
+	state.cap("bucket", -2, 10, 5)
+	assert 0.25 < state.take("bucket", 10, 5) <= 0.3
@@ -0,0 +1,75 @@
+import pytest
+
+import web
+from store import MemoryConversationStore, SQLConversationStore
+
+
+@pytest.fixture(params=["memory", "sql"])
+def store(request):
+	if request.param == "memory":
+		return MemoryConversationStore()
+	return SQLConversationStore("sqlite://")
+
+
+def filled(store, count):
+	conversation_id = store.create()
+	for i in range(count):
+		store.append(conversation_id, "user" if i % 2 else "system", f"message {i}", f"<p>message {i}</p>")
+	return conversation_id
+
+
+def contents(messages):
+	return [m["content"] for m in messages]
+
+
+def test_pages_walk_back_from_the_newest(store):
+	conversation_id = filled(store, 7)
+	newest = store.load(conversation_id, 3)
+	assert contents(newest) == ["message 4", "message 5", "message 6"]
+	older = store.load(conversation_id, 3, newest[0]["id"])
+	assert contents(older) == ["message 1", "message 2", "message 3"]
+	assert contents(store.load(conversation_id, 3, older[0]["id"])) == ["message 0"]
+	assert contents(store.messages(conversation_id)) == [f"message {i}" for i in range(7)]
+
+
+def test_conversations_do_not_mix(store):
+	first = store.create()
+	second = store.create()
+	for i in range(4):
+		store.append(first, "user", f"first {i}")
+		store.append(second, "user", f"second {i}")
+	assert contents(store.load(first, 10)) == [f"first {i}" for i in range(4)]
+	assert contents(store.head(second, 2)) == ["second 0", "second 1"]
+	assert store.exists(first) and not store.exists("missing")
+
+
+def test_prompt_loads_leave_the_html_out(store):
+	conversation_id = filled(store, 3)
+	assert all("html" not in m for m in store.load(conversation_id, 10, html=False))
+	assert all("html" not in m for m in store.head(conversation_id, 2))
+	assert store.load(conversation_id, 1)[0]["html"] == "<p>message 2</p>"
+
+
+def test_loaded_messages_are_copies(store):
+	conversation_id = filled(store, 2)
+	for m in store.load(conversation_id, 10) + store.messages(conversation_id):
+		m["content"] = "changed"
+		m["html"] = "changed"
+	assert contents(store.messages(conversation_id)) == ["message 0", "message 1"]
+
+
+def test_history_requests_leave_the_stored_conversation_alone(monkeypatch):
+	monkeypatch.setattr(web, "store", MemoryConversationStore())
+	client = web.app.test_client()
+	with client.session_transaction() as session:
+		session["unlocked"] = True
+	client.get("/history")
+	with client.session_transaction() as session:
+		conversation_id = session["conversation_id"]
+	# Stored before links were checked with entities decoded; served cleaned
+	web.store.append(conversation_id, "assistant", "[x](javascript&#58;alert(1))", '<p><a href="javascript&#58;alert(1)">x</a></p>')
+	before = [dict(m) for m in web.store.messages(conversation_id)]
+	for _ in range(2):
+		served = client.get("/history").get_json()["messages"][0]["html"]
+		assert 'href="#"' in served
+	assert web.store.messages(conversation_id) == before
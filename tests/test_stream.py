@@ -0,0 +1,46 @@
+import json
+
+import flask
+import pytest
+
+import web
+
+
+@pytest.fixture(autouse=True)
+def upstream(monkeypatch):
+	monkeypatch.setattr(web.router, "providers", [object()])
+	monkeypatch.setattr(web.completions, "stream", lambda router, model, messages, headers: iter(["hello", " world"]))
+
+
+def turns(conversation_id):
+	# Everything after the system prompt
+	return [(m["role"], m["content"]) for m in web.store.messages(conversation_id)][1:]
+
+
+def open_stream(prompt):
+	"""Call the view the way a WSGI server would, returning the unread body and its conversation."""
+	with web.app.test_request_context("/send_stream", method="POST", json={"prompt": prompt}):
+		flask.session["unlocked"] = True
+		response = web.send_stream()
+		return response, flask.session["conversation_id"]
+
+
+def test_reply_is_stored_after_the_prompt():
+	response, conversation_id = open_stream("hi")
+	events = [json.loads(line) for line in response.response]
+	assert events[-1] == {"done": True}
+	assert turns(conversation_id) == [("user", "hi"), ("assistant", "hello world")]
+
+
+def test_client_gone_before_the_body_stores_nothing():
+	# The server closes the body without ever reading from it
+	response, conversation_id = open_stream("hi")
+	response.close()
+	assert turns(conversation_id) == []
+
+
+def test_client_gone_after_the_first_line_keeps_the_turns_paired():
+	response, conversation_id = open_stream("hi")
+	assert "context" in json.loads(next(iter(response.response)))
+	response.close()
+	assert turns(conversation_id) == [("user", "hi"), ("assistant", web.STOPPED_REPLY)]
@@ -0,0 +1,80 @@
+import os
+
+from transcript import ENTRY, Transcript, list_sessions
+
+
+def count(message):
+	return len(message["content"].split())
+
+
+def saved(directory, turns=3):
+	session = Transcript.new(str(directory))
+	session.append([{"role": "system", "content": "be brief"}])
+	for turn in range(turns):
+		session.append([{"role": "user", "content": f"question {turn}"}, {"role": "assistant", "content": f"answer {turn}"}])
+	return session
+
+
+def contents(session):
+	return [m["content"] for m in session.tail(10_000, count)]
+
+
+def test_sessions_started_together_get_distinct_ids(tmp_path):
+	ids = {Transcript.new(str(tmp_path)).id for _ in range(200)}
+	assert len(ids) == 200
+
+
+def test_tail_keeps_the_system_prompt_and_newest_turns(tmp_path):
+	session = saved(tmp_path, turns=10)
+	reopened = Transcript(session.id, str(tmp_path))
+	assert reopened.count == 21
+	assert [m["content"] for m in reopened.tail(6, count)] == ["be brief", "question 9", "answer 9"]
+
+
+def test_half_written_record_is_dropped(tmp_path):
+	session = saved(tmp_path)
+	with open(session.log_path, "ab") as fh:
+		fh.write(b'{"role": "user", "content": "cut o')
+	reopened = Transcript(session.id, str(tmp_path))
+	assert reopened.count == 7
+	assert contents(reopened)[-1] == "answer 2"
+	# New turns land after the last complete record
+	reopened.append([{"role": "user", "content": "question 3"}, {"role": "assistant", "content": "answer 3"}])
+	assert contents(Transcript(session.id, str(tmp_path)))[-2:] == ["question 3", "answer 3"]
+
+
+def test_log_ahead_of_its_index_is_reindexed(tmp_path):
+	session = saved(tmp_path)
+	# A crash after the log write but before the index write
+	with open(session.log_path, "ab") as fh:
+		fh.write(b'{"role": "user", "content": "question 3"}\n{"role": "assistant", "content": "answer 3"}\n')
+	reopened = Transcript(session.id, str(tmp_path))
+	assert reopened.count == 9
+	assert contents(reopened)[-2:] == ["question 3", "answer 3"]
+	assert os.path.getsize(session.idx_path) == 9 * ENTRY.size
+
+
+def test_partial_index_entry_is_truncated(tmp_path):
+	session = saved(tmp_path)
+	with open(session.idx_path, "ab") as fh:
+		fh.write(b"\x01\x02\x03")
+	reopened = Transcript(session.id, str(tmp_path))
+	assert reopened.count == 7
+	assert os.path.getsize(session.idx_path) == 7 * ENTRY.size
+	assert contents(reopened)[-1] == "answer 2"
+
+
+def test_index_past_the_end_of_the_log_is_rebuilt(tmp_path):
+	session = saved(tmp_path)
+	size = os.path.getsize(session.log_path)
+	with open(session.log_path, "rb+") as fh:
+		fh.truncate(size - 5)
+	reopened = Transcript(session.id, str(tmp_path))
+	assert reopened.count == 6
+	assert contents(reopened)[-2:] == ["answer 1", "question 2"]
+
+
+def test_unused_sessions_are_not_listed(tmp_path):
+	Transcript.new(str(tmp_path))
+	session = saved(tmp_path)
+	assert [s.id for s in list_sessions(str(tmp_path))] == [session.id]
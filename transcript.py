@@ -0,0 +1,187 @@
+"""Append-only, indexed transcripts for chat.py sessions.
+
+Each session is two files in CHAT_SESSIONS_DIR:
+
+	<id>.log  one JSON object per message, appended as turns complete
+	<id>.idx  a fixed-size (offset, length) entry per message
+
+Nothing is ever rewritten. Opening a session memory-maps both files and
+decodes only the newest messages that fit the context budget, so a transcript
+with thousands of turns loads as fast as a short one. If a crash leaves the log
+ahead of its index, the missing entries are re-indexed on open.
+
+	CHAT_SESSIONS_DIR  where sessions are kept (default ~/.chat_sessions)
+"""
+import json
+import mmap
+import os
+import re
+import struct
+import time
+import uuid
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
+
+SESSIONS_DIR = os.path.expanduser(os.getenv("CHAT_SESSIONS_DIR", "~/.chat_sessions"))
+# Byte offset and length of one log record
+ENTRY = struct.Struct("<QI")
+SESSION_ID = re.compile(r"^[\w.-]+$")
+
+
+def _map(path: str) -> Optional[mmap.mmap]:
+	try:
+		with open(path, "rb") as fh:
+			if os.fstat(fh.fileno()).st_size == 0:
+				return None
+			# The mapping stays valid after the file is closed
+			return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+	except FileNotFoundError:
+		return None
+
+
+def _size(path: str) -> int:
+	try:
+		return os.path.getsize(path)
+	except FileNotFoundError:
+		return 0
+
+
+class Transcript:
+	def __init__(self, session_id: str, directory: str = SESSIONS_DIR) -> None:
+		if not SESSION_ID.match(session_id):
+			raise ValueError(f"invalid session id: {session_id!r}")
+		self.id = session_id
+		self.log_path = os.path.join(directory, session_id + ".log")
+		self.idx_path = os.path.join(directory, session_id + ".idx")
+		self.directory = directory
+		self.count = 0
+		self._repair()
+
+	@classmethod
+	def new(cls, directory: str = SESSIONS_DIR) -> "Transcript":
+		# Files are only created by the first append, so unused sessions leave nothing behind.
+		# The random suffix keeps sessions started in the same second by other processes apart.
+		return cls(f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}", directory)
+
+	@property
+	def exists(self) -> bool:
+		return self.count > 0
+
+	def _repair(self) -> None:
+		log_size = _size(self.log_path)
+		idx_size = _size(self.idx_path)
+		entries = idx_size // ENTRY.size
+		end = 0
+		if entries:
+			with open(self.idx_path, "rb") as fh:
+				fh.seek((entries - 1) * ENTRY.size)
+				offset, length = ENTRY.unpack(fh.read(ENTRY.size))
+			end = offset + length
+		if end > log_size:
+			# Index points past the log; rebuild it from scratch
+			entries, end = 0, 0
+		if entries * ENTRY.size != idx_size:
+			with open(self.idx_path, "rb+") as fh:
+				fh.truncate(entries * ENTRY.size)
+		if end < log_size:
+			with open(self.log_path, "rb+") as log, open(self.idx_path, "ab") as idx:
+				log.seek(end)
+				data = log.read()
+				complete = data.rfind(b"\n") + 1
+				if complete < len(data):
+					# Half-written last record
+					log.truncate(end + complete)
+				start = 0
+				while start < complete:
+					stop = data.index(b"\n", start) + 1
+					idx.write(ENTRY.pack(end + start, stop - start))
+					entries += 1
+					start = stop
+		self.count = entries
+
+	def append(self, messages: Sequence[Mapping[str, str]]) -> None:
+		if not messages:
+			return
+		os.makedirs(self.directory, exist_ok=True)
+		offset = _size(self.log_path)
+		records: List[bytes] = []
+		entries: List[bytes] = []
+		for message in messages:
+			record = json.dumps({"role": message["role"], "content": message["content"]}, ensure_ascii=False).encode("utf-8") + b"\n"
+			entries.append(ENTRY.pack(offset, len(record)))
+			records.append(record)
+			offset += len(record)
+		# Log before index: a crash in between is repaired on the next open
+		with open(self.log_path, "ab") as fh:
+			fh.write(b"".join(records))
+		with open(self.idx_path, "ab") as fh:
+			fh.write(b"".join(entries))
+		self.count += len(messages)
+
+	def sync(self) -> None:
+		for path in (self.log_path, self.idx_path):
+			if os.path.exists(path):
+				with open(path, "rb+") as fh:
+					os.fsync(fh.fileno())
+
+	def tail(self, budget: int, count: Callable[[Mapping[str, str]], int]) -> List[Dict[str, str]]:
+		"""The first message (the system prompt) plus the newest ones that fit `budget` tokens."""
+		idx, log = _map(self.idx_path), _map(self.log_path)
+		if idx is None or log is None:
+			return []
+		try:
+			def read(i: int) -> Dict[str, str]:
+				offset, length = ENTRY.unpack_from(idx, i * ENTRY.size)
+				return json.loads(log[offset:offset + length])
+
+			first = read(0)
+			used = count(first)
+			newest: List[Dict[str, str]] = []
+			for i in range(self.count - 1, 0, -1):
+				message = read(i)
+				used += count(message)
+				if used > budget and newest:
+					break
+				newest.append(message)
+			# Don't open the context with a reply whose question was cut off
+			while len(newest) > 1 and newest[-1]["role"] != "user":
+				newest.pop()
+			newest.reverse()
+			return [first] + newest if first["role"] == "system" else newest
+		finally:
+			idx.close()
+			log.close()
+
+	def preview(self, width: int = 60) -> str:
+		"""The first user message, shortened for listings."""
+		idx, log = _map(self.idx_path), _map(self.log_path)
+		if idx is None or log is None:
+			return ""
+		try:
+			for i in range(min(self.count, 3)):
+				offset, length = ENTRY.unpack_from(idx, i * ENTRY.size)
+				message = json.loads(log[offset:offset + length])
+				if message["role"] == "user":
+					text = " ".join(message["content"].split())
+					return text if len(text) <= width else text[:width - 1] + "…"
+			return ""
+		finally:
+			idx.close()
+			log.close()
+
+	def modified(self) -> float:
+		try:
+			return os.path.getmtime(self.log_path)
+		except FileNotFoundError:
+			return 0.0
+
+
+def list_sessions(directory: str = SESSIONS_DIR) -> List[Transcript]:
+	"""Saved sessions, most recently updated first."""
+	try:
+		names = os.listdir(directory)
+	except FileNotFoundError:
+		return []
+	sessions = [Transcript(name[:-4], directory) for name in names if name.endswith(".log") and SESSION_ID.match(name[:-4])]
+	sessions = [s for s in sessions if s.exists]
+	sessions.sort(key=lambda s: s.modified(), reverse=True)
+	return sessions
@@ -0,0 +1,290 @@
+"""Warm start: pooled connections, the model catalog and readiness.
+
+After a deploy or a free-plan wake-up, the first request used to pay for the
+SDK import and a TLS handshake to the provider, and a model name the provider
+doesn't offer only failed once a message was sent. start() does that work on a
+background thread instead: it imports the SDK, opens a keep-alive connection
+to every configured provider and loads each provider's model catalog, then
+checks the default model against it. web.py reports progress at /ready;
+chat.py's /model and web.py's /model check names against the catalog.
+
+Catalogs come from GET /models and are cached on disk, so restarts and other
+workers reuse them until they expire. A name the catalog doesn't list is
+rejected; while no catalog can be loaded every name is accepted, as before.
+
+	WARMUP              "0" to skip warm-up (default on)
+	WARMUP_TIMEOUT      seconds allowed for each warm-up request (default 10)
+	MODEL_CATALOG_PATH  JSON file catalogs are cached in (default model_catalog.json; "" keeps them in memory)
+	MODEL_CATALOG_TTL   seconds a cached catalog is trusted (default 21600)
+"""
+import asyncio
+import difflib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, FrozenSet, List, Optional
+
+from clients import get_async_client, get_client
+from providers import Provider, default_settings
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("WARMUP", "1") != "0"
+TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+# After a failed listing, names are accepted unchecked for this long before asking again
+RETRY_AFTER = 60.0
+
+
+class ModelCatalog:
+	"""Model ids offered by each provider, keyed by base URL."""
+
+	def __init__(self, path: Optional[str] = None, ttl: float = 21600.0) -> None:
+		self.path = path
+		self.ttl = ttl
+		self._entries: Dict[str, Dict[str, Any]] = self._read()
+		self._failed: Dict[str, float] = {}
+		self._lock = threading.Lock()
+
+	def _read(self) -> Dict[str, Dict[str, Any]]:
+		if not self.path or not os.path.exists(self.path):
+			return {}
+		try:
+			with open(self.path, encoding="utf-8") as fh:
+				data = json.load(fh)
+		except (OSError, ValueError) as exc:
+			logger.warning("model catalog: could not read %s: %s", self.path, exc)
+			return {}
+		return data if isinstance(data, dict) else {}
+
+	def _write(self, key: str, entry: Dict[str, Any]) -> None:
+		if not self.path:
+			return
+		# Other workers write the same file; keep their entries
+		data = self._read()
+		data[key] = entry
+		tmp = f"{self.path}.{os.getpid()}.tmp"
+		try:
+			with open(tmp, "w", encoding="utf-8") as fh:
+				json.dump(data, fh)
+			os.replace(tmp, self.path)
+		except OSError as exc:
+			logger.warning("model catalog: could not save %s: %s", self.path, exc)
+
+	def fetch(self, provider: Provider) -> List[str]:
+		page = get_client(provider.api_key, provider.base_url).with_options(timeout=TIMEOUT).models.list()
+		return sorted(model.id for model in page.data)
+
+	def models(self, provider: Provider, refresh: bool = False) -> Optional[FrozenSet[str]]:
+		"""The provider's model ids, fetched when missing or expired; None if there is no catalog."""
+		key = provider.base_url.rstrip("/")
+		with self._lock:
+			entry = self._entries.get(key)
+			failed = self._failed.get(key)
+		if entry is not None and not refresh and time.time() - entry["fetched"] < self.ttl:
+			return frozenset(entry["models"])
+		# An expired catalog is better than none
+		stale = frozenset(entry["models"]) if entry is not None else None
+		if failed is not None and not refresh and time.time() - failed < RETRY_AFTER:
+			return stale
+		try:
+			ids = self.fetch(provider)
+		except Exception as exc:
+			logger.warning("model catalog: could not list %s models: %s", provider.name, exc)
+			with self._lock:
+				self._failed[key] = time.time()
+			return stale
+		entry = {"fetched": time.time(), "models": ids}
+		with self._lock:
+			self._entries[key] = entry
+		self._write(key, entry)
+		return frozenset(ids)
+
+	def check(self, provider: Provider, model: str) -> Optional[str]:
+		"""Why `provider` can't serve `model`, or None if it can (or nobody knows)."""
+		ids = self.models(provider)
+		# OpenRouter variants such as ":nitro" aren't listed separately
+		if ids is None or model in ids or model.split(":", 1)[0] in ids:
+			return None
+		close = difflib.get_close_matches(model, ids, n=3)
+		hint = f" Did you mean {', '.join(close)}?" if close else ""
+		return f"{provider.name} does not offer a model named {model}.{hint}"
+
+
+_catalog: Optional[ModelCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def model_catalog() -> ModelCatalog:
+	global _catalog
+	with _catalog_lock:
+		if _catalog is None:
+			_catalog = ModelCatalog(
+				path=os.getenv("MODEL_CATALOG_PATH", "model_catalog.json") or None,
+				ttl=float(os.getenv("MODEL_CATALOG_TTL", "21600")),
+			)
+		return _catalog
+
+
+def check_model(router: Any, model: str) -> Optional[str]:
+	"""Why `model` can't be used with `router`, or None; only the first provider gets the chosen model."""
+	if not router.providers:
+		return None
+	return model_catalog().check(router.providers[0], model)
+
+
+def preload() -> None:
+	"""Import the SDK without opening anything, so forked workers share the loaded modules."""
+	from openai.resources import models  # noqa: F401
+	from openai.resources.chat import completions  # noqa: F401
+
+
+class WarmUp:
+	"""This process's warm-up, as reported by /ready."""
+
+	def __init__(self) -> None:
+		self.started: Optional[float] = None
+		self.finished: Optional[float] = None
+		self.model = ""
+		self.model_error: Optional[str] = None
+		self.providers: Dict[str, Dict[str, Any]] = {}
+		self.task: Optional["asyncio.Task[None]"] = None
+		self._lock = threading.Lock()
+
+	@property
+	def ready(self) -> bool:
+		return not ENABLED or self.finished is not None
+
+	def claim(self) -> bool:
+		# True for the first caller only
+		with self._lock:
+			if self.started is not None:
+				return False
+			self.started = time.time()
+			return True
+
+	def record(self, provider: Provider, **fields: Any) -> None:
+		with self._lock:
+			self.providers.setdefault(provider.name, {}).update(fields)
+
+	def snapshot(self) -> Dict[str, Any]:
+		with self._lock:
+			return {
+				"ready": self.ready,
+				"pid": os.getpid(),
+				"seconds": round((self.finished or time.time()) - self.started, 3) if self.started else None,
+				"model": self.model,
+				"model_error": self.model_error,
+				"providers": {name: dict(fields) for name, fields in self.providers.items()},
+			}
+
+	def preconnect(self, provider: Provider) -> None:
+		from openai import APIStatusError
+
+		started = time.perf_counter()
+		client = get_client(provider.api_key, provider.base_url).with_options(timeout=TIMEOUT)
+		try:
+			# Any HTTP answer, even a 404, leaves a warm keep-alive connection in the pool
+			client.models.retrieve(provider.models[0] if provider.models else "-")
+		except APIStatusError:
+			pass
+		except Exception as exc:
+			self.record(provider, connected=False, error=str(exc))
+			return
+		self.record(provider, connected=True, connect_ms=round((time.perf_counter() - started) * 1000, 1))
+
+	async def apreconnect(self, provider: Provider) -> None:
+		from openai import APIStatusError
+
+		started = time.perf_counter()
+		client = get_async_client(provider.api_key, provider.base_url).with_options(timeout=TIMEOUT)
+		try:
+			await client.models.retrieve(provider.models[0] if provider.models else "-")
+		except APIStatusError:
+			pass
+		except Exception as exc:
+			self.record(provider, connected=False, error=str(exc))
+			return
+		self.record(provider, connected=True, connect_ms=round((time.perf_counter() - started) * 1000, 1))
+
+	def load_catalogs(self, router: Any, model: str) -> None:
+		catalog = model_catalog()
+		for provider in router.providers:
+			models = catalog.models(provider)
+			self.record(provider, models=len(models) if models is not None else None)
+		self.model = model
+		self.model_error = check_model(router, model)
+		if self.model_error:
+			logger.warning("warm-up: %s", self.model_error)
+
+	def run(self, router: Any, model: str) -> None:
+		try:
+			router.warm()
+			for provider in router.providers:
+				self.preconnect(provider)
+			self.load_catalogs(router, model)
+		except Exception:
+			logger.exception("warm-up failed")
+		finally:
+			self.finished = time.time()
+
+	async def arun(self, router: Any, model: str) -> None:
+		try:
+			router.warm(asynchronous=True)
+			await asyncio.gather(*(self.apreconnect(provider) for provider in router.providers))
+			# Catalog requests and file writes are blocking
+			await asyncio.to_thread(self.load_catalogs, router, model)
+		except Exception:
+			logger.exception("warm-up failed")
+		finally:
+			self.finished = time.time()
+
+
+_state = WarmUp()
+
+
+def _reset() -> None:
+	global _state
+	# Each forked worker warms, and reports on, its own connections
+	_state = WarmUp()
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def _defaults(router: Any, model: Optional[str]) -> Any:
+	if router is None:
+		from router import default_router
+
+		router = default_router()
+	return router, model or default_settings()[2]
+
+
+def start(router: Any = None, model: Optional[str] = None) -> None:
+	"""Warm up on a background thread, once per process."""
+	if not ENABLED or not _state.claim():
+		return
+	router, model = _defaults(router, model)
+	threading.Thread(target=_state.run, args=(router, model), name="warm-up", daemon=True).start()
+
+
+def astart(router: Any = None, model: Optional[str] = None) -> None:
+	"""Warm up the async clients as a task on the running event loop, once per process."""
+	if not ENABLED or not _state.claim():
+		return
+	router, model = _defaults(router, model)
+	task = asyncio.get_running_loop().create_task(_state.arun(router, model))
+	# Keep a reference so the task isn't garbage collected half-way
+	_state.task = task
+
+
+def run(router: Any = None, model: Optional[str] = None) -> None:
+	"""Warm up on the calling thread, e.g. chat.py's own background thread."""
+	if not ENABLED or not _state.claim():
+		return
+	_state.run(*_defaults(router, model))
+
+
+def status() -> Dict[str, Any]:
+	return _state.snapshot()
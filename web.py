@@ -1,12 +1,31 @@
+import json
 import os
-from typing import List, Dict
+import time
+from datetime import datetime
+from typing import List, Dict, Iterator, MutableMapping, Optional, Tuple
 
-from flask import Flask, render_template_string, request, session, jsonify, redirect, url_for
+from flask import Flask, Response, abort, g, request, session, jsonify, redirect, url_for
 from dotenv import load_dotenv
-from openai import OpenAI
+from markupsafe import Markup
+
+import completions
+import warmup
+from assets import CACHE_CONTROL, Asset, AssetRegistry, build_asset
+from cache import shared_cache
+from cancel import Cancelled, CancelScope, cancel_scope, watch_disconnect
+from context import ContextStats, ContextWindow
+from metrics import REGISTRY
+from providers import default_settings
+from ratelimit import as_user, snapshot as rate_limit_snapshot
+from render import IncrementalRenderer, clean_urls, highlight_css, render_markdown
+from router import default_router
+from semantic import shared_semantic_cache
+from shared import is_shared, shared_state
+from store import as_api_messages, create_store
 
 load_dotenv()
-app = Flask(__name__)
+# static/ is served fingerprinted from /assets (see assets.py)
+app = Flask(__name__, static_folder=None)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-key")
 # Session defaults
 app.config["PERMANENT_SESSION_LIFETIME"] = 60 * 60 * 24 * 30
@@ -18,23 +37,7 @@ LOCK_PASSWORD = os.getenv("LOCK_PASSWORD", "230111009115")
 LOCK_ON_RELOAD = os.getenv("LOCK_ON_RELOAD", "1")  # "1" => show lock every reload
 LOCK_PERSIST = os.getenv("LOCK_PERSIST", "0")      # "1" => remember unlock in cookie session
 
-API_KEY = (
-	os.getenv("OPENROUTER_API_KEY")
-	or os.getenv("DEEPSEEK_API_KEY")
-	or os.getenv("OPENAI_API_KEY")
-	or ""
-).strip()
-BASE_URL = (
-	os.getenv("OPENROUTER_BASE_URL")
-	or os.getenv("DEEPSEEK_BASE_URL")
-	or "https://openrouter.ai/api/v1"
-).strip()
-DEFAULT_MODEL = (
-	os.getenv("OPENROUTER_MODEL")
-	or os.getenv("DEEPSEEK_MODEL")
-	or os.getenv("OPENAI_MODEL")
-	or "nousresearch/deephermes-3-llama-3-8b-preview:free"
-)
+API_KEY, BASE_URL, DEFAULT_MODEL = default_settings()
 REFERER = os.getenv("OPENROUTER_SITE_URL", "").strip()
 TITLE = os.getenv("OPENROUTER_SITE_NAME", "").strip()
 EXTRA_HEADERS: Dict[str, str] = {}
@@ -43,7 +46,20 @@ if REFERER:
 if TITLE:
 	EXTRA_HEADERS["X-Title"] = TITLE
 
-client = OpenAI(api_key=API_KEY, base_url=BASE_URL) if API_KEY else None
+# Fails over across every configured provider (see router.py)
+router = default_router()
+
+SYSTEM_PROMPT = "You are a helpful, concise assistant."
+
+# Conversation history lives server-side; the cookie only holds its id
+store = create_store()
+# Trims old turns so prompt size stays within the per-model token budget
+context_window = ContextWindow.from_env()
+# /chat renders the newest page; older pages come from /history as the user scrolls
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "30"))
+HISTORY_MAX_PAGE = 200
+# Stored for a reply stopped before its first token, so user/assistant turns stay paired
+STOPPED_REPLY = "[stopped]"
 
 LANDING_TEMPLATE = """
 <!doctype html>
@@ -52,28 +68,7 @@ LANDING_TEMPLATE = """
 	<meta charset=\"utf-8\">
 	<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
 	<title>potato.ai • Welcome</title>
-	<style>
-		:root { --bg1:#1b140d; --bg2:#0f0b07; --text:#f6efe7; --muted:#d1b89a; --edge:#2b1e12; --accent:#b7832f; --accent2:#d4a052; }
-		html, body { height:100%; }
-		body { margin:0; background: radial-gradient(1200px 600px at 80% -10%, #d4a05222, transparent), linear-gradient(140deg, var(--bg1), var(--bg2)); color:var(--text); font-family: Inter, ui-sans-serif, system-ui, -apple-system, Segoe UI, Roboto, Arial; }
-		.hero { min-height:100%; display:grid; grid-template-rows: auto 1fr auto; }
-		.nav { display:flex; align-items:center; justify-content:space-between; padding:16px 22px; border-bottom:1px solid var(--edge); }
-		.brand { display:flex; align-items:center; gap:10px; font-weight:700; letter-spacing:.35px; }
-		.logo { width:28px; height:28px; border-radius:7px; display:grid; place-items:center; background: radial-gradient(circle at 35% 30%, #e6b76a, #b27b34 60%, #885a1f); box-shadow: 0 10px 30px #b27b3433; }
-		.cta { display:flex; gap:10px; }
-		.cta a { text-decoration:none; color:var(--text); border:1px solid var(--edge); padding:8px 12px; border-radius:10px; }
-		.main { display:grid; place-items:center; text-align:center; padding: 44px 20px; }
-		.h1 { font-size: clamp(28px, 6vw, 48px); line-height:1.1; font-weight:900; margin:0; letter-spacing:.3px; }
-		.sub { margin-top:12px; color:var(--muted); max-width:860px; }
-		.grid { margin-top:28px; display:grid; grid-template-columns: repeat(auto-fit, minmax(220px, 1fr)); gap:14px; max-width:1000px; width:100%; }
-		.card { background:#21170e; border:1px solid var(--edge); border-radius:16px; padding:14px; text-align:left; }
-		.card h3 { margin:0 0 6px 0; font-size:15px; }
-		.card p { margin:0; color:var(--muted); font-size:13px; }
-		.actions { margin-top:30px; display:flex; gap:12px; justify-content:center; }
-		.btn { background: linear-gradient(180deg, var(--accent2), var(--accent)); color:white; border:0; padding: 12px 16px; border-radius: 12px; cursor:pointer; font-weight:800; box-shadow: 0 10px 24px #d4a05233; text-decoration:none; }
-		.btn.secondary { background: transparent; border:1px solid var(--edge); color:var(--text); }
-		.footer { padding:14px 22px; border-top:1px solid var(--edge); color:var(--muted); font-size:12px; }
-	</style>
+	<link rel=\"stylesheet\" href=\"{{ asset_url('landing.css') }}\">
 </head>
 <body>
 	<div class=\"hero\">
@@ -108,80 +103,33 @@ CHAT_TEMPLATE = """
 	<meta charset=\"utf-8\">
 	<meta name=\"viewport\" content=\"width=device-width, initial-scale=1\" />
 	<title>potato.ai</title>
-	<link rel=\"stylesheet\" href=\"https://cdn.jsdelivr.net/npm/highlight.js@11.9.0/styles/github-dark.min.css\">
-	<style>
-		:root {
-			--bg1:#1b140d; --bg2:#0f0b07; --card:#241a11; --edge:#362617;
-			--text:#f6efe7; --muted:#d1b89a; --accent:#b7832f; --accent2:#d4a052;
-		}
-		html, body { height: 100%; }
-		body {
-			margin: 0; color: var(--text);
-			font-family: Inter, ui-sans-serif, system-ui, -apple-system, Segoe UI, Roboto, Arial;
-			background:
-				radial-gradient(1000px 500px at 80% -10%, #d4a05222, transparent),
-				linear-gradient(140deg, var(--bg1), var(--bg2));
-		}
-		.app { display:flex; flex-direction:column; height:100%; }
-		.header { padding: 14px 18px; position: sticky; top:0; backdrop-filter: blur(8px); background: #160f09cc; border-bottom:1px solid #2b1e12; display:flex; align-items:center; gap:10px; }
-		.logo { width:28px; height:28px; border-radius:7px; display:grid; place-items:center; background: radial-gradient(circle at 35% 30%, #e6b76a, #b27b34 60%, #885a1f); box-shadow: 0 10px 30px #b27b3433; font-size:16px; }
-		.title { font-size: 14px; color:#f4dfc7; letter-spacing: .35px; font-weight:600; }
-		.watermark { margin-left:auto; font-size:12px; color: var(--muted); opacity:.7; }
-		.chat { flex:1; overflow-y:auto; padding: 18px; scroll-behavior:smooth; }
-		.card { background: var(--card); border:1px solid var(--edge); border-radius: 14px; padding: 12px 14px; margin: 8px 0; max-width: 85%; animation: fadeIn .3s ease-out; }
-		.card :is(p, ul, ol, pre, code) { white-space: pre-wrap; word-wrap: break-word; }
-		.card pre { position: relative; padding-top: 34px; }
-		.copy-btn { position:absolute; top:8px; right:8px; background:#5b4228; color:#f6efe7; border:1px solid #714f2c; border-radius:8px; padding:6px 8px; font-size:12px; cursor:pointer; }
-		.copy-btn:active { transform: translateY(1px); }
-		@keyframes fadeIn { from { opacity:0; transform: translateY(6px);} to { opacity:1; transform: translateY(0);} }
-		.row { display:flex; gap:10px; align-items:flex-start; }
-		.msg-user { margin-left:auto; background: #2a1f12; border-color:#3a2a17; box-shadow: 0 8px 24px #b27b3414; }
-		.msg-assistant { margin-right:auto; background: #21170e; border-color:#2e1f13; box-shadow: 0 8px 24px #00000022; }
-		.footer { position: sticky; bottom:0; padding: 12px 18px; background:#160f09cc; backdrop-filter: blur(8px); border-top:1px solid #2b1e12; }
-		.input { display:flex; gap:10px; }
-		input[type=text] { flex:1; padding: 12px 14px; border-radius: 12px; border:1px solid var(--edge); background:#1a120b; color: var(--text); outline:none; transition: border .2s, box-shadow .2s; }
-		input[type=text]:focus { border-color:var(--accent2); box-shadow: 0 0 0 4px #d4a05222; }
-		button { background: linear-gradient(180deg, var(--accent2), var(--accent)); color:white; border:0; padding: 12px 16px; border-radius: 12px; cursor:pointer; font-weight:700; box-shadow: 0 10px 24px #d4a05233; transition: transform .06s ease; }
-		button:active { transform: translateY(1px); }
-		.typing { display:inline-flex; gap:4px; align-items:center; padding:6px 8px; }
-		.dot { width:6px; height:6px; border-radius:50%; background:#d4a052; opacity:.6; animation: bounce 1s infinite ease-in-out; }
-		.dot:nth-child(2){ animation-delay:.15s } .dot:nth-child(3){ animation-delay:.3s }
-		@keyframes bounce{ 0%,80%,100%{ transform: translateY(0); opacity:.35} 40%{ transform: translateY(-5px); opacity:.9} }
-		a { color:#d4a052; }
-
-		/* Lock screen */
-		.lock { position: fixed; inset: 0; background: #0b0b0fb3; backdrop-filter: blur(6px); display: {{ 'none' if unlocked else 'grid' }}; place-items: center; z-index: 50; }
-		.lock-card { width: 92%; max-width: 380px; background: #1c140d; border:1px solid #362617; border-radius: 16px; padding: 18px; box-shadow: 0 20px 50px #00000055; }
-		.lock-title { font-weight: 700; letter-spacing:.3px; margin-bottom: 10px; color:#f4dfc7; }
-		.lock-input { width: 100%; padding: 12px 14px; border-radius: 12px; border:1px solid #3a2a17; background:#140e0a; color: #f6efe7; outline:none; }
-		.lock-input:focus { border-color:#d4a052; box-shadow: 0 0 0 4px #d4a05222; }
-		.lock-btn { margin-top: 10px; width: 100%; padding: 12px 16px; border-radius: 12px; border:0; background: linear-gradient(180deg, var(--accent2), var(--accent)); color:white; font-weight:700; cursor:pointer; }
-		.lock-msg { margin-top: 8px; color:#d1b89a; font-size:12px; min-height: 18px; }
-	</style>
+	<link rel=\"stylesheet\" href=\"{{ asset_url('highlight.css') }}\">
+	<link rel=\"stylesheet\" href=\"{{ asset_url('chat.css') }}\">
 </head>
 <body>
 	<div class=\"app\" aria-hidden=\"{{ 'true' if not unlocked else 'false' }}\">
 		<div class=\"header\">
 			<div class=\"logo\">🥔</div>
 			<div class=\"title\">potato.ai</div>
-			<div class=\"watermark\">potato.ai • Model: {{ (session.get('model') or default_model) }}</div>
+			<div class=\"watermark\">potato.ai • Model: {{ (model or default_model) }}</div>
 		</div>
-		<div id=\"chat\" class=\"chat\">
+		<div id=\"chat\" class=\"chat\" data-has-more=\"{{ '1' if has_more else '0' }}\">
 			{% for m in messages %}
-				<div class=\"row\">
-					<div class=\"card {{ 'msg-user' if m.role=='user' else 'msg-assistant' }}\"><div class=\"md\" data-role=\"{{ m.role }}\">{{ m.content }}</div></div>
+				<div class=\"row\" data-id=\"{{ m.id }}\">
+					<div class=\"card {{ 'msg-user' if m.role=='user' else 'msg-assistant' }}\"><div class=\"md\" data-role=\"{{ m.role }}\">{% if m.html %}{{ m.html|safe }}{% else %}{{ m.content|markdown }}{% endif %}</div></div>
 				</div>
 			{% endfor %}
 		</div>
 		<div class=\"footer\">
 			<form id=\"send-form\" class=\"input\" autocomplete=\"off\">
 				<input id=\"prompt\" type=\"text\" placeholder=\"Ask anything...\" />
-				<button type=\"submit\">Send</button>
+				<button id=\"send\" type=\"submit\">Send</button>
+				<button id=\"stop\" class=\"stop\" type=\"button\" hidden>Stop</button>
 			</form>
 		</div>
 	</div>
 
-	<div class=\"lock\" id=\"lock\">
+	<div class=\"lock\" id=\"lock\" style=\"display: {{ 'none' if unlocked else 'grid' }}\">
 		<div class=\"lock-card\">
 			<div class=\"lock-title\">Enter Passcode</div>
 			<input id=\"lock-input\" class=\"lock-input\" type=\"password\" placeholder=\"Password\" autofocus />
@@ -190,121 +138,50 @@ CHAT_TEMPLATE = """
 		</div>
 	</div>
 
-	<script src=\"https://cdn.jsdelivr.net/npm/marked/marked.min.js\"></script>
-	<script src=\"https://cdn.jsdelivr.net/npm/highlight.js@11.9.0/lib/common.min.js\"></script>
-	<script>
-		const chat = document.getElementById('chat');
-		const form = document.getElementById('send-form');
-		const promptInput = document.getElementById('prompt');
-
-		function enhanceCodeBlocks(container){
-			container.querySelectorAll('pre code').forEach((code)=>{
-				const pre = code.parentElement;
-				const btn = document.createElement('button');
-				btn.className = 'copy-btn';
-				btn.type = 'button';
-				btn.textContent = 'Copy';
-				btn.addEventListener('click', async ()=>{
-					try{ await navigator.clipboard.writeText(code.textContent); btn.textContent='Copied'; setTimeout(()=>btn.textContent='Copy', 1200);}catch(e){ btn.textContent='Failed'; setTimeout(()=>btn.textContent='Copy', 1200);} 
-				});
-				pre.style.position = 'relative';
-				pre.prepend(btn);
-			});
-		}
-
-		function renderMarkdown(text){
-			const html = marked.parse(text, { breaks:true });
-			const wrapper = document.createElement('div');
-			wrapper.innerHTML = html;
-			wrapper.querySelectorAll('pre code').forEach((block)=>{ try{ hljs.highlightElement(block);}catch(e){} });
-			enhanceCodeBlocks(wrapper);
-			return wrapper.innerHTML;
-		}
-
-		function addMessage(role, content){
-			const row = document.createElement('div');
-			row.className = 'row';
-			const card = document.createElement('div');
-			card.className = 'card ' + (role === 'user' ? 'msg-user' : 'msg-assistant');
-			const md = document.createElement('div');
-			md.className = 'md';
-			md.innerHTML = renderMarkdown(content);
-			card.appendChild(md);
-			row.appendChild(card);
-			chat.appendChild(row);
-			chat.scrollTop = chat.scrollHeight;
-		}
-
-		function addTyping(){
-			const row = document.createElement('div');
-			row.className = 'row';
-			row.id = 'typing-row';
-			const card = document.createElement('div');
-			card.className = 'card msg-assistant';
-			card.innerHTML = '<div class="typing"><span class="dot"></span><span class="dot"></span><span class="dot"></span></div>';
-			row.appendChild(card);
-			chat.appendChild(row);
-			chat.scrollTop = chat.scrollHeight;
-		}
-
-		function removeTyping(){
-			const t = document.getElementById('typing-row');
-			if(t){ t.remove(); }
-		}
-
-		// Render any existing messages (server-rendered content is plain text)
-		document.querySelectorAll('.md').forEach((el)=>{ el.innerHTML = renderMarkdown(el.textContent); });
-
-		form.addEventListener('submit', async (e)=>{
-			e.preventDefault();
-			const text = promptInput.value.trim();
-			if(!text) return;
-			addMessage('user', text);
-			promptInput.value = '';
-			addTyping();
-			try{
-				const res = await fetch('/send_json', { method:'POST', headers:{ 'Content-Type':'application/json' }, body: JSON.stringify({ prompt: text }) });
-				const data = await res.json();
-				removeTyping();
-				addMessage('assistant', data.assistant || '[no response]');
-			}catch(err){
-				removeTyping();
-				addMessage('assistant', '[error] ' + err);
-			}
-		});
-
-		// Lock handling
-		const lockEl = document.getElementById('lock');
-		const lockInput = document.getElementById('lock-input');
-		const lockBtn = document.getElementById('lock-btn');
-		const lockMsg = document.getElementById('lock-msg');
-		async function tryUnlock(){
-			const pw = (lockInput.value||'').trim();
-			if(!pw) return;
-			lockBtn.disabled = true;
-			lockMsg.textContent = 'Checking...';
-			try{
-				const r = await fetch('/unlock', { method:'POST', headers:{ 'Content-Type':'application/json' }, body: JSON.stringify({ password: pw }) });
-				const j = await r.json();
-				if(j.ok){ lockEl.style.display='none'; }
-				else { lockMsg.textContent = 'Incorrect password'; }
-			} catch(e){ lockMsg.textContent = 'Error'; }
-			lockBtn.disabled = false;
-		}
-		lockBtn.addEventListener('click', (e)=>{ e.preventDefault(); tryUnlock(); });
-		lockInput.addEventListener('keydown', (e)=>{ if(e.key==='Enter'){ e.preventDefault(); tryUnlock(); } });
-	</script>
+	<script src=\"{{ asset_url('chat.js') }}\"></script>
 </body>
 </html>
 """
 
 
-def ensure_messages() -> List[Dict[str, str]]:
-	if "messages" not in session:
-		session["messages"] = [
-			{"role": "system", "content": "You are a helpful, concise assistant."}
-		]
-	return session["messages"]
+assets = AssetRegistry()
+assets.add(build_asset("highlight.css", highlight_css().encode("utf-8")))
+app.jinja_env.globals["asset_url"] = assets.url
+# Only for rows stored before HTML was cached with the message
+app.jinja_env.filters["markdown"] = lambda text: Markup(render_markdown(text))
+# Compiled once at import instead of on every request
+LANDING = app.jinja_env.from_string(LANDING_TEMPLATE)
+CHAT = app.jinja_env.from_string(CHAT_TEMPLATE)
+landing_pages: Dict[int, Asset] = {}
+
+
+def ensure_conversation(sess: MutableMapping = session) -> str:
+	conversation_id = sess.get("conversation_id")
+	if conversation_id and store.exists(conversation_id):
+		return conversation_id
+	conversation_id = store.create()
+	legacy = sess.pop("messages", None) or [{"role": "system", "content": SYSTEM_PROMPT}]
+	for m in legacy:
+		store.append(conversation_id, m["role"], m["content"], render_markdown(m["content"]))
+	sess["conversation_id"] = conversation_id
+	return conversation_id
+
+
+def prompt_messages(conversation_id: str, model: str) -> Tuple[List[Dict[str, str]], ContextStats]:
+	# Reads the newest pages the budget needs, without their HTML, rather than the whole conversation
+	kept, stats = context_window.fit_tail(
+		store.head(conversation_id, 4),
+		lambda limit, before: store.load(conversation_id, limit, before, html=False),
+		store.count(conversation_id),
+		model,
+	)
+	return as_api_messages(kept), stats
+
+
+def history_page(conversation_id: str, limit: int, before: Optional[int] = None) -> Tuple[List[Dict[str, object]], bool]:
+	# One extra row tells us whether anything older is left
+	page = [{**m, "html": m["html"] and clean_urls(m["html"])} for m in store.load(conversation_id, limit + 1, before)]
+	return page[-limit:], len(page) > limit
 
 
 def get_headers() -> Dict[str, str]:
@@ -316,50 +193,250 @@ def get_headers() -> Dict[str, str]:
 	return headers
 
 
+def serve_asset(asset: Asset, cache_control: str) -> Response:
+	body, encoding = asset.body(request.headers.get("Accept-Encoding", ""))
+	response = Response(body, mimetype=asset.mimetype)
+	if encoding:
+		response.headers["Content-Encoding"] = encoding
+	response.headers["Cache-Control"] = cache_control
+	response.vary.add("Accept-Encoding")
+	response.set_etag(asset.etag_for(encoding))
+	return response.make_conditional(request)
+
+
+@app.route("/assets/<path:path>", methods=["GET"])
+def asset(path: str):
+	found = assets.lookup(path)
+	if found is None:
+		abort(404)
+	return serve_asset(found, CACHE_CONTROL)
+
+
 @app.route("/", methods=["GET"])
 def landing():
-	return render_template_string(LANDING_TEMPLATE, year=__import__('datetime').datetime.now().year, default_model=DEFAULT_MODEL)
+	# Identical for every visitor: render once per year, revalidate with ETag
+	year = datetime.now().year
+	page = landing_pages.get(year)
+	if page is None:
+		html = LANDING.render(year=year, default_model=DEFAULT_MODEL)
+		page = landing_pages[year] = build_asset("landing.html", html.encode("utf-8"), "text/html; charset=utf-8")
+	return serve_asset(page, "no-cache")
 
 
 @app.route("/chat", methods=["GET"])
 def chat_page():
-	messages = ensure_messages()
+	messages, has_more = history_page(ensure_conversation(), HISTORY_PAGE_SIZE)
 	# If LOCK_ON_RELOAD is enabled (default), force lock on each load
 	if LOCK_ON_RELOAD == "1":
 		session["unlocked"] = False
-	return render_template_string(
-		CHAT_TEMPLATE,
+	return CHAT.render(
 		messages=messages,
+		has_more=has_more,
 		default_model=DEFAULT_MODEL,
+		model=session.get("model"),
 		unlocked=session.get("unlocked", False),
 	)
 
 
+@app.route("/history", methods=["GET"])
+def history():
+	# Cursor-paginated, newest first: pass the returned "next" back as ?before=
+	if not session.get("unlocked", False):
+		return jsonify({"messages": [], "next": None}), 403
+	limit = min(max(request.args.get("limit", HISTORY_PAGE_SIZE, type=int), 1), HISTORY_MAX_PAGE)
+	page, has_more = history_page(ensure_conversation(), limit, request.args.get("before", type=int))
+	messages = [
+		{"id": m["id"], "role": m["role"], "html": m["html"] or render_markdown(m["content"])}
+		for m in reversed(page)
+	]
+	return jsonify({"messages": messages, "next": page[0]["id"] if has_more else None})
+
+
 @app.route("/send_json", methods=["POST"])
 def send_json():
 	if not session.get("unlocked", False):
 		return jsonify({"assistant": "[locked] Please unlock to chat"})
-	if not client:
+	if not router.providers:
 		return jsonify({"assistant": "[error] Missing API key on server"})
 	payload = request.get_json(silent=True) or {}
 	prompt = (payload.get("prompt") or "").strip()
 	if not prompt:
 		return jsonify({"assistant": ""})
-	messages = ensure_messages()
-	messages.append({"role": "user", "content": prompt})
+	conversation_id = ensure_conversation()
+	user_html = render_markdown(prompt)
+	store.append(conversation_id, "user", prompt, user_html)
+	model = session.get("model") or DEFAULT_MODEL
+	outgoing, context_stats = prompt_messages(conversation_id, model)
+	pieces: List[str] = []
+	scope = CancelScope()
 	try:
-		resp = client.chat.completions.create(
-			model=session.get("model") or DEFAULT_MODEL,
-			messages=messages,
-			stream=False,
-			**({"extra_headers": get_headers()} if get_headers() else {}),
-		)
-		assistant_text = resp.choices[0].message.content or ""
+		# Streamed and joined rather than one blocking call, so a client that
+		# goes away closes the upstream mid-answer
+		with as_user(conversation_id), cancel_scope(scope), watch_disconnect(request.environ, scope):
+			for content_piece in completions.stream(router, model, outgoing, get_headers()):
+				pieces.append(content_piece)
+		assistant_text = "".join(pieces)
+	except Cancelled:
+		assistant_text = "".join(pieces) or STOPPED_REPLY
 	except Exception as exc:
 		assistant_text = f"[error] {exc}"
-	messages.append({"role": "assistant", "content": assistant_text})
-	session["messages"] = messages
-	return jsonify({"assistant": assistant_text})
+	html = render_markdown(assistant_text)
+	store.append(conversation_id, "assistant", assistant_text, html)
+	return jsonify({"assistant": assistant_text, "html": html, "user_html": user_html, "context": context_stats.as_dict()})
+
+
+def ndjson(event: Dict[str, object]) -> str:
+	return json.dumps(event) + "\n"
+
+
+@app.route("/send_stream", methods=["POST"])
+def send_stream():
+	# Same contract as /send_json, but relays deltas as newline-delimited JSON
+	# so the first token reaches the browser as soon as the model emits it.
+	if not session.get("unlocked", False):
+		return Response(ndjson({"error": "[locked] Please unlock to chat"}), mimetype="application/x-ndjson")
+	if not router.providers:
+		return Response(ndjson({"error": "[error] Missing API key on server"}), mimetype="application/x-ndjson")
+	payload = request.get_json(silent=True) or {}
+	prompt = (payload.get("prompt") or "").strip()
+	if not prompt:
+		return Response("", mimetype="application/x-ndjson")
+	conversation_id = ensure_conversation()
+	model = session.get("model") or DEFAULT_MODEL
+	headers = get_headers()
+	# The request context is gone by the time the body is generated
+	environ = request.environ
+
+	def generate() -> Iterator[str]:
+		# The user turn is stored here, right before the try whose finally stores the reply:
+		# a client gone before the body starts closes the generator unstarted, and neither is kept
+		user_html = render_markdown(prompt)
+		store.append(conversation_id, "user", prompt, user_html)
+		renderer = IncrementalRenderer()
+		# The Stop button aborts the fetch; either way the client hangs up and the watcher cancels
+		scope = CancelScope()
+		stopped = True
+		try:
+			outgoing, context_stats = prompt_messages(conversation_id, model)
+			yield ndjson({"context": context_stats.as_dict(), "user_html": user_html})
+			with as_user(conversation_id), cancel_scope(scope), watch_disconnect(environ, scope):
+				for content_piece in completions.stream(router, model, outgoing, headers):
+					yield ndjson({"delta": content_piece, **renderer.feed(content_piece)})
+			stopped = False
+		except Cancelled:
+			pass
+		except Exception as exc:
+			stopped = False
+			error = f"[error] {exc}"
+			yield ndjson({"error": error, **renderer.feed(("\n" if renderer.text else "") + error)})
+		finally:
+			# Also reached when the server closes the response after a failed write;
+			# the partial answer is kept either way
+			text = renderer.text or (STOPPED_REPLY if stopped else "")
+			store.append(conversation_id, "assistant", text, render_markdown(text))
+		yield ndjson(renderer.finish())
+		yield ndjson({"done": True})
+
+	return Response(
+		generate(),
+		mimetype="application/x-ndjson",
+		headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+	)
+
+
+def collect_app_metrics() -> List[Tuple[str, str, str, List[Tuple[Dict[str, str], float]]]]:
+	families = [
+		("chat_context_tokens_total", "counter", "Prompt tokens before/after context trimming", [
+			({"stage": "before"}, float(context_window.total_before)),
+			({"stage": "after"}, float(context_window.total_after)),
+		]),
+		("chat_endpoint_error_rate", "gauge", "Rolling upstream error rate per endpoint", [
+			({"endpoint": name}, float(stats["error_rate"])) for name, stats in router.snapshot().items()
+		]),
+	]
+	limiters = rate_limit_snapshot()
+	families.append(("chat_rate_limit_rps", "gauge", "Current adaptive request rate per provider", [
+		({"provider": name}, float(state["rate"])) for name, state in limiters.items()
+	]))
+	families.append(("chat_rate_limit_queued", "gauge", "Requests waiting for a rate-limit slot", [
+		({"provider": name}, float(state["queued"])) for name, state in limiters.items()
+	]))
+	cache = shared_cache()
+	if cache:
+		families.append(("chat_cache_events_total", "counter", "Completion cache hits, misses and evictions", [
+			({"event": name}, float(value)) for name, value in cache.stats().items() if name != "size"
+		]))
+		families.append(("chat_cache_entries", "gauge", "Entries in the in-process cache tier", [({}, float(cache.stats()["size"]))]))
+	semantic = shared_semantic_cache()
+	if semantic:
+		stats = semantic.stats()
+		families.append(("chat_semantic_cache_entries", "gauge", "Live entries in the semantic cache index", [({}, float(stats["size"]))]))
+		families.append(("chat_semantic_cache_hit_ratio", "gauge", "Semantic cache hits per lookup since start", [({}, float(stats["hit_rate"]))]))
+	return families
+
+
+REGISTRY.register_collector(collect_app_metrics)
+if is_shared():
+	# Counters and histograms are summed over every worker; collector gauges stay per worker
+	REGISTRY.share(shared_state())
+# Time until the response is handed to the server (headers, for streamed routes)
+HTTP_LATENCY = REGISTRY.histogram("http_request_duration_seconds", "Flask handler time per route")
+
+
+@app.before_request
+def start_timer():
+	g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response: Response) -> Response:
+	started = g.get("request_started")
+	if started is not None:
+		rule = request.url_rule.rule if request.url_rule else "unmatched"
+		HTTP_LATENCY.observe(time.perf_counter() - started, route=rule, method=request.method, status=str(response.status_code))
+	return response
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+	return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache_stats", methods=["GET"])
+def cache_stats():
+	cache = shared_cache()
+	semantic = shared_semantic_cache()
+	return jsonify({
+		"enabled": cache is not None,
+		**(cache.stats() if cache else {}),
+		"semantic": {"enabled": semantic is not None, **(semantic.stats() if semantic else {})},
+	})
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+	# Servers that don't call warmup.start() themselves (flask run, tests) warm up on the first probe
+	warmup.start(router, DEFAULT_MODEL)
+	status = warmup.status()
+	return jsonify(status), 200 if status["ready"] else 503
+
+
+@app.route("/model", methods=["GET", "POST"])
+def model_setting():
+	if not session.get("unlocked", False):
+		return jsonify({"error": "locked"}), 403
+	if request.method == "POST":
+		payload = request.get_json(silent=True) or {}
+		name = (payload.get("model") or "").strip()
+		if name:
+			problem = warmup.check_model(router, name)
+			if problem:
+				return jsonify({"error": problem}), 400
+			session["model"] = name
+		else:
+			# An empty name goes back to the default
+			session.pop("model", None)
+	return jsonify({"model": session.get("model") or DEFAULT_MODEL, "default": DEFAULT_MODEL})
 
 
 @app.route("/unlock", methods=["POST"])
@@ -375,4 +452,5 @@ def unlock():
 
 
 if __name__ == "__main__":
+	warmup.start(router, DEFAULT_MODEL)
 	app.run(host="127.0.0.1", port=5000, debug=True)